@@ -0,0 +1,527 @@
+"""Offline benchmark suite for the Tube Snatch backend.
+
+Runs the real Flask app on a local threaded server with ``yt_dlp.YoutubeDL``
+swapped for a deterministic stand-in: channel URLs of the form
+``https://www.youtube.com/@bench<N>`` list N synthetic videos, and every
+video resolves to a single MP4 served by a local media server, so yt-dlp's
+own HTTP downloader does the transfers. Nothing touches the network.
+
+Measures /api/fetch-channel ingest time and peak memory vs. channel size,
+/api/videos and /api/search latency vs. library size, download throughput
+vs. worker count and file-serving throughput. Results are written as JSON; pass ``--compare`` with
+an earlier result file to print the change in every figure.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --compare bench.json
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import requests
+import yt_dlp
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_CHANNEL_RE = re.compile(r'/@bench(\d+)')
+WATCH_URL_RE = re.compile(r'[?&]v=([\w-]+)')
+MEDIA_PATH_RE = re.compile(r'^/media/([\w-]+)\.mp4$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+RealYoutubeDL = yt_dlp.YoutubeDL
+
+class FakeYoutubeDL(RealYoutubeDL):
+    """yt-dlp with extraction replaced by synthetic channels and videos.
+
+    Only ``extract_info`` is faked; format selection, the HTTP downloader,
+    progress hooks and post hooks are yt-dlp's own.
+    """
+    media_base_url = None
+    page_size = 100
+    page_latency = 0.0
+
+    def __init__(self, params=None, auto_init=True):
+        # Keep yt-dlp's console output off stdout, which may be carrying the JSON report
+        params = dict(params or {}, quiet=True, noprogress=True, no_warnings=True)
+        super().__init__(params, auto_init)
+
+    def extract_info(self, url, download=True, ie_key=None, extra_info=None, process=True, force_generic_extractor=False):
+        match = BENCH_CHANNEL_RE.search(url)
+        if match:
+            return self.fake_channel(int(match.group(1)))
+        match = WATCH_URL_RE.search(url)
+        if not match:
+            raise yt_dlp.utils.DownloadError(f'benchmark: no synthetic result for {url}')
+        info = self.fake_video(match.group(1))
+        return self.process_ie_result(info, download=download) if process else info
+
+    def fake_channel(self, size):
+        channel_id = f'UCbench{size}'
+        def entries():
+            for index in range(size):
+                # Paged like the real channel tab, so a cancelled walk stops paying for pages
+                if self.page_latency and index % self.page_size == 0:
+                    time.sleep(self.page_latency)
+                yield {
+                    '_type': 'url',
+                    'ie_key': 'Youtube',
+                    'id': f'b{size:04d}v{index:05d}'[-11:],
+                    'title': f'Benchmark video {index} of {size}',
+                    'duration': 60 + index % 3600,
+                }
+        return {
+            '_type': 'playlist',
+            'id': channel_id,
+            'channel_id': channel_id,
+            'channel': f'Benchmark {size}',
+            'title': f'Benchmark {size} - Videos',
+            'entries': entries(),
+        }
+
+    def fake_video(self, video_id):
+        url = f'{self.media_base_url}/media/{video_id}.mp4'
+        return {
+            'id': video_id,
+            'title': f'Benchmark video {video_id}',
+            'extractor': 'youtube',
+            'extractor_key': 'Youtube',
+            'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+            'duration': 60,
+            'formats': [{
+                'format_id': '18',
+                'url': url,
+                'ext': 'mp4',
+                'protocol': 'http',
+                'width': 1280,
+                'height': 720,
+                'vcodec': 'avc1.64001F',
+                'acodec': 'mp4a.40.2',
+                'filesize': MediaServer.media_size,
+            }],
+        }
+
+class MediaServer:
+    """Serves the same deterministic payload for every /media/<id>.mp4, with single byte ranges"""
+    media_size = 8 * 1024 * 1024
+
+    def __init__(self, media_size):
+        MediaServer.media_size = media_size
+        self.payload = random.Random(media_size).randbytes(media_size)
+        self.server = make_server('127.0.0.1', 0, self.wsgi_app, threaded=True)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, name='bench-media', daemon=True)
+
+    def wsgi_app(self, environ, start_response):
+        request = Request(environ)
+        if not MEDIA_PATH_RE.match(request.path):
+            return Response('not found', status=404)(environ, start_response)
+        size = len(self.payload)
+        start, end = 0, size - 1
+        status = 200
+        match = RANGE_RE.match(request.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start >= size:
+                return Response(status=416, headers={'Content-Range': f'bytes */{size}'})(environ, start_response)
+            status = 206
+        response = Response(self.payload[start:end + 1], status=status, mimetype='video/mp4')
+        response.headers['Accept-Ranges'] = 'bytes'
+        if status == 206:
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return response(environ, start_response)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    ordered = sorted(samples)
+    def pick(fraction):
+        return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000, 3)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': pick(0.5),
+        'p95_ms': pick(0.95),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+class Benchmark:
+    def __init__(self, server, base_url, args):
+        self.server = server
+        self.base_url = base_url
+        self.args = args
+        self.session = requests.Session()
+
+    def get(self, path, **kwargs):
+        response = self.session.get(self.base_url + path, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def post(self, path, payload):
+        response = self.session.post(self.base_url + path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def bench_fetch_channel(self):
+        results = []
+        for size in self.args.channel_sizes:
+            url = f'https://www.youtube.com/@bench{size}'
+            started = time.perf_counter()
+            body = self.post('/api/fetch-channel', {'channel_url': url, 'sync': 'full',
+                                                    'fetch_mode': self.args.fetch_mode})
+            full_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            self.post('/api/fetch-channel', {'channel_url': url, 'sync': 'incremental',
+                                             'fetch_mode': self.args.fetch_mode})
+            resync_seconds = time.perf_counter() - started
+            # Separate pass, tracing slows everything down; the answer leaves the library out so only ingestion counts
+            tracemalloc.start()
+            self.post('/api/fetch-channel', {'channel_url': url, 'sync': 'full', 'include_videos': False,
+                                             'fetch_mode': self.args.fetch_mode})
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({
+                'channel_size': size,
+                'video_count': body['video_count'],
+                'full_seconds': round(full_seconds, 4),
+                'videos_per_second': round(body['video_count'] / full_seconds, 1),
+                'incremental_seconds': round(resync_seconds, 4),
+                'ingest_peak_mib': round(peak / 2**20, 2),
+            })
+            log(f"fetch-channel {size}: {full_seconds:.3f}s full, {resync_seconds:.3f}s incremental, "
+                f"{peak / 2**20:.2f} MiB peak")
+        return results
+
+    def grow_library(self, target):
+        """Bulk-insert synthetic videos (spread over 20 channels) until the library holds ``target`` rows"""
+        current = self.server.db_query_one("SELECT COUNT(*) AS n FROM videos")['n']
+        batches = [[] for _ in range(20)]
+        for index in range(current, target):
+            channel = index % 20
+            batch = batches[channel]
+            batch.append({
+                'video_id': f'L{index:010d}',
+                'title': f'{random.choice(TITLE_WORDS)} {random.choice(TITLE_WORDS)} {index}',
+                'thumbnail_url': f'https://img.youtube.com/vi/L{index:010d}/hqdefault.jpg',
+                'duration': f'{index % 60}:{index % 59:02d}',
+                'resolutions': ['highest'],
+                'channel_id': f'UClibrary{channel:02d}',
+                'channel_name': f'Library {channel}',
+            })
+            if len(batch) == 5000:
+                self.server.upsert_channel_videos(batch[0]['channel_id'], batch[0]['channel_name'], batch)
+                batch.clear()
+        for batch in batches:
+            if batch:
+                self.server.upsert_channel_videos(batch[0]['channel_id'], batch[0]['channel_name'], batch)
+
+    def bench_videos_listing(self):
+        queries = {
+            'first_page': '/api/videos',
+            'small_page': '/api/videos?limit=50&fields=video_id,title',
+            'channel_filter': '/api/videos?channel_id=UClibrary07',
+            'title_prefix': '/api/videos?title_prefix=Ocean',
+            'title_sort_desc': '/api/videos?sort=-title',
+            'search_word': '/api/search?q=Guitar',
+            'search_prefix': '/api/search?q=Gui',
+            'search_two_words': '/api/search?q=Guitar%20Trav',
+            'search_rare': '/api/search?q=1234',
+        }
+        results = []
+        for size in self.args.library_sizes:
+            self.grow_library(size)
+            entry = {'library_size': size, 'queries': {}}
+            for name, path in queries.items():
+                self.get(path)  # warm the statement cache and page cache
+                samples = []
+                for _ in range(self.args.repeat):
+                    started = time.perf_counter()
+                    self.get(path)
+                    samples.append(time.perf_counter() - started)
+                entry['queries'][name] = summarize(samples)
+            # Walk five pages with the keyset cursor
+            samples = []
+            for _ in range(max(self.args.repeat // 5, 1)):
+                cursor = None
+                started = time.perf_counter()
+                for _ in range(5):
+                    page = self.get('/api/videos' + (f'?cursor={cursor}' if cursor else '')).json()
+                    cursor = page['next_cursor']
+                    if not cursor:
+                        break
+                samples.append(time.perf_counter() - started)
+            entry['queries']['five_page_walk'] = summarize(samples)
+            results.append(entry)
+            log(f"videos {size}: first page p50 {entry['queries']['first_page']['p50_ms']}ms")
+        return results
+
+    def reset_downloads(self):
+        shutil.rmtree(self.server.DOWNLOADS_DIR, ignore_errors=True)
+        with self.server.db_transaction() as conn:
+            conn.execute("DELETE FROM media_files")
+            conn.execute("DELETE FROM download_jobs")
+            conn.execute("UPDATE videos SET downloaded=0, download_progress=0, file_path=NULL")
+
+    def download_video_ids(self):
+        size = self.args.download_count
+        self.post('/api/fetch-channel', {'channel_url': f'https://www.youtube.com/@bench{size}', 'sync': 'full'})
+        return [row['video_id'] for row in self.server.db_query(
+            "SELECT video_id FROM videos WHERE channel_id=? ORDER BY id", (f'UCbench{size}',))]
+
+    def bench_downloads(self, video_ids):
+        results = []
+        for workers in self.args.download_workers:
+            self.reset_downloads()
+            # A fresh pool per level; the idle workers of the previous one just sleep on their condition
+            self.server.download_scheduler = self.server.DownloadScheduler(workers, self.server.download_video_thread)
+            started = time.perf_counter()
+            self.post('/api/download', {'video_ids': video_ids, 'priority': 'bulk'})
+            while True:
+                rows = self.server.db_query("SELECT state, COUNT(*) AS n FROM download_jobs GROUP BY state")
+                states = {row['state']: row['n'] for row in rows}
+                if states.get('done', 0) + states.get('failed', 0) >= len(video_ids):
+                    break
+                time.sleep(0.02)
+            seconds = time.perf_counter() - started
+            total_bytes = len(video_ids) * MediaServer.media_size * states.get('done', 0) // len(video_ids)
+            results.append({
+                'workers': workers,
+                'videos': len(video_ids),
+                'failed': states.get('failed', 0),
+                'seconds': round(seconds, 4),
+                'mib_per_second': round(total_bytes / seconds / 1024 ** 2, 2),
+                'videos_per_second': round(len(video_ids) / seconds, 2),
+            })
+            log(f"downloads x{workers}: {seconds:.3f}s, {results[-1]['mib_per_second']} MiB/s")
+        return results
+
+    def bench_file_serving(self, video_ids):
+        results = []
+        chunk = self.args.range_size
+        for clients in self.args.serve_clients:
+            for mode in ('full', 'range'):
+                def fetch(worker):
+                    session = requests.Session()
+                    rng = random.Random(worker)
+                    served = 0
+                    for index in range(self.args.serve_requests):
+                        video_id = video_ids[(worker + index) % len(video_ids)]
+                        headers = {}
+                        if mode == 'range':
+                            start = rng.randrange(0, MediaServer.media_size - chunk)
+                            headers['Range'] = f'bytes={start}-{start + chunk - 1}'
+                        with session.get(f'{self.base_url}/api/download-file/{video_id}', headers=headers,
+                                         stream=True) as response:
+                            response.raise_for_status()
+                            for block in response.iter_content(1024 * 1024):
+                                served += len(block)
+                    return served
+                started = time.perf_counter()
+                with concurrent.futures.ThreadPoolExecutor(clients) as pool:
+                    served = sum(pool.map(fetch, range(clients)))
+                seconds = time.perf_counter() - started
+                requests_served = clients * self.args.serve_requests
+                results.append({
+                    'mode': mode,
+                    'clients': clients,
+                    'requests': requests_served,
+                    'seconds': round(seconds, 4),
+                    'mib_per_second': round(served / seconds / 1024 ** 2, 2),
+                    'requests_per_second': round(requests_served / seconds, 1),
+                })
+                log(f"serving {mode} x{clients}: {results[-1]['mib_per_second']} MiB/s")
+        return results
+
+    def run(self):
+        results = {}
+        if 'fetch' in self.args.suites:
+            results['fetch_channel'] = self.bench_fetch_channel()
+        if 'videos' in self.args.suites:
+            results['videos_listing'] = self.bench_videos_listing()
+        if 'downloads' in self.args.suites or 'serving' in self.args.suites:
+            video_ids = self.download_video_ids()
+            if 'downloads' in self.args.suites:
+                results['downloads'] = self.bench_downloads(video_ids)
+            if 'serving' in self.args.suites:
+                if not results.get('downloads') or results['downloads'][-1]['failed']:
+                    self.args.download_workers = [max(self.args.download_workers)]
+                    self.bench_downloads(video_ids)
+                results['file_serving'] = self.bench_file_serving(video_ids)
+        return results
+
+TITLE_WORDS = ('Ocean', 'Mountain', 'Guitar', 'Cooking', 'Review', 'Travel', 'Vlog', 'Tutorial',
+               'Live', 'Highlights', 'Unboxing', 'Podcast', 'Challenge', 'Music', 'Gaming', 'News')
+SUITES = ('fetch', 'videos', 'downloads', 'serving')
+FULL_SIZES = {
+    'channel_sizes': [100, 1000, 5000],
+    'library_sizes': [1000, 10000, 50000],
+    'download_workers': [1, 2, 4, 8],
+    'download_count': 16,
+    'serve_clients': [1, 4, 16],
+    'serve_requests': 8,
+    'media_size': 8 * 1024 * 1024,
+    'repeat': 50,
+}
+QUICK_SIZES = {
+    'channel_sizes': [100, 500],
+    'library_sizes': [1000, 5000],
+    'download_workers': [1, 4],
+    'download_count': 8,
+    'serve_clients': [1, 4],
+    'serve_requests': 4,
+    'media_size': 2 * 1024 * 1024,
+    'repeat': 20,
+}
+
+def log(message):
+    print(f"⏱️  {message}", file=sys.stderr)
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        return None
+
+def flatten(value, prefix=''):
+    """path -> number for every numeric leaf; list items are keyed by their first field"""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = ((f"{next(iter(item.values()))}" if isinstance(item, dict) and item else str(index), item)
+                 for index, item in enumerate(value))
+    else:
+        return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+    flat = {}
+    for key, item in items:
+        flat.update(flatten(item, f'{prefix}.{key}' if prefix else str(key)))
+    return flat
+
+def print_comparison(baseline, current):
+    before = flatten(baseline.get('results', {}))
+    after = flatten(current['results'])
+    for key in sorted(after):
+        if key in before and before[key]:
+            change = (after[key] - before[key]) / before[key] * 100
+            print(f"{key:70} {before[key]:>12} -> {after[key]:>12} ({change:+.1f}%)", file=sys.stderr)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the Tube Snatch backend')
+    parser.add_argument('--suites', default=','.join(SUITES),
+                        help=f"comma separated subset of {', '.join(SUITES)}")
+    parser.add_argument('--quick', action='store_true', help='small sizes for a fast smoke run')
+    parser.add_argument('--channel-sizes', type=int_list)
+    parser.add_argument('--library-sizes', type=int_list)
+    parser.add_argument('--download-workers', type=int_list)
+    parser.add_argument('--download-count', type=int)
+    parser.add_argument('--serve-clients', type=int_list)
+    parser.add_argument('--serve-requests', type=int, help='requests per client')
+    parser.add_argument('--media-size', type=int, help='bytes per synthetic video')
+    parser.add_argument('--range-size', type=int, default=1024 * 1024, help='bytes per ranged read')
+    parser.add_argument('--page-latency', type=float, default=0.0,
+                        help='simulated seconds per 100-entry channel page')
+    parser.add_argument('--fetch-mode', choices=('race', 'serial'), default='race')
+    parser.add_argument('--repeat', type=int, help='samples per listing query')
+    parser.add_argument('--output', help='write the JSON result here instead of stdout')
+    parser.add_argument('--compare', help='earlier result file to print deltas against')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    parser.add_argument('--verbose', action='store_true', help='keep the server log at INFO')
+    args = parser.parse_args(argv)
+    # Explicit flags win over the --quick/full size presets
+    for name, value in (QUICK_SIZES if args.quick else FULL_SIZES).items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    args.suites = [suite.strip() for suite in args.suites.split(',') if suite.strip()]
+    unknown = [suite for suite in args.suites if suite not in SUITES]
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(unknown)}")
+    args.range_size = min(args.range_size, args.media_size // 2)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='tube-snatch-bench-')
+    # The server keeps its database, log and downloads/ relative to the working directory
+    os.environ['TUBE_SNATCH_DB'] = os.path.join(workdir, 'bench.db')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    media = MediaServer(args.media_size)
+    media.start()
+    FakeYoutubeDL.media_base_url = media.base_url
+    FakeYoutubeDL.page_latency = args.page_latency
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+
+    if not args.verbose:
+        # Set before the import, which already touches the database
+        logging.getLogger('youtube_api_server').setLevel(logging.WARNING)
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    import youtube_api_server as server
+    server.setup_database()
+    app_server = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=app_server.serve_forever, name='bench-app', daemon=True).start()
+
+    try:
+        started = time.perf_counter()
+        results = Benchmark(server, f'http://127.0.0.1:{app_server.server_port}', args).run()
+        report = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'yt_dlp': yt_dlp.version.__version__,
+                'sqlite': server.sqlite3.sqlite_version,
+                'elapsed_seconds': round(time.perf_counter() - started, 2),
+                'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            },
+            'results': results,
+        }
+    finally:
+        app_server.shutdown()
+        media.stop()
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            log(f"scratch directory kept at {workdir}")
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        log(f"results written to {args.output}")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
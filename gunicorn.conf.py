@@ -0,0 +1,44 @@
+"""Gunicorn settings for serving with several worker processes (Linux/macOS):
+
+    gunicorn -c gunicorn.conf.py youtube_api_server:app
+
+One worker owns the download queue; the others hand jobs to it through the
+database. On Windows use ``python youtube_api_server.py --production``.
+"""
+import os
+import signal
+import threading
+
+bind = f"{os.environ.get('TUBE_SNATCH_HOST', '127.0.0.1')}:{os.environ.get('TUBE_SNATCH_PORT', '8000')}"
+workers = int(os.environ.get('TUBE_SNATCH_WORKERS', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('TUBE_SNATCH_THREADS', '32'))  # every open event stream holds one
+keepalive = int(os.environ.get('TUBE_SNATCH_KEEPALIVE', '75'))
+# gthread workers heartbeat from their main loop, so a long stream never trips this
+timeout = int(os.environ.get('TUBE_SNATCH_WORKER_TIMEOUT', '120'))
+# Must outlast the download drain plus checkpoint, or the arbiter kills the owner mid-drain
+graceful_timeout = int(os.environ.get('TUBE_SNATCH_DRAIN_TIMEOUT', '30')) + 30
+
+def post_worker_init(worker):
+    import youtube_api_server
+    youtube_api_server.setup_database()
+    youtube_api_server.start_background_services()
+    
+    # Gunicorn's own handler stops the accept loop; start draining downloads and
+    # ending event streams alongside it instead of after the last request
+    handle_exit = signal.getsignal(signal.SIGTERM)
+    
+    def on_sigterm(signum, frame):
+        threading.Thread(target=youtube_api_server.shutdown_services, name='shutdown', daemon=True).start()
+        handle_exit(signum, frame)
+    
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+def worker_exit(server, worker):
+    import youtube_api_server
+    youtube_api_server.shutdown_services()
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# The server reads its settings at import time, so point it at a scratch database first
+os.environ.setdefault('TUBE_SNATCH_DB', os.path.join(tempfile.mkdtemp(), 'test.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,120 @@
+import os
+import time
+
+import pytest
+
+import youtube_api_server as server
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'DOWNLOADS_DIR', str(tmp_path))
+    for table in ('media_files', 'media_leases', 'videos'):
+        server.db_execute(f"DELETE FROM {table}")
+    manager = server.CacheManager(quota=1000, high_watermark=0.5, low_watermark=0.2, policy='lru')
+    
+    def add(video_id, size=200, last_access=0.0, pinned=False):
+        path = f"{video_id}_video.mp4"
+        (tmp_path / path).write_bytes(b'x' * size)
+        server.db_execute("INSERT INTO videos (video_id, title, downloaded, file_path) VALUES (?, 't', 1, ?)",
+                          (video_id, path))
+        server.register_media_file(video_id, path, pinned=pinned)
+        server.db_execute("UPDATE media_files SET last_access=? WHERE path=?", (last_access, path))
+        return path
+    
+    manager.add = add
+    return manager
+
+
+def indexed_paths():
+    return {row['path'] for row in server.db_query("SELECT path FROM media_files")}
+
+
+def test_evicts_least_recently_used_down_to_low_watermark(cache, tmp_path):
+    paths = [cache.add(f"video{i:06d}", last_access=i) for i in range(4)]
+    assert cache.evict() == 3
+    assert indexed_paths() == {paths[3]}
+    assert sorted(os.listdir(tmp_path)) == [paths[3]]
+    assert server.db_query_one("SELECT downloaded FROM videos WHERE video_id='video000000'")['downloaded'] == 0
+
+
+def test_pinned_files_are_kept(cache):
+    pinned = cache.add('video000000', last_access=0, pinned=True)
+    others = [cache.add(f"video{i:06d}", last_access=i) for i in range(1, 4)]
+    cache.evict()
+    assert pinned in indexed_paths()
+    assert others[0] not in indexed_paths()
+
+
+def test_file_leased_by_another_worker_is_skipped(cache):
+    leased = cache.add('video000000', last_access=0)
+    others = [cache.add(f"video{i:06d}", last_access=i) for i in range(1, 4)]
+    server.db_execute("INSERT INTO media_leases (path, holder, expires_at) VALUES (?, 'other-worker', ?)",
+                      (leased, time.time() + 60))
+    cache.evict()
+    assert leased in indexed_paths()
+    assert others[0] not in indexed_paths() and others[1] not in indexed_paths()
+
+
+def test_expired_lease_does_not_block_eviction(cache):
+    leased = cache.add('video000000', last_access=0)
+    for i in range(1, 4):
+        cache.add(f"video{i:06d}", last_access=i)
+    server.db_execute("INSERT INTO media_leases (path, holder, expires_at) VALUES (?, 'crashed', ?)",
+                      (leased, time.time() - 1))
+    cache.evict()
+    assert leased not in indexed_paths()
+
+
+def test_file_read_in_this_process_is_skipped(cache):
+    leased = cache.add('video000000', last_access=0)
+    for i in range(1, 4):
+        cache.add(f"video{i:06d}", last_access=i)
+    server.media_leases.acquire(leased)
+    try:
+        cache.evict()
+        assert leased in indexed_paths()
+    finally:
+        server.media_leases.release(leased)
+    assert server.db_query("SELECT * FROM media_leases") == []
+
+
+def test_locked_file_is_skipped_and_the_rest_committed(cache, tmp_path, monkeypatch):
+    locked = cache.add('video000000', last_access=0)
+    others = [cache.add(f"video{i:06d}", last_access=i) for i in range(1, 4)]
+    remove = os.remove
+    
+    def windows_remove(path):
+        # What Windows does for a file another process has open
+        if path.endswith(locked):
+            raise PermissionError(13, 'The process cannot access the file', path)
+        remove(path)
+    
+    monkeypatch.setattr(os, 'remove', windows_remove)
+    assert cache.evict() == 3
+    assert indexed_paths() == {locked}
+    assert os.listdir(tmp_path) == [locked]
+    assert server.db_query_one("SELECT downloaded FROM videos WHERE video_id='video000000'")['downloaded'] == 1
+    assert server.db_query_one("SELECT downloaded FROM videos WHERE video_id='video000001'")['downloaded'] == 0
+
+
+def test_standby_worker_never_starts_the_evictor(cache, monkeypatch):
+    for i in range(4):
+        cache.add(f"video{i:06d}", last_access=i)
+    monkeypatch.setattr(server.download_ownership, 'role', 'standby')
+    cache.check()
+    assert cache._thread is None
+
+
+def test_download_request_can_pin(cache, monkeypatch):
+    monkeypatch.setattr(server, 'download_scheduler', server.DownloadScheduler(1, lambda job: None))
+    cached = cache.add('video000000')
+    server.db_execute("INSERT INTO videos (video_id, title) VALUES ('video000009', 't')")
+    response = server.app.test_client().post('/api/download', json={
+        'video_ids': ['video000000', 'video000009'], 'pin': True})
+    assert response.status_code == 200
+    job_ids = [job['job_id'] for job in response.get_json()['jobs']]
+    rows = server.db_query(f"SELECT pin FROM download_jobs WHERE job_id IN ({server.sql_placeholders(job_ids)})",
+                           job_ids)
+    assert [row['pin'] for row in rows] == [1, 1]
+    assert server.db_query_one("SELECT pinned FROM media_files WHERE path=?", (cached,))['pinned'] == 1
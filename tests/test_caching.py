@@ -0,0 +1,55 @@
+import gzip
+
+import pytest
+
+import youtube_api_server as server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, 'download_scheduler', server.DownloadScheduler(1, lambda job: None))
+    server.db_execute("DELETE FROM download_jobs")
+    server.db_execute("DELETE FROM videos")
+    return server.app.test_client()
+
+
+def test_unchanged_progress_poll_is_answered_without_building_it(client, monkeypatch):
+    first = client.get('/api/download-progress')
+    assert first.status_code == 200
+    calls = []
+    build = server.build_download_progress
+    monkeypatch.setattr(server, 'build_download_progress', lambda: calls.append(1) or build())
+    again = client.get('/api/download-progress', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert calls == []
+
+
+def test_progress_tag_moves_with_job_writes_and_the_queue(client):
+    etag = client.get('/api/download-progress').headers['ETag']
+    server.db_execute("INSERT INTO download_jobs (job_id, video_id, state, created_at) VALUES ('j', 'v', 'queued', 1)")
+    response = client.get('/api/download-progress', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'j' in str(response.get_json())
+    
+    etag = response.headers['ETag']
+    server.download_scheduler.version += 1  # e.g. a job promoted ahead of others
+    assert client.get('/api/download-progress', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_videos_tag_follows_library_writes(client):
+    etag = client.get('/api/videos').headers['ETag']
+    assert client.get('/api/videos', headers={'If-None-Match': etag}).status_code == 304
+    server.db_execute("INSERT INTO videos (video_id, title) VALUES ('aaaaaaaaaaa', 't')")
+    assert client.get('/api/videos', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_large_json_is_compressed_and_small_json_is_not(client):
+    server.db_executemany("INSERT INTO videos (video_id, title) VALUES (?, ?)",
+                          [(f"video{i:06d}", f"Title {i}") for i in range(100)])
+    response = client.get('/api/videos', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(response.data)) > server.COMPRESS_MIN_SIZE
+    small = client.get('/api/videos?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    assert small.get_json()['videos']
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import youtube_api_server as server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def apply_migrations(path, count):
+    conn = sqlite3.connect(path)
+    for number, script in enumerate(server.SCHEMA_MIGRATIONS[:count], start=1):
+        for statement in server.split_sql(script):
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version={number}")
+    conn.commit()
+    conn.close()
+
+
+def user_version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_split_sql_keeps_trigger_bodies_whole():
+    statements = list(server.split_sql('''CREATE TABLE t (a);
+        CREATE TRIGGER tr AFTER INSERT ON t BEGIN
+            UPDATE t SET a = 1; UPDATE t SET a = 2;
+        END;
+        INSERT INTO t VALUES (';');'''))
+    assert len(statements) == 3
+    assert statements[1].startswith('CREATE TRIGGER') and statements[1].endswith('END;')
+
+
+def test_old_database_is_upgraded_in_place(tmp_path, monkeypatch):
+    path = str(tmp_path / 'old.db')
+    apply_migrations(path, 4)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO videos (video_id, title, channel_id) VALUES ('aaaaaaaaaaa', 'Old title', 'c')")
+    conn.commit()
+    conn.close()
+    
+    monkeypatch.setattr(server, 'DATABASE_PATH', path)
+    monkeypatch.setattr(server, '_schema_ready', False)
+    server.setup_database()
+    
+    assert user_version(path) == len(server.SCHEMA_MIGRATIONS)
+    conn = sqlite3.connect(path)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(media_files)")}
+    assert {'variant', 'last_access', 'pinned'} <= columns
+    # Rows from before the upgrade are kept and indexed for search
+    assert conn.execute("SELECT video_id FROM videos_fts JOIN videos ON videos.id = videos_fts.rowid "
+                        "WHERE videos_fts MATCH 'old'").fetchall() == [('aaaaaaaaaaa',)]
+    conn.close()
+
+
+def test_migrated_database_is_left_alone(tmp_path, monkeypatch):
+    path = str(tmp_path / 'current.db')
+    monkeypatch.setattr(server, 'DATABASE_PATH', path)
+    monkeypatch.setattr(server, '_schema_ready', False)
+    server.setup_database()
+    monkeypatch.setattr(server, '_schema_ready', False)
+    server.setup_database()
+    assert user_version(path) == len(server.SCHEMA_MIGRATIONS)
+
+
+def test_concurrent_first_start_migrates_once(tmp_path):
+    path = str(tmp_path / 'fresh.db')
+    env = dict(os.environ, TUBE_SNATCH_DB=path)
+    script = "import youtube_api_server as server; server.setup_database()"
+    for _ in range(3):
+        workers = [subprocess.Popen([sys.executable, '-c', script], cwd=ROOT, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) for _ in range(3)]
+        errors = [worker.communicate()[1] for worker in workers]
+        assert [worker.returncode for worker in workers] == [0, 0, 0], errors
+        assert user_version(path) == len(server.SCHEMA_MIGRATIONS)
+        os.remove(path)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
@@ -0,0 +1,40 @@
+import io
+import zipfile
+
+import pytest
+
+import youtube_api_server as server
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'DOWNLOADS_DIR', str(tmp_path))
+    server.db_execute("DELETE FROM media_files")
+    server.db_execute("DELETE FROM videos")
+    long_title = "A very long title that goes on well past the fifty character cut"
+    titles = {
+        'aaaaaaaaaaa': long_title,
+        'bbbbbbbbbbb': long_title,
+        'ccccccccccc': long_title + " (part two)",
+        'ddddddddddd': "Same title",
+        'eeeeeeeeeee': "Same title",
+        'fffffffffff': None,
+    }
+    for video_id, title in titles.items():
+        server.db_execute("INSERT INTO videos (video_id, title, channel_id, channel_name) VALUES (?, ?, 'chan', 'Chan')",
+                          (video_id, title))
+        path = f"{video_id}.mp4"
+        (tmp_path / path).write_bytes(video_id.encode())
+        server.db_execute("INSERT INTO media_files (path, video_id, ext, created_at) VALUES (?, ?, 'mp4', 0)",
+                          (path, video_id))
+    return titles
+
+
+def test_export_member_names_are_unique(library):
+    response = server.app.test_client().get('/api/export?channel_id=chan&format=zip')
+    assert response.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert len(names) == len(library) == len(set(names))
+    for video_id in library:
+        assert sum(name.endswith(f" [{video_id}].mp4") for name in names) == 1
+    assert "fffffffffff [fffffffffff].mp4" in names
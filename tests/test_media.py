@@ -0,0 +1,108 @@
+import pytest
+
+import youtube_api_server as server
+
+CONTENT = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.mark.parametrize('header, size, expected', [
+    (None, 100, None),
+    ('items=0-1', 100, None),
+    ('bytes=abc', 100, None),
+    ('bytes=5-2', 100, None),
+    ('bytes=0-9', 100, [(0, 9)]),
+    ('bytes=90-', 100, [(90, 99)]),
+    ('bytes=90-500', 100, [(90, 99)]),
+    ('bytes=-10', 100, [(90, 99)]),
+    ('bytes=-500', 100, [(0, 99)]),
+    ('bytes=100-', 100, []),
+    ('bytes=0-0,-1', 100, [(0, 0), (99, 99)]),
+    ('bytes=0-9,5-19,20-29', 100, [(0, 29)]),
+    ('bytes=50-59, 0-9', 100, [(0, 9), (50, 59)]),
+    ('bytes=-10', 0, []),
+    ('bytes=0-', 0, []),
+    ('bytes=0-0,-5', 0, []),
+])
+def test_parse_byte_ranges(header, size, expected):
+    assert server.parse_byte_ranges(header, size) == expected
+
+
+@pytest.fixture
+def media(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'DOWNLOADS_DIR', str(tmp_path))
+    for table in ('media_files', 'media_leases', 'videos'):
+        server.db_execute(f"DELETE FROM {table}")
+    
+    def add(video_id, content, title='Clip'):
+        path = f"{video_id}_clip.mp4"
+        (tmp_path / path).write_bytes(content)
+        server.db_execute("INSERT INTO videos (video_id, title, downloaded, file_path) VALUES (?, ?, 1, ?)",
+                          (video_id, title, path))
+        server.register_media_file(video_id, path)
+        return f"/api/download-file/{video_id}"
+    
+    return add
+
+
+def get(url, **headers):
+    return server.app.test_client().get(url, headers=headers)
+
+
+def test_whole_file(media):
+    response = get(media('aaaaaaaaaaa', CONTENT))
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(len(CONTENT))
+
+
+def test_single_range(media):
+    response = get(media('aaaaaaaaaaa', CONTENT), Range='bytes=100-199')
+    assert response.status_code == 206
+    assert response.data == CONTENT[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(CONTENT)}'
+
+
+def test_multiple_ranges(media):
+    response = get(media('aaaaaaaaaaa', CONTENT), Range='bytes=0-9,-10')
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    boundary = response.mimetype_params['boundary']
+    parts = response.data.split(f'--{boundary}'.encode())
+    assert response.headers['Content-Length'] == str(len(response.data))
+    bodies = [part.split(b'\r\n\r\n', 1)[1][:-2] for part in parts[1:-1]]
+    assert bodies == [CONTENT[:10], CONTENT[-10:]]
+    assert f'Content-Range: bytes 0-9/{len(CONTENT)}'.encode() in parts[1]
+
+
+def test_unsatisfiable_range(media):
+    response = get(media('aaaaaaaaaaa', CONTENT), Range=f'bytes={len(CONTENT)}-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_suffix_range_of_empty_file_is_unsatisfiable(media):
+    response = get(media('aaaaaaaaaaa', b''), Range='bytes=-10')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */0'
+
+
+def test_revalidation(media):
+    url = media('aaaaaaaaaaa', CONTENT)
+    first = get(url)
+    assert get(url, **{'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert get(url, **{'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+
+
+def test_stale_if_range_sends_the_whole_file(media):
+    response = get(media('aaaaaaaaaaa', CONTENT), Range='bytes=0-9', **{'If-Range': '"something-else"'})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_non_ascii_title_gets_an_encoded_filename(media):
+    response = get(media('aaaaaaaaaaa', CONTENT, title='日本語 🎵'))
+    assert response.status_code == 200
+    disposition = response.headers['Content-Disposition']
+    disposition.encode('latin-1')
+    assert "filename*=UTF-8''%E6%97%A5%E6%9C%AC%E8%AA%9E" in disposition
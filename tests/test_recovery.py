@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+import youtube_api_server as server
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """A scheduler whose single worker parks on every job, standing in for real downloads"""
+    release = threading.Event()
+    scheduler = server.DownloadScheduler(1, lambda job: release.wait(5))
+    monkeypatch.setattr(server, 'download_scheduler', scheduler)
+    server.setup_database()
+    server.db_execute("DELETE FROM download_jobs")
+    yield scheduler
+    release.set()
+
+
+def add_job(video_id, state, attempts=0, created_at=None):
+    job_id = uuid.uuid4().hex
+    now = created_at or time.time()
+    server.db_execute('''INSERT INTO download_jobs
+                         (job_id, video_id, resolution, priority, channel_id, state, attempts, created_at, updated_at)
+                         VALUES (?, ?, '720p', ?, 'chan', ?, ?, ?, ?)''',
+                      (job_id, video_id, server.PRIORITY_BULK, state, attempts, now, now))
+    return job_id
+
+
+def job_row(job_id):
+    return server.db_query_one("SELECT * FROM download_jobs WHERE job_id=?", (job_id,))
+
+
+def test_interrupted_jobs_are_requeued_and_restored(scheduler):
+    now = time.time()
+    queued = add_job('queued', 'queued', created_at=now - 3)
+    running = add_job('running', 'running', attempts=1, created_at=now - 2)
+    merging = add_job('merging', 'merging', attempts=2, created_at=now - 1)
+    done = add_job('done', 'done', attempts=1, created_at=now)
+
+    server.recover_download_jobs()
+
+    assert job_row(running)['state'] == 'queued' and job_row(running)['attempts'] == 1
+    assert job_row(merging)['state'] == 'queued'
+    assert job_row(done)['state'] == 'done'
+    restored = {job.video_id: job.job_id for job in scheduler._jobs.values()}
+    assert restored == {'queued': queued, 'running': running, 'merging': merging}
+
+
+def test_jobs_out_of_attempts_are_failed_not_restored(scheduler):
+    dead = add_job('dead', 'running', attempts=server.MAX_DOWNLOAD_ATTEMPTS)
+
+    server.recover_download_jobs()
+
+    row = job_row(dead)
+    assert row['state'] == 'failed' and row['finished_at'] is not None
+    assert 'giving up' in row['error']
+    assert 'dead' not in scheduler._jobs
+
+
+def test_recovery_skips_jobs_the_scheduler_already_holds(scheduler):
+    [(job, _)] = scheduler.submit_many([('held', '720p', 'chan')], server.PRIORITY_BULK,
+                                       persist=server.save_download_jobs)
+    server.db_execute("UPDATE download_jobs SET state='running' WHERE job_id=?", (job.job_id,))
+
+    server.recover_download_jobs()
+
+    assert scheduler._jobs['held'] is job
+    assert len(scheduler._jobs) == 1
+
+
+def test_checkpointed_jobs_are_not_charged_an_attempt(scheduler):
+    stopped = add_job('stopped', 'running', attempts=2)
+    fresh = add_job('fresh', 'merging', attempts=0)
+    finished = add_job('finished', 'done', attempts=1)
+
+    server.requeue_checkpointed_jobs([stopped, fresh, finished])
+
+    assert (job_row(stopped)['state'], job_row(stopped)['attempts']) == ('queued', 1)
+    assert (job_row(fresh)['state'], job_row(fresh)['attempts']) == ('queued', 0)
+    assert job_row(finished)['state'] == 'done'
+
+
+def test_drain_stops_taking_jobs_and_reports_running_ones(scheduler):
+    results = scheduler.submit_many([('first', '720p', 'chan'), ('second', '720p', 'chan')],
+                                    server.PRIORITY_BULK)
+    deadline = time.monotonic() + 5
+    while scheduler.stats()['active_workers'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    still_running = scheduler.drain(0.1)
+
+    assert [job.video_id for job in still_running] == ['first']
+    assert scheduler.stats()['queued'] == 1
+    assert results[1][0].status == 'queued'
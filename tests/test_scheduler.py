@@ -0,0 +1,89 @@
+import threading
+
+import youtube_api_server as server
+
+BULK = server.PRIORITY_BULK
+INTERACTIVE = server.PRIORITY_INTERACTIVE
+
+
+class Recorder:
+    """Download handler that holds the first job until released and records the order jobs start in"""
+
+    def __init__(self):
+        self.started = []
+        self.release = threading.Event()
+        self.first = threading.Event()
+        self.done = threading.Semaphore(0)
+
+    def __call__(self, job):
+        self.started.append(job.video_id)
+        self.first.set()
+        self.release.wait(5)
+        self.done.release()
+
+
+def blocked_scheduler():
+    recorder = Recorder()
+    scheduler = server.DownloadScheduler(1, recorder)
+    scheduler.submit_many([('blocker', '720p', 'z')], BULK)
+    assert recorder.first.wait(5)
+    return scheduler, recorder
+
+
+def run_all(scheduler, recorder, count):
+    recorder.release.set()
+    for _ in range(count):
+        assert recorder.done.acquire(timeout=5)
+    return recorder.started[1:]
+
+
+def test_channels_are_interleaved_instead_of_served_in_bulk_order():
+    scheduler, recorder = blocked_scheduler()
+    scheduler.submit_many([(f"x{i}", '720p', 'x') for i in range(4)], BULK)
+    scheduler.submit_many([(f"y{i}", '720p', 'y') for i in range(2)], BULK)
+    assert run_all(scheduler, recorder, 7) == ['x0', 'y0', 'x1', 'y1', 'x2', 'x3']
+
+
+def test_interactive_jobs_overtake_bulk():
+    scheduler, recorder = blocked_scheduler()
+    scheduler.submit_many([(f"x{i}", '720p', 'x') for i in range(3)], BULK)
+    scheduler.submit_many([('now', '720p', 'x')], INTERACTIVE)
+    assert run_all(scheduler, recorder, 5) == ['now', 'x0', 'x1', 'x2']
+
+
+def test_rerequesting_a_queued_job_interactively_promotes_it():
+    scheduler, recorder = blocked_scheduler()
+    [(job, created)] = scheduler.submit_many([('late', '720p', 'x')], BULK)
+    scheduler.submit_many([(f"x{i}", '720p', 'x') for i in range(3)], BULK)
+    assert scheduler.queue_positions()[job.job_id] == 1
+    scheduler.submit_many([(f"y{i}", '720p', 'y') for i in range(2)], BULK)
+
+    version = scheduler.version
+    [(promoted, created)] = scheduler.submit_many([('x2', '720p', 'x')], INTERACTIVE)
+    assert not created and promoted.priority == INTERACTIVE
+    assert scheduler.queue_positions()[promoted.job_id] == 1
+    assert scheduler.version > version
+    assert run_all(scheduler, recorder, 7)[0] == 'x2'
+
+
+def test_active_video_is_not_queued_twice():
+    scheduler, recorder = blocked_scheduler()
+    [(first, created)] = scheduler.submit_many([('a', '720p', 'x')], BULK)
+    assert created
+    [(second, created)] = scheduler.submit_many([('a', '1080p', 'x')], BULK)
+    assert second is first and not created
+    assert scheduler.submit_many([('blocker', '720p', 'z')], BULK)[0][1] is False
+    assert run_all(scheduler, recorder, 2) == ['a']
+
+
+def test_jobs_are_persisted_before_a_worker_can_take_them():
+    seen = []
+    scheduler, recorder = blocked_scheduler()
+
+    def persist(jobs):
+        seen.extend(job.video_id for job in jobs)
+        assert scheduler.stats()['queued'] == 0
+
+    scheduler.submit_many([('a', '720p', 'x'), ('b', '720p', 'x')], BULK, persist=persist)
+    assert seen == ['a', 'b']
+    run_all(scheduler, recorder, 3)
@@ -0,0 +1,58 @@
+import pytest
+
+import youtube_api_server as server
+
+TITLES = ['apple pie', 'Apple tart', None, 'banana', 'APPLE crumble', '', 'apricot', 'apple', None, 'Cherry']
+
+
+@pytest.fixture
+def library():
+    server.db_execute("DELETE FROM videos")
+    server.db_executemany("INSERT INTO videos (video_id, title, channel_id) VALUES (?, ?, 'chan')",
+                          [(f"video{i:06d}", title) for i, title in enumerate(TITLES)])
+
+
+def fetch_all(**args):
+    client = server.app.test_client()
+    videos, cursor = [], None
+    while True:
+        query = dict(args, limit=2, **({'cursor': cursor} if cursor else {}))
+        response = client.get('/api/videos', query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        videos += body['videos']
+        cursor = body['next_cursor']
+        if not cursor:
+            return videos
+
+
+@pytest.mark.parametrize('sort', ['id', '-id', 'title', '-title'])
+def test_every_video_is_listed_exactly_once(library, sort):
+    video_ids = [video['video_id'] for video in fetch_all(sort=sort)]
+    assert sorted(video_ids) == sorted(f"video{i:06d}" for i in range(len(TITLES)))
+
+
+def test_title_sort_orders_untitled_videos_first(library):
+    titles = [video['title'] for video in fetch_all(sort='title', fields='title')]
+    assert titles[:3] in ([None, '', None], [None, None, ''], ['', None, None])
+    assert [title.lower() for title in titles[3:]] == sorted(title.lower() for title in titles[3:])
+
+
+@pytest.mark.parametrize('sort', ['title', '-title', 'id'])
+def test_title_prefix_pages_match_case_insensitively(library, sort):
+    titles = [video['title'] for video in fetch_all(title_prefix='apple', sort=sort)]
+    assert sorted(titles, key=str.lower) == sorted(['apple pie', 'Apple tart', 'APPLE crumble', 'apple'],
+                                                    key=str.lower)
+    if sort == 'title':
+        assert titles == sorted(titles, key=str.lower)
+
+
+def test_title_prefix_with_title_sort_needs_no_sort_step(library):
+    sort_key, collate, _ = server.VIDEO_SORTS['title']
+    plan = server.db_query(
+        f"EXPLAIN QUERY PLAN SELECT id FROM videos "
+        f"WHERE COALESCE(title, '') >= ? COLLATE NOCASE AND COALESCE(title, '') < ? COLLATE NOCASE "
+        f"ORDER BY {sort_key}{collate}, id LIMIT 3", ('apple', 'apple\U0010ffff'))
+    details = ' '.join(row['detail'] for row in plan)
+    assert 'idx_videos_title_sort' in details
+    assert 'TEMP B-TREE' not in details
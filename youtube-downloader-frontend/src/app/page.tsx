@@ -38,6 +38,7 @@ export default function Home() {
   const [selectedCategory, setSelectedCategory] = useState<string>('All Videos');
   const [searchCategories, setSearchCategories] = useState<Array<{name: string, count: number}>>([]);
   const [downloadProgress, setDownloadProgress] = useState<any>({});
+  const [qualityBadges, setQualityBadges] = useState<Record<string, string[]>>({});
   const [channelName, setChannelName] = useState('');
   const [backendConnected, setBackendConnected] = useState(false);
   const [currentPage, setCurrentPage] = useState(1);
@@ -144,30 +145,58 @@ export default function Home() {
       console.log('Original URL:', channelUrl);
       console.log('Clean URL:', cleanUrl);
       
-      const response = await axios.post(`${API_BASE}/api/fetch-channel`, {
-        channel_url: cleanUrl,
-        content_type: contentType
-      }, {
-        timeout: 120000 // 2 minute timeout for mega channels
+      // Streamed as NDJSON: the channel first, then batches of videos as pages are walked, then a summary
+      const response = await fetch(`${API_BASE}/api/fetch-channel`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ channel_url: cleanUrl, content_type: contentType, stream: true })
       });
+      if (!response.ok || !response.body) {
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.error || `Fetch failed with status ${response.status}`);
+      }
+      
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = '';
+      let fetchedChannel = '';
+      let summary: any = null;
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop() || '';
+        for (const line of lines) {
+          if (!line) continue;
+          const record = JSON.parse(line);
+          if (record.type === 'channel') {
+            fetchedChannel = record.channel_name;
+            setVideos([]);
+            setChannelName(fetchedChannel);
+            // Auto-set category to the new channel
+            if (fetchedChannel) {
+              setSelectedCategory(fetchedChannel);
+            }
+            setStep(2); // Show the first videos while the rest stream in
+          } else if (record.type === 'videos') {
+            setVideos(prev => [...prev, ...record.videos]);
+          } else if (record.type === 'error') {
+            throw new Error(record.error);
+          } else if (record.type === 'summary') {
+            summary = record;
+          }
+        }
+      }
       
-      console.log('✅ Fetch response:', response.data);
+      console.log('✅ Fetch summary:', summary);
       
-      if (response.data.success) {
-        setVideos(response.data.videos);
-        setChannelName(response.data.channel_name);
-        setStep(2); // Move to video selection step
-        
+      if (summary?.success) {
         // Save to recent channels
-        saveRecentChannel(cleanUrl, response.data.channel_name, response.data.videos.length);
+        saveRecentChannel(cleanUrl, fetchedChannel, summary.video_count);
         
-        // Auto-set category to the new channel if it's the first/only channel
-        if (response.data.channel_name) {
-          setSelectedCategory(response.data.channel_name);
-        }
-        
-        console.log(`📹 Loaded ${response.data.videos.length} videos from ${response.data.channel_name}`);
-        addNotification(`✅ Found ${response.data.videos.length} ${contentType} from ${response.data.channel_name}!`, 'success');
+        console.log(`📹 Loaded ${summary.video_count} videos from ${fetchedChannel}`);
+        addNotification(`✅ Found ${summary.video_count} ${contentType} from ${fetchedChannel}!`, 'success');
       }
     } catch (error: any) {
       console.error('❌ Error fetching channel:', error);
@@ -291,15 +320,53 @@ export default function Home() {
     }
   };
 
+  // Export selected downloaded videos as one ZIP, streamed by the backend
+  const exportSelectedVideos = () => {
+    const downloadedIds = videos
+      .filter(v => selectedVideos.has(v.video_id) && v.downloaded)
+      .map(v => v.video_id);
+    if (downloadedIds.length === 0) {
+      addNotification('❌ None of the selected videos are downloaded yet', 'error');
+      return;
+    }
+
+    // A form POST lets the browser handle the archive as a normal download, without a URL length limit
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = `${API_BASE}/api/export`;
+    for (const [name, value] of [['video_ids', downloadedIds.join(',')], ['format', 'zip']]) {
+      const input = document.createElement('input');
+      input.type = 'hidden';
+      input.name = name;
+      input.value = value;
+      form.appendChild(input);
+    }
+    document.body.appendChild(form);
+    form.submit();
+    document.body.removeChild(form);
+    addNotification(`📦 Exporting ${downloadedIds.length} videos as ZIP...`, 'info');
+  };
+
   // Load existing videos from database
   const loadVideos = async () => {
     try {
-      const response = await axios.get(`${API_BASE}/api/videos`);
-      if (response.data.videos && response.data.videos.length > 0) {
-        setVideos(response.data.videos);
-        setChannelName(response.data.videos[0].channel_name);
+      // Walk the keyset-paginated listing, only asking for the fields the cards use
+      const fields = 'id,video_id,title,thumbnail_url,duration,resolutions,channel_name,downloaded,download_progress';
+      const loadedVideos: Video[] = [];
+      let cursor: string | null = null;
+      do {
+        const response: { data: { videos: Video[], next_cursor: string | null } } = await axios.get(`${API_BASE}/api/videos`, {
+          params: { limit: 1000, fields, ...(cursor ? { cursor } : {}) }
+        });
+        loadedVideos.push(...response.data.videos);
+        cursor = response.data.next_cursor;
+      } while (cursor);
+
+      if (loadedVideos.length > 0) {
+        setVideos(loadedVideos);
+        setChannelName(loadedVideos[0].channel_name);
         setStep(2);
-        console.log(`📚 Loaded ${response.data.videos.length} videos from database`);
+        console.log(`📚 Loaded ${loadedVideos.length} videos from database`);
       }
     } catch (error) {
       console.error('❌ Error loading videos:', error);
@@ -397,10 +464,53 @@ export default function Home() {
   const endIndex = startIndex + videosPerPage;
   const currentVideos = filteredVideos.slice(startIndex, endIndex);
 
-  // Reset to page 1 when videos change
+  // Reset to page 1 when the video list is replaced - not when a streamed batch is appended
   useEffect(() => {
     setCurrentPage(1);
-  }, [videos]);
+  }, [videos[0]?.video_id]);
+
+  // Resolve quality badges for the visible page in one streamed batch request
+  const currentVideoIds = currentVideos.map(v => v.video_id).join(',');
+  useEffect(() => {
+    const missing = currentVideoIds.split(',').filter(id => id && !qualityBadges[id]);
+    if (missing.length === 0) return;
+    const controller = new AbortController();
+
+    (async () => {
+      try {
+        const response = await fetch(`${API_BASE}/api/video-qualities`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ video_ids: missing }),
+          signal: controller.signal
+        });
+        if (!response.ok || !response.body) return;
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffered += decoder.decode(value, { stream: true });
+          const lines = buffered.split('\n');
+          buffered = lines.pop() || '';
+          const resolved: Record<string, string[]> = {};
+          for (const line of lines) {
+            if (!line) continue;
+            const item = JSON.parse(line);
+            if (item.qualities) resolved[item.video_id] = item.qualities;
+          }
+          if (Object.keys(resolved).length > 0) {
+            setQualityBadges(prev => ({ ...prev, ...resolved }));
+          }
+        }
+      } catch (error: any) {
+        if (error.name !== 'AbortError') console.error('❌ Error loading qualities:', error);
+      }
+    })();
+
+    return () => controller.abort();
+  }, [currentVideoIds]);
 
   useEffect(() => {
     // Test backend connection on load
@@ -411,6 +521,43 @@ export default function Home() {
     loadRecentChannels();
   }, []);
 
+  // Live download progress pushed by the backend (Server-Sent Events).
+  // EventSource reconnects on its own and resumes from the last event id.
+  useEffect(() => {
+    const source = new EventSource(`${API_BASE}/api/download-events`);
+    const finished = new Set(['done', 'failed']);
+
+    source.addEventListener('snapshot', (e) => {
+      setDownloadProgress(JSON.parse((e as MessageEvent).data));
+    });
+
+    source.addEventListener('job', (e) => {
+      const job = JSON.parse((e as MessageEvent).data);
+      setDownloadProgress((prev: any) => ({ ...prev, [job.video_id]: { ...prev[job.video_id], ...job } }));
+      if (job.state === 'done') {
+        setVideos(prev => prev.map(v => v.video_id === job.video_id ? { ...v, downloaded: true } : v));
+      }
+    });
+
+    source.addEventListener('progress', (e) => {
+      const tick = JSON.parse((e as MessageEvent).data);
+      setDownloadProgress((prev: any) => {
+        const current = prev[tick.video_id];
+        // Ignore ticks for a job that has been superseded or already finished
+        if (current && (current.job_id !== tick.job_id || finished.has(current.state))) return prev;
+        return { ...prev, [tick.video_id]: { ...current, ...tick } };
+      });
+    });
+
+    source.addEventListener('cleared', () => {
+      setDownloadProgress((prev: any) => Object.fromEntries(
+        Object.entries(prev).filter(([, job]: [string, any]) => !finished.has(job.state))
+      ));
+    });
+
+    return () => source.close();
+  }, []);
+
   return (
     <div className="min-h-screen p-6 text-white">
       <div className="max-w-7xl mx-auto">
@@ -763,6 +910,14 @@ export default function Home() {
                           <Download className="mr-2" size={18} />
                           Download Selected ({selectedVideos.size})
                         </Button>
+                        <Button
+                          onClick={exportSelectedVideos}
+                          disabled={selectedVideos.size === 0}
+                          variant="outline"
+                          size="sm"
+                        >
+                          Export ZIP
+                        </Button>
                       </div>
         </div>
                   </CardContent>
@@ -901,9 +1056,19 @@ export default function Home() {
                           <h3 className="font-medium text-sm line-clamp-2 text-white mb-1">
                             {video.title}
                           </h3>
+                          {downloadProgress[video.video_id] && !['done', 'failed'].includes(downloadProgress[video.video_id].state) && (
+                            <div className="mb-2">
+                              <Progress value={downloadProgress[video.video_id].progress || 0} className="h-1" />
+                              <div className="text-[10px] text-red-200 mt-1">
+                                {downloadProgress[video.video_id].state === 'queued'
+                                  ? 'Queued'
+                                  : `${downloadProgress[video.video_id].progress || 0}%`}
+                              </div>
+                            </div>
+                          )}
                           <div className="flex items-center justify-between">
                             <div className="text-xs text-red-200">
-                              🎬 Max Quality
+                              🎬 {qualityBadges[video.video_id]?.[0] ?? 'Max Quality'}
                             </div>
                             <Button
                               onClick={(e) => {
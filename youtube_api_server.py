@@ -3,16 +3,62 @@ import sqlite3
 import json
 import logging
 import uuid
-import tempfile
-from flask import Flask, request, jsonify, send_file, redirect
+import hashlib
+import io
+import mimetypes
+import shutil
+import signal
+import subprocess
+import sys
+from flask import Flask, request, jsonify, redirect, Response
 from flask_cors import CORS
 from pytube import YouTube, Channel
-from pytube.exceptions import VideoUnavailable
+from pytube import extract as pytube_extract
 import yt_dlp
+import requests
 import re
 import threading
 import time
-from datetime import datetime
+import heapq
+import contextlib
+import collections
+import copy
+import queue
+import base64
+import binascii
+import itertools
+import concurrent.futures
+import struct
+import tarfile
+import zlib
+import gzip
+import functools
+import unicodedata
+import urllib.parse
+from datetime import datetime, timezone
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+# Optional speedups - JSON encoding and response compression fall back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+from werkzeug.http import http_date
+from werkzeug.wsgi import ClosingIterator
+from prometheus_client import Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
 # Set up logging without emojis for Windows compatibility
 logging.basicConfig(
@@ -28,48 +74,1049 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
+# Metrics - Prometheus text format on /metrics. Hot paths only touch pre-bound
+# children (a lock and an add); cache and queue figures are read at scrape time.
+REQUEST_SECONDS = Histogram('tubesnatch_request_seconds', 'Time to response headers per route',
+                            ['method', 'route', 'status'])
+DB_SECONDS = Histogram('tubesnatch_db_seconds', 'SQLite statement and transaction time', ['op'],
+                       buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+DB_QUERY_SECONDS = DB_SECONDS.labels('query')
+DB_TRANSACTION_SECONDS = DB_SECONDS.labels('transaction')
+EXTRACTION_SECONDS = Histogram('tubesnatch_extraction_seconds', 'Channel extraction latency per strategy',
+                               ['strategy'], buckets=(.5, 1, 2, 5, 10, 15, 20, 30, 40, 60))
+EXTRACTION_ATTEMPTS = Counter('tubesnatch_extraction_attempts', 'Channel extraction attempts per strategy and outcome',
+                              ['strategy', 'outcome'])
+DOWNLOAD_BYTES = Counter('tubesnatch_download_bytes', 'Bytes fetched from YouTube', ['source'])
+LIBRARY_DOWNLOAD_BYTES = DOWNLOAD_BYTES.labels('library')
+STREAM_DOWNLOAD_BYTES = DOWNLOAD_BYTES.labels('stream')
+MERGE_SECONDS = Histogram('tubesnatch_merge_seconds', 'ffmpeg merge time of DASH downloads',
+                          buckets=(.5, 1, 2, 5, 10, 30, 60, 120, 300))
+BANDWIDTH_WAIT_SECONDS = Counter('tubesnatch_bandwidth_wait_seconds', 'Time downloads spent held back by rate limits')
+
+@app.before_request
+def start_request_timer():
+    request.environ['tube_snatch.started'] = time.perf_counter()
+
+@app.after_request
+def observe_request_latency(response):
+    started = request.environ.get('tube_snatch.started')
+    if started is not None:
+        # Streamed bodies are still going out at this point - this is time to first byte
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(time.perf_counter() - started)
+    return response
+
 @app.route('/api/test', methods=['GET'])
 def test_connection():
     logger.info("Test endpoint hit!")
     return jsonify({'message': 'Backend is working!', 'status': 'success'})
 
 # Database setup
-def setup_database():
-    conn = sqlite3.connect('youtube_downloader.db', check_same_thread=False)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS videos
-                 (id INTEGER PRIMARY KEY, 
-                 video_id TEXT UNIQUE, 
-                 title TEXT, 
-                 thumbnail_url TEXT, 
-                 duration TEXT,
-                 resolutions TEXT, 
-                 channel_id TEXT,
-                 channel_name TEXT,
-                 downloaded INTEGER DEFAULT 0,
-                 download_progress INTEGER DEFAULT 0,
-                 file_path TEXT)''')
-    conn.commit()
+DATABASE_PATH = os.environ.get('TUBE_SNATCH_DB', 'youtube_downloader.db')
+DB_POOL_SIZE = int(os.environ.get('TUBE_SNATCH_DB_POOL_SIZE', '8'))
+
+# Schema migrations, applied once at startup and tracked with PRAGMA user_version.
+# Never edit an entry that has shipped - append a new one instead.
+SCHEMA_MIGRATIONS = [
+    # 1: video library
+    '''CREATE TABLE IF NOT EXISTS videos
+       (id INTEGER PRIMARY KEY,
+       video_id TEXT UNIQUE,
+       title TEXT,
+       thumbnail_url TEXT,
+       duration TEXT,
+       resolutions TEXT,
+       channel_id TEXT,
+       channel_name TEXT,
+       downloaded INTEGER DEFAULT 0,
+       download_progress INTEGER DEFAULT 0,
+       file_path TEXT);''',
+    # 2: persistent download job store
+    '''CREATE TABLE IF NOT EXISTS download_jobs
+       (job_id TEXT PRIMARY KEY,
+       video_id TEXT NOT NULL,
+       resolution TEXT,
+       priority INTEGER DEFAULT 1,
+       channel_id TEXT,
+       state TEXT NOT NULL DEFAULT 'queued',
+       attempts INTEGER DEFAULT 0,
+       downloaded_bytes INTEGER DEFAULT 0,
+       total_bytes INTEGER,
+       file_path TEXT,
+       error TEXT,
+       created_at REAL,
+       updated_at REAL,
+       started_at REAL,
+       finished_at REAL);
+    CREATE INDEX IF NOT EXISTS idx_download_jobs_state ON download_jobs (state);''',
+    # 3: indexes backing the filtered, keyset-paginated /api/videos listing
+    '''CREATE INDEX IF NOT EXISTS idx_videos_channel ON videos (channel_id, id);
+    CREATE INDEX IF NOT EXISTS idx_videos_downloaded ON videos (downloaded, id);
+    CREATE INDEX IF NOT EXISTS idx_videos_title ON videos (title COLLATE NOCASE, id);''',
+    # 4: index of media files on disk, so lookups never scan the downloads directory
+    '''CREATE TABLE IF NOT EXISTS media_files
+       (path TEXT PRIMARY KEY,
+       video_id TEXT NOT NULL,
+       format_id TEXT,
+       ext TEXT,
+       size INTEGER,
+       mtime REAL,
+       checksum TEXT,
+       created_at REAL);
+    CREATE INDEX IF NOT EXISTS idx_media_files_video ON media_files (video_id, created_at);''',
+    # 5: which requested quality a cached file satisfies, so stream downloads can reuse it
+    '''ALTER TABLE media_files ADD COLUMN variant TEXT;
+    CREATE INDEX IF NOT EXISTS idx_media_files_variant ON media_files (video_id, variant);''',
+    # 6: access tracking and pinning for the download cache quota
+    '''ALTER TABLE media_files ADD COLUMN last_access REAL;
+    ALTER TABLE media_files ADD COLUMN access_count INTEGER DEFAULT 0;
+    ALTER TABLE media_files ADD COLUMN pinned INTEGER DEFAULT 0;
+    UPDATE media_files SET pinned=1 WHERE path NOT GLOB '???????????_stream-*';''',
+    # 7: when a video's qualities were last resolved from its formats (stored in resolutions)
+    '''ALTER TABLE videos ADD COLUMN qualities_checked_at REAL;''',
+    # 8: channel extraction outcomes that drive adaptive strategy ordering
+    '''CREATE TABLE IF NOT EXISTS extraction_attempts
+       (id INTEGER PRIMARY KEY,
+       strategy TEXT NOT NULL,
+       url_variant TEXT NOT NULL,
+       outcome TEXT NOT NULL,
+       seconds REAL,
+       created_at REAL NOT NULL);
+    CREATE INDEX IF NOT EXISTS idx_extraction_attempts_created ON extraction_attempts (created_at);''',
+    # 9: lets serving workers poll for job rows another process changed
+    '''CREATE INDEX IF NOT EXISTS idx_download_jobs_updated ON download_jobs (updated_at);''',
+    # 10: channels whose PyTube listing is still having resolutions filled in, resumed at startup
+    '''CREATE TABLE IF NOT EXISTS channel_enrichments
+       (channel_id TEXT PRIMARY KEY,
+       state TEXT NOT NULL,
+       started_at REAL,
+       updated_at REAL);''',
+    # 11: full-text index over titles and channel names, kept in step with videos by triggers
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5
+       (title, channel_name, content='videos', content_rowid='id',
+       tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+    INSERT INTO videos_fts (videos_fts, rank) VALUES ('rank', 'bm25(10.0, 2.0)');
+    CREATE TRIGGER IF NOT EXISTS videos_fts_insert AFTER INSERT ON videos BEGIN
+        INSERT INTO videos_fts (rowid, title, channel_name) VALUES (new.id, new.title, new.channel_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS videos_fts_delete AFTER DELETE ON videos BEGIN
+        INSERT INTO videos_fts (videos_fts, rowid, title, channel_name)
+        VALUES ('delete', old.id, old.title, old.channel_name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS videos_fts_update AFTER UPDATE OF title, channel_name ON videos
+    WHEN old.title IS NOT new.title OR old.channel_name IS NOT new.channel_name BEGIN
+        INSERT INTO videos_fts (videos_fts, rowid, title, channel_name)
+        VALUES ('delete', old.id, old.title, old.channel_name);
+        INSERT INTO videos_fts (rowid, title, channel_name) VALUES (new.id, new.title, new.channel_name);
+    END;
+    INSERT INTO videos_fts (videos_fts) VALUES ('rebuild');''',
+    # 12: per-table change counters behind the ETags of listing endpoints. They start at a random
+    # value so an ETag handed out before the database was recreated cannot match by accident.
+    '''CREATE TABLE IF NOT EXISTS change_counters
+       (name TEXT PRIMARY KEY,
+       version INTEGER NOT NULL);
+    INSERT OR IGNORE INTO change_counters (name, version)
+    VALUES ('videos', abs(random() % 1000000000)), ('download_jobs', abs(random() % 1000000000));
+    CREATE TRIGGER IF NOT EXISTS videos_changed_insert AFTER INSERT ON videos BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'videos';
+    END;
+    CREATE TRIGGER IF NOT EXISTS videos_changed_update AFTER UPDATE ON videos BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'videos';
+    END;
+    CREATE TRIGGER IF NOT EXISTS videos_changed_delete AFTER DELETE ON videos BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'videos';
+    END;
+    CREATE TRIGGER IF NOT EXISTS download_jobs_changed_insert AFTER INSERT ON download_jobs BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'download_jobs';
+    END;
+    CREATE TRIGGER IF NOT EXISTS download_jobs_changed_update AFTER UPDATE ON download_jobs BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'download_jobs';
+    END;
+    CREATE TRIGGER IF NOT EXISTS download_jobs_changed_delete AFTER DELETE ON download_jobs BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'download_jobs';
+    END;''',
+    # 13: title sort that keeps untitled videos (sorted as '') in keyset pages
+    '''CREATE INDEX IF NOT EXISTS idx_videos_title_sort ON videos (COALESCE(title, '') COLLATE NOCASE, id);''',
+    # 14: the cache quota may evict library files unless a user pins them (6 pinned them all), a per-job
+    # pin request from /api/download, and leases on files being read, shared by every worker process
+    '''UPDATE media_files SET pinned=0 WHERE path NOT GLOB '???????????_stream-*';
+    ALTER TABLE download_jobs ADD COLUMN pin INTEGER DEFAULT 0;
+    CREATE TABLE IF NOT EXISTS media_leases
+       (path TEXT NOT NULL,
+       holder TEXT NOT NULL,
+       expires_at REAL NOT NULL,
+       PRIMARY KEY (path, holder));''',
+    # 15: idx_videos_title_sort (13) serves both title_prefix and the title sorts
+    '''DROP INDEX IF EXISTS idx_videos_title;''',
+    # 16: download_jobs change counter for /api/download-progress, for databases that got 12 without it
+    '''INSERT OR IGNORE INTO change_counters (name, version) VALUES ('download_jobs', abs(random() % 1000000000));
+    CREATE TRIGGER IF NOT EXISTS download_jobs_changed_insert AFTER INSERT ON download_jobs BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'download_jobs';
+    END;
+    CREATE TRIGGER IF NOT EXISTS download_jobs_changed_update AFTER UPDATE ON download_jobs BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'download_jobs';
+    END;
+    CREATE TRIGGER IF NOT EXISTS download_jobs_changed_delete AFTER DELETE ON download_jobs BEGIN
+        UPDATE change_counters SET version = version + 1 WHERE name = 'download_jobs';
+    END;''',
+]
+
+def open_connection():
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, avoids an fsync per commit
+    conn.execute("PRAGMA cache_size=-16000")  # 16 MB page cache per connection
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
-# Global variables for download progress tracking
-download_progress = {}
-download_threads = {}
+_schema_lock = threading.Lock()
+_schema_ready = False
 
-def fetch_channel_with_ytdlp(channel_url, content_type='videos'):
-    """⚡ UNCLE HYDE'S LIGHTNING FAST FETCH - No timeouts, maximum speed!"""
-    logger.info(f"⚡ UNCLE HYDE'S SPEED DEMON MODE! Fetching {content_type} from: {channel_url}")
-    
-    # UNCLE HYDE'S MEGA CHANNEL STRATEGIES - Optimized for 2000+ videos!
-    strategies = [
+def split_sql(script):
+    """The statements of a migration script, one at a time (trigger bodies stay whole)"""
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \t\n;'):
+                yield statement.strip()
+            statement = ''
+
+def setup_database():
+    """Switch the database to WAL and run pending migrations - once per process.
+
+    Every gunicorn worker runs this at startup, so the version is read and the
+    migrations applied inside one BEGIN IMMEDIATE: whichever process gets the
+    write lock first migrates, the rest then find nothing left to do.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        conn = open_connection()
+        conn.isolation_level = None  # Transactions are spelled out below
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")  # Readers never block the download workers' writes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                for number, script in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+                    # Not executescript - it would commit and drop the lock first
+                    for statement in split_sql(script):
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version={number}")
+                    logger.info(f"Applied database migration {number}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        _schema_ready = True
+
+class ConnectionPool:
+    """Hands out SQLite connections so requests and workers stop reconnecting.
+
+    Connections are reused LIFO so hot ones keep a warm page and statement
+    cache. If every pooled connection is busy an overflow connection is opened
+    and closed on return instead of making the caller wait.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        setup_database()
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = open_connection()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+db_pool = ConnectionPool(DB_POOL_SIZE)
+
+def db_query(sql, params=()):
+    with db_pool.connection() as conn, DB_QUERY_SECONDS.time():
+        return conn.execute(sql, params).fetchall()
+
+def db_query_one(sql, params=()):
+    with db_pool.connection() as conn, DB_QUERY_SECONDS.time():
+        return conn.execute(sql, params).fetchone()
+
+def db_execute(sql, params=()):
+    """Run one write statement in its own transaction; returns the row count"""
+    with db_transaction() as conn:
+        return conn.execute(sql, params).rowcount
+
+def db_executemany(sql, rows):
+    with db_transaction() as conn:
+        return conn.executemany(sql, rows).rowcount
+
+@contextlib.contextmanager
+def db_transaction():
+    """Borrow a connection for several statements that commit or roll back together"""
+    with db_pool.connection() as conn, DB_TRANSACTION_SECONDS.time():
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def sql_placeholders(values):
+    return ",".join("?" * len(values))
+
+# HTTP caching and compression for the JSON endpoints
+COMPRESS_MIN_SIZE = int(os.environ.get('TUBE_SNATCH_COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_MIMETYPES = ('application/json',)
+COMPRESSORS = {'gzip': lambda data: gzip.compress(data, compresslevel=6, mtime=0)}
+if zstandard is not None:
+    COMPRESSORS['zstd'] = zstandard.ZstdCompressor(level=3).compress
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=4)
+# Preferred first when the client accepts several equally
+COMPRESS_ENCODINGS = [encoding for encoding in ('zstd', 'br', 'gzip') if encoding in COMPRESSORS]
+
+def dumps_json(data):
+    """Compact JSON text - through orjson when it is installed, which is several times faster on big lists"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data, separators=(',', ':'))
+
+def json_response(data, status=200):
+    """jsonify for the big list endpoints"""
+    return Response(dumps_json(data), status=status, mimetype='application/json')
+
+def change_versions(tables):
+    """Current change counter of each table, bumped by triggers on every write to it"""
+    rows = db_query(f"SELECT name, version FROM change_counters WHERE name IN ({sql_placeholders(tables)})", tables)
+    versions = {row['name']: row['version'] for row in rows}
+    return '.'.join(f"{table}-{versions.get(table, 0)}" for table in tables)
+
+def versioned(*tables, live=None):
+    """Send a weak ETag built from the tables' change counters and answer 304 while they stand still.
+
+    ``live`` adds the version of in-memory state the response also depends on.
+
+    The counters are read before the view runs, so a write that races the
+    response can only make the client fetch once more, never keep a stale
+    copy. Revalidating costs one primary-key read instead of the view's query.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = change_versions(tables)
+            if live:
+                etag += f".{live()}"
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
+
+@app.after_request
+def compress_response(response):
+    """Compress buffered JSON bodies of COMPRESS_MIN_SIZE bytes or more with the best encoding the client takes.
+
+    Streamed bodies (SSE, NDJSON, files) go out untouched.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESS_MIMETYPES or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.content_length is not None and response.content_length < COMPRESS_MIN_SIZE:
+        return response
+    encoding = request.accept_encodings.best_match(COMPRESS_ENCODINGS)
+    if not encoding:
+        return response
+    response.set_data(COMPRESSORS[encoding](response.get_data()))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# Download job store - every queued/running download lives in the download_jobs table
+JOB_STATES = ('queued', 'running', 'merging', 'done', 'failed')
+ACTIVE_JOB_STATES = ('queued', 'running', 'merging')
+MAX_DOWNLOAD_ATTEMPTS = int(os.environ.get('TUBE_SNATCH_MAX_DOWNLOAD_ATTEMPTS', '3'))
+PROGRESS_WRITE_INTERVAL = 1.0  # seconds between byte-counter writes per job
+
+# Status names the frontend has always seen in /api/download-progress
+LEGACY_JOB_STATUS = {
+    'queued': 'queued',
+    'running': 'downloading',
+    'merging': 'merging',
+    'done': 'completed',
+    'failed': 'error',
+}
+
+def save_download_jobs(jobs):
+    """Persist freshly queued jobs in one transaction"""
+    now = time.time()
+    db_executemany('''INSERT INTO download_jobs
+                      (job_id, video_id, resolution, priority, channel_id, state, created_at, updated_at)
+                      VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)''',
+                   [(job.job_id, job.video_id, job.resolution, job.priority, job.channel_id, now, now)
+                    for job in jobs])
+    for job in jobs:
+        job_events.publish('job', {
+            'job_id': job.job_id,
+            'video_id': job.video_id,
+            'status': 'queued',
+            'state': 'queued',
+            'progress': 0,
+            'downloaded_bytes': 0,
+            'total_bytes': None,
+            'attempts': 0,
+            'updated_at': now,
+        })
+
+def update_download_job(job_id, **fields):
+    fields['updated_at'] = time.time()
+    assignments = ", ".join(f"{name}=?" for name in fields)
+    db_execute(f"UPDATE download_jobs SET {assignments} WHERE job_id=?", (*fields.values(), job_id))
+    if 'state' in fields:
+        publish_job_state(job_id)
+
+def load_active_jobs():
+    """Jobs that were queued or in flight, oldest first"""
+    return db_query(f"SELECT * FROM download_jobs WHERE state IN ({sql_placeholders(ACTIVE_JOB_STATES)}) "
+                    "ORDER BY created_at", ACTIVE_JOB_STATES)
+
+def job_progress_entry(row):
+    """Shape a download_jobs row like the old in-memory progress entries"""
+    downloaded = row['downloaded_bytes'] or 0
+    total = row['total_bytes'] or 0
+    if row['state'] == 'done':
+        progress = 100
+    else:
+        progress = int(downloaded * 100 / total) if total else 0
+    entry = {
+        'job_id': row['job_id'],
+        'status': LEGACY_JOB_STATUS.get(row['state'], row['state']),
+        'state': row['state'],
+        'progress': min(progress, 100),
+        'downloaded_bytes': downloaded,
+        'total_bytes': row['total_bytes'],
+        'attempts': row['attempts'],
+        'updated_at': row['updated_at'],
+    }
+    if row['file_path']:
+        entry['file_path'] = row['file_path']
+    if row['error']:
+        entry['message'] = row['error']
+    return entry
+
+# Download job events - pushed to /api/download-events subscribers
+PROGRESS_EVENT_MAX_HZ = float(os.environ.get('TUBE_SNATCH_PROGRESS_EVENT_MAX_HZ', '2'))
+JOB_EVENT_BACKLOG = 2000
+
+class JobEventBus:
+    """Delta feed of download job changes.
+
+    State changes go out as they happen. Progress ticks are coalesced per job
+    to at most ``max_rate`` a second, the newest tick winning. Recent events
+    stay in a ring buffer so a reconnecting client can resume from its
+    Last-Event-ID; event IDs carry a per-process epoch so IDs from before a
+    restart are recognised as stale.
+    """
+
+    def __init__(self, backlog, max_rate):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = collections.deque(maxlen=backlog)  # (seq, event_type, data)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self._last_progress = {}  # job_id -> monotonic time of its last progress event
+        self._pending_progress = {}  # job_id -> (due_at, data) held back by the rate limit
+        self.closed = False
+
+    def close(self):
+        """Release every waiting subscriber; used when the process shuts down"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def event_id(self, seq):
+        return f"{self.epoch}:{seq}"
+
+    def parse_event_id(self, event_id):
+        """Sequence number of one of our event IDs, or None if it is from another process lifetime"""
+        epoch, _, seq = (event_id or '').partition(':')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _append(self, event_type, data):
+        self._seq += 1
+        self._events.append((self._seq, event_type, data))
+        self._cond.notify_all()
+
+    def publish(self, event_type, data):
+        with self._cond:
+            job_id = data.get('job_id') if isinstance(data, dict) else None
+            if event_type == 'job' and job_id:
+                # A state change carries the latest counters, so a held-back tick is stale
+                self._pending_progress.pop(job_id, None)
+                if data.get('state') in ('done', 'failed'):
+                    self._last_progress.pop(job_id, None)
+            self._append(event_type, data)
+
+    def publish_progress(self, job_id, data):
+        now = time.monotonic()
+        with self._cond:
+            last = self._last_progress.get(job_id)
+            if last is None or now - last >= self._min_interval:
+                self._last_progress[job_id] = now
+                self._pending_progress.pop(job_id, None)
+                self._append('progress', data)
+            else:
+                self._pending_progress[job_id] = (last + self._min_interval, data)
+                self._cond.notify_all()
+
+    def _flush_due(self, now):
+        for job_id, (due_at, data) in list(self._pending_progress.items()):
+            if due_at <= now:
+                del self._pending_progress[job_id]
+                self._last_progress[job_id] = now
+                self._append('progress', data)
+
+    def current_seq(self):
+        with self._cond:
+            return self._seq
+
+    def wait(self, after_seq, timeout):
+        """Events newer than ``after_seq``; [] on timeout, None if the backlog no longer reaches back that far"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._flush_due(now)
+                if self._seq > after_seq:
+                    if not self._events or self._events[0][0] > after_seq + 1:
+                        return None
+                    return [event for event in self._events if event[0] > after_seq]
+                if now >= deadline or self.closed:
+                    return []
+                wake_at = min([deadline] + [due for due, _ in self._pending_progress.values()])
+                self._cond.wait(max(wake_at - now, 0.01))
+
+job_events = JobEventBus(JOB_EVENT_BACKLOG, PROGRESS_EVENT_MAX_HZ)
+
+def publish_job_state(job_id):
+    row = db_query_one("SELECT * FROM download_jobs WHERE job_id=?", (job_id,))
+    if row:
+        job_events.publish('job', dict(job_progress_entry(row), video_id=row['video_id']))
+
+# Download scheduler - a fixed pool of workers instead of one thread per video
+DOWNLOAD_WORKERS = int(os.environ.get('TUBE_SNATCH_DOWNLOAD_WORKERS', '3'))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {'interactive': PRIORITY_INTERACTIVE, 'bulk': PRIORITY_BULK}
+PRIORITY_LABELS = {value: name for name, value in PRIORITY_NAMES.items()}
+
+class DownloadJob:
+    """One queued or running download"""
+
+    def __init__(self, video_id, resolution, priority, channel_id, channel_round, seq, job_id=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.video_id = video_id
+        self.resolution = resolution
+        self.priority = priority
+        self.channel_id = channel_id
+        self.channel_round = channel_round
+        self.seq = seq
+        self.status = 'queued'
+
+    def sort_key(self):
+        return (self.priority, self.channel_round, self.seq)
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+class DownloadCheckpointed(Exception):
+    """Raised from a progress hook to stop a download at shutdown; yt-dlp keeps its .part file"""
+
+class DownloadScheduler:
+    """Fixed-size worker pool fed by a priority queue.
+
+    Jobs are ordered by (priority, channel round, arrival). Every channel keeps
+    its own round counter, so a bulk grab of 800 videos from one channel is
+    interleaved FIFO with other channels instead of starving them.
+    """
+
+    def __init__(self, worker_count, handler):
+        self.worker_count = max(1, worker_count)
+        self._handler = handler
+        self._heap = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._channel_rounds = {}  # (priority, channel_id) -> last round handed out
+        self._served_round = {}  # priority -> round of the last job picked up
+        self._jobs = {}  # video_id -> queued/running job
+        self._running = 0
+        self._workers = []
+        self.draining = False  # shutting down: queued jobs stay queued for the next start
+        self.checkpointing = False  # running downloads are asked to stop where they are
+        # Bumped whenever queue positions can move; with the epoch it tags /api/download-progress
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+
+    def _ensure_started(self):
+        # Started lazily so importing the module (reloader, WSGI servers) spawns nothing
+        if self._workers:
+            return
+        for index in range(self.worker_count):
+            worker = threading.Thread(target=self._worker_loop, name=f'download-worker-{index}', daemon=True)
+            self._workers.append(worker)
+            worker.start()
+        logger.info(f"Download scheduler started with {self.worker_count} workers")
+
+    def submit_many(self, requests, priority, persist=None):
+        """Queue (video_id, resolution, channel_id) requests at one priority.
+
+        Returns a list of (job, created). Videos that already have an active job
+        are not queued twice. New jobs are handed to ``persist`` before any
+        worker can see them.
+        """
+        results = []
+        new_jobs = []
+        with self._cond:
+            self._ensure_started()
+            for video_id, resolution, channel_id in requests:
+                existing = self._jobs.get(video_id)
+                if existing:
+                    if existing.status == 'queued' and priority < existing.priority:
+                        # Re-requested interactively - promote it ahead of the bulk queue
+                        existing.priority = priority
+                        existing.channel_round = self._next_round(priority, existing.channel_id)
+                        heapq.heapify(self._heap)
+                        self.version += 1
+                    results.append((existing, False))
+                    continue
+                job = DownloadJob(video_id, resolution, priority, channel_id,
+                                  self._next_round(priority, channel_id), next(self._seq))
+                self._jobs[video_id] = job
+                new_jobs.append(job)
+                results.append((job, True))
+            if new_jobs and persist:
+                persist(new_jobs)
+            self._push(new_jobs)
+        return results
+
+    def restore(self, rows):
+        """Requeue jobs recovered from the job store, keeping their IDs"""
+        with self._cond:
+            self._ensure_started()
+            jobs = []
+            for row in rows:
+                if row['video_id'] in self._jobs:
+                    continue
+                job = DownloadJob(row['video_id'], row['resolution'], row['priority'], row['channel_id'],
+                                  self._next_round(row['priority'], row['channel_id']), next(self._seq),
+                                  job_id=row['job_id'])
+                self._jobs[job.video_id] = job
+                jobs.append(job)
+            self._push(jobs)
+        return jobs
+
+    def _push(self, jobs):
+        for job in jobs:
+            heapq.heappush(self._heap, job)
+        if jobs:
+            self.version += 1
+        self._cond.notify(len(jobs))
+
+    def _next_round(self, priority, channel_id):
+        key = (priority, channel_id)
+        channel_round = max(self._channel_rounds.get(key, -1) + 1, self._served_round.get(priority, 0))
+        self._channel_rounds[key] = channel_round
+        return channel_round
+
+    def queue_positions(self):
+        """Map job_id -> 1-based position for every queued job"""
+        with self._cond:
+            ordered = sorted(self._heap)
+        return {job.job_id: position for position, job in enumerate(ordered, start=1)}
+
+    def adopt(self, job_ids, load_queued_rows):
+        """Queue jobs another process stored, returning (adopted jobs, duplicate job IDs).
+
+        Rows are re-read under the scheduler lock: a worker records a job's final
+        state before letting go of it, so a job that just finished here is seen
+        as done rather than run twice. A stored job for a video that already has
+        one here is a duplicate.
+        """
+        with self._cond:
+            known = {job.job_id for job in self._jobs.values()}
+            job_ids = [job_id for job_id in job_ids if job_id not in known]
+            if not job_ids:
+                return [], []
+            rows = load_queued_rows(job_ids)
+            duplicates = [row['job_id'] for row in rows if row['video_id'] in self._jobs]
+            return self.restore([row for row in rows if row['video_id'] not in self._jobs]), duplicates
+
+    def drain(self, timeout):
+        """Stop starting jobs and wait up to ``timeout`` seconds for running ones; returns those still running"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.draining = True
+            while self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [job for job in self._jobs.values() if job.status == 'running']
+
+    def checkpoint(self, timeout):
+        """Ask running downloads to stop where they are and wait up to ``timeout`` seconds for them"""
+        with self._cond:
+            self.checkpointing = True
+        return self.drain(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.worker_count,
+                'active_workers': self._running,
+                'queued': len(self._heap),
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self.draining:
+                    self._cond.wait()
+                job = heapq.heappop(self._heap)
+                self._served_round[job.priority] = job.channel_round
+                job.status = 'running'
+                self._running += 1
+                self.version += 1
+            try:
+                self._handler(job)
+            except Exception as e:
+                logger.error(f"Download worker crashed on {job.video_id}: {str(e)}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._jobs.pop(job.video_id, None)
+                    self.version += 1
+                    self._cond.notify_all()
+
+# Bandwidth and connection sharing between library downloads
+def parse_rate(value):
+    """Bytes per second from '0', '2500000', '10M' or '512K'; 0 means unlimited"""
+    return int(yt_dlp.utils.parse_bytes(value) or 0) if value not in (None, '', '0') else 0
+
+GLOBAL_RATE_LIMIT = parse_rate(os.environ.get('TUBE_SNATCH_GLOBAL_RATE_LIMIT', '0'))
+JOB_RATE_LIMIT = parse_rate(os.environ.get('TUBE_SNATCH_JOB_RATE_LIMIT', '0'))
+FRAGMENT_CONNECTIONS = int(os.environ.get('TUBE_SNATCH_FRAGMENT_CONNECTIONS', '4'))  # per job, for DASH/HLS formats
+MAX_CONNECTIONS = int(os.environ.get('TUBE_SNATCH_MAX_CONNECTIONS', '16'))  # across all jobs; 0 for no cap
+RATE_BURST_SECONDS = 1.0  # bucket depth, in seconds of the configured rate
+PRIORITY_WEIGHTS = {PRIORITY_INTERACTIVE: 4, PRIORITY_BULK: 1}
+
+class BandwidthJob:
+    """Per-job token bucket and fair-queueing clock"""
+
+    def __init__(self, weight, rate, now):
+        self.weight = weight
+        self.rate = rate
+        self.tokens = rate * RATE_BURST_SECONDS
+        self.updated = now
+        self.finish_tag = 0.0
+
+class BandwidthScheduler:
+    """Shares download bandwidth and connections between running jobs.
+
+    yt-dlp reports each block it reads through the progress hook, which calls
+    ``consume``; that blocks until the bytes fit under both the global and the
+    job's own token bucket, so the socket read that follows is held back too.
+    Waiting blocks are granted in self-clocked fair queueing order, weighted by
+    priority: a job reading over eight fragment connections gets no more than
+    one reading over a single connection, and interactive downloads overtake
+    bulk ones. Buckets may go into debt by one block, which keeps the
+    sustained rate exact whatever yt-dlp's read size.
+    """
+
+    def __init__(self, global_rate, job_rate, fragment_connections, max_connections):
+        self.global_rate = global_rate
+        self.job_rate = job_rate
+        self.fragment_connections = max(1, fragment_connections)
+        self.max_connections = max_connections
+        self._cond = threading.Condition()
+        self._tokens = global_rate * RATE_BURST_SECONDS
+        self._updated = time.monotonic()
+        self._jobs = {}  # job_id -> BandwidthJob
+        self._waiting = []  # heap of (finish tag, seq, job, [nbytes, granted])
+        self._seq = itertools.count()
+        self._virtual_time = 0.0  # finish tag of the last granted block
+        self._connections = 0
+
+    def start_job(self, job_id, priority):
+        """Register a job and reserve its connections; returns how many fragment connections it may open.
+
+        Every job gets at least one connection, waiting for it under the cap.
+        """
+        with self._cond:
+            while self.max_connections and self._connections >= self.max_connections:
+                self._cond.wait()
+            connections = self.fragment_connections
+            if self.max_connections:
+                connections = min(connections, self.max_connections - self._connections)
+            self._connections += connections
+            self._jobs[job_id] = BandwidthJob(PRIORITY_WEIGHTS.get(priority, 1), self.job_rate, time.monotonic())
+            return connections
+
+    def finish_job(self, job_id, connections):
+        with self._cond:
+            self._jobs.pop(job_id, None)
+            self._connections -= connections
+            self._cond.notify_all()
+
+    def consume(self, job_id, nbytes):
+        """Block until ``nbytes`` more may be downloaded for the job"""
+        if nbytes <= 0 or not (self.global_rate or self.job_rate):
+            return
+        started = time.monotonic()
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            # An idle job restarts from the current virtual time instead of cashing in its idle spell
+            job.finish_tag = max(self._virtual_time, job.finish_tag) + nbytes / job.weight
+            request = [nbytes, False]
+            heapq.heappush(self._waiting, (job.finish_tag, next(self._seq), job, request))
+            while True:
+                delay = self._dispatch(time.monotonic())
+                if request[1]:
+                    break
+                self._cond.wait(delay)
+        BANDWIDTH_WAIT_SECONDS.inc(time.monotonic() - started)
+
+    def _refill(self, now):
+        if self.global_rate:
+            self._tokens = min(self._tokens + (now - self._updated) * self.global_rate,
+                               self.global_rate * RATE_BURST_SECONDS)
+        self._updated = now
+        for job in self._jobs.values():
+            if job.rate:
+                job.tokens = min(job.tokens + (now - job.updated) * job.rate, job.rate * RATE_BURST_SECONDS)
+            job.updated = now
+
+    def _dispatch(self, now):
+        """Grant whatever the buckets allow; returns seconds until it is worth looking again"""
+        self._refill(now)
+        granted = False
+        held = []  # blocks of jobs that are over their own limit
+        while self._waiting and (not self.global_rate or self._tokens >= 0):
+            entry = heapq.heappop(self._waiting)
+            finish_tag, _, job, request = entry
+            if job.rate and job.tokens < 0:
+                held.append(entry)
+                continue
+            request[1] = True
+            granted = True
+            self._virtual_time = finish_tag
+            self._tokens -= request[0]
+            job.tokens -= request[0]
+        for entry in held:
+            heapq.heappush(self._waiting, entry)
+        if granted:
+            self._cond.notify_all()
+        
+        delays = []
+        if self.global_rate and self._tokens < 0:
+            delays.append(-self._tokens / self.global_rate)
+        delays.extend(-job.tokens / job.rate for _, _, job, _ in held)
+        return max(min(delays), 0.001) if delays else 1.0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'global_rate_limit': self.global_rate,
+                'job_rate_limit': self.job_rate,
+                'fragment_connections': self.fragment_connections,
+                'max_connections': self.max_connections,
+                'connections': self._connections,
+                'throttled_jobs': len({id(job) for _, _, job, _ in self._waiting}),
+            }
+
+bandwidth_scheduler = BandwidthScheduler(GLOBAL_RATE_LIMIT, JOB_RATE_LIMIT, FRAGMENT_CONNECTIONS, MAX_CONNECTIONS)
+
+# Incremental sync stops walking a channel after this many already-known videos in a row
+KNOWN_RUN_STOP = int(os.environ.get('TUBE_SNATCH_KNOWN_RUN_STOP', '30'))
+# A listing this big (or an incremental walk that reached known videos) ends the search
+GOOD_ENOUGH_VIDEOS = 50
+# 'race' runs strategy/URL candidates concurrently, 'serial' tries them one at a time
+DEFAULT_FETCH_MODE = os.environ.get('TUBE_SNATCH_FETCH_MODE', 'race')
+FETCH_RACE_FANOUT = int(os.environ.get('TUBE_SNATCH_FETCH_RACE_FANOUT', '4'))
+
+class ExtractionCancelled(Exception):
+    """Raised inside a channel walk once its candidate lost the race or timed out"""
+
+def extract_channel_listing(ydl, url):
+    """Extract a channel tab without processing it, so entries are fetched page by page as they are iterated"""
+    info = ydl.extract_info(url, download=False, process=False)
+    for _ in range(3):
+        # Channel home pages answer with a redirect to one of their tabs
+        if not info or info.get('_type') not in ('url', 'url_transparent'):
+            break
+        info = ydl.extract_info(info['url'], download=False, process=False)
+    return info
+
+class ChannelWalk:
+    """One lazy walk of a channel tab, newest first.
+
+    ``open()`` requests the tab's first page; iterating then yields video
+    dicts while yt-dlp fetches further pages on demand, so only the ids of the
+    videos seen so far stay in memory. With a ``known_ids_loader`` the walk
+    stops once ``stop_after_known`` consecutive videos are already in the
+    library, so a re-sync only pages through the new uploads. Setting
+    ``cancel_event`` aborts the walk before the next entry (and so before the
+    next page request).
+    """
+
+    def __init__(self, opts, url, known_ids_loader=None, stop_after_known=KNOWN_RUN_STOP, cancel_event=None):
+        self.opts = opts
+        self.url = url
+        self.known_ids_loader = known_ids_loader
+        self.stop_after_known = stop_after_known
+        self.cancel_event = cancel_event
+        self.channel_name = "Unknown Channel"
+        self.channel_id = "unknown"
+        self.new_count = 0
+        self.stopped_early = False
+        self.finished = False
+        self._ydl = None
+        self._videos = None
+
+    def check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ExtractionCancelled(self.url)
+
+    def open(self):
+        """Fetch the first page; returns False if the URL has no listing"""
+        self._ydl = yt_dlp.YoutubeDL(self.opts)
+        try:
+            info = extract_channel_listing(self._ydl, self.url)
+            self.check_cancelled()
+        except BaseException:
+            self.close()
+            raise
+        if not info:
+            self.close()
+            return False
+        self.channel_name = info.get('channel') or info.get('uploader') or info.get('title') or "Unknown Channel"
+        self.channel_id = info.get('channel_id') or info.get('id') or "unknown"
+        self._videos = self._walk(info.get('entries') or [])
+        return True
+
+    def __iter__(self):
+        return self._videos if self._videos is not None else iter(())
+
+    def _walk(self, entries):
+        known_ids = self.known_ids_loader(self.channel_id) if self.known_ids_loader else set()
+        limit = self.opts.get('playlistend')
+        seen_video_ids = set()
+        known_run = 0
+        
+        for entry in entries:
+            self.check_cancelled()
+            if not entry:
+                continue
+            
+            video_id = entry.get('id', '')
+            if not video_id or video_id in seen_video_ids:
+                continue
+            seen_video_ids.add(video_id)
+            
+            if video_id in known_ids:
+                known_run += 1
+            else:
+                known_run = 0
+                self.new_count += 1
+            
+            duration = entry.get('duration_string')
+            if not duration and entry.get('duration'):
+                duration = yt_dlp.utils.formatSeconds(int(entry['duration']))
+            
+            yield {
+                'video_id': video_id,
+                'title': entry.get('title', 'Unknown Title'),
+                'thumbnail_url': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg",  # Generate thumbnail URL manually
+                'duration': duration or 'Unknown',
+                'resolutions': ['highest'],  # Always use highest quality
+                'channel_id': self.channel_id,
+                'channel_name': self.channel_name
+            }
+            
+            if known_ids and known_run >= self.stop_after_known:
+                self.stopped_early = True
+                break
+            if limit and len(seen_video_ids) >= limit:
+                break
+        self.finished = True
+
+    def close(self):
+        if self._videos is not None:
+            self._videos.close()
+        if self._ydl is not None:
+            self._ydl.close()
+            self._ydl = None
+
+def probe_channel_walk(opts, url, known_ids_loader=None, cancel_event=None, limit=GOOD_ENOUGH_VIDEOS):
+    """Open a walk and read its first ``limit`` videos.
+
+    Returns None if the URL has no listing, else ``(walk, videos)``. A walk
+    with more to come is left open, so the winning candidate can be read on
+    from where its probe stopped; whoever gets it must close it.
+    """
+    walk = ChannelWalk(opts, url, known_ids_loader, cancel_event=cancel_event)
+    try:
+        if not walk.open():
+            return None
+        videos = list(itertools.islice(walk, limit))
+        walk.check_cancelled()  # Lost while probing - nobody is going to read on
+    except BaseException:
+        walk.close()
+        raise
+    if walk.finished:
+        walk.close()
+    return walk, videos
+
+def build_extraction_strategies(content_type):
+    # UNCLE HYDE'S MEGA CHANNEL STRATEGIES - no listing cap, the winning walk streams into the library
+    return [
         {
+            'id': 'mega_channel_destroyer',  # Stable key for metrics
             'name': '🏆 MEGA CHANNEL DESTROYER',
             'timeout': 40,  # MAXIMUM timeout for channels like MrBeast (900+ videos)
             'opts': {
                 'quiet': True,
                 'no_warnings': True,
                 'extract_flat': True,
-                'playlistend': 2000,  # MASSIVE limit for mega channels like MrBeast
                 'socket_timeout': 35,
                 'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
                 'extractor_args': {
@@ -82,13 +1129,13 @@ def fetch_channel_with_ytdlp(channel_url, content_type='videos'):
             }
         },
         {
+            'id': 'lightning_web',  # Stable key for metrics
             'name': '⚡ Lightning Web Client',
             'timeout': 20,
             'opts': {
                 'quiet': True,
                 'no_warnings': True,
                 'extract_flat': True,
-                'playlistend': 1500,
                 'socket_timeout': 15,
                 'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
                 'extractor_args': {
@@ -100,13 +1147,13 @@ def fetch_channel_with_ytdlp(channel_url, content_type='videos'):
             }
         },
         {
+            'id': 'rapid_android',  # Stable key for metrics
             'name': '🚀 Rapid Android Client',
             'timeout': 15,  # Increased timeout
             'opts': {
                 'quiet': True,
                 'no_warnings': True,
                 'extract_flat': True,
-                'playlistend': 1800,  # Increased limit
                 'socket_timeout': 12,
                 'user_agent': 'com.google.android.youtube/17.36.4 (Linux; U; Android 12) gzip',
                 'extractor_args': {
@@ -117,13 +1164,13 @@ def fetch_channel_with_ytdlp(channel_url, content_type='videos'):
             }
         },
         {
+            'id': 'mega_channel_crusher',  # Stable key for metrics
             'name': '🔥 Mega Channel Crusher',
             'timeout': 25,  # Longest timeout for massive channels
             'opts': {
                 'quiet': True,
                 'no_warnings': True,
                 'extract_flat': True,
-                'playlistend': 1800,  # Increased limit
                 'socket_timeout': 20,
                 'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
                 'extractor_args': {
@@ -136,23 +1183,19 @@ def fetch_channel_with_ytdlp(channel_url, content_type='videos'):
             }
         },
         {
+            'id': 'speed_demon_basic',  # Stable key for metrics
             'name': '💨 Speed Demon Basic',
             'timeout': 12,  # Increased timeout
             'opts': {
                 'quiet': True,
                 'no_warnings': True,
                 'extract_flat': True,
-                'playlistend': 1800,  # Increased limit
                 'socket_timeout': 10
             }
         }
     ]
-    
-    all_videos = []
-    seen_video_ids = set()
-    channel_name = "Unknown Channel"
-    channel_id = "unknown"
-    
+
+def channel_url_variations(channel_url, content_type):
     # Prioritize URL patterns based on content type
     if content_type == 'videos':
         url_variations = [
@@ -178,6 +1221,210 @@ def fetch_channel_with_ytdlp(channel_url, content_type='videos'):
             f"{channel_url.rstrip('/')}/videos",
             channel_url
         ]
+    return url_variations
+
+class ChannelListing:
+    """The videos found by walks of the same channel, first sighting wins.
+
+    Probes are merged into ``videos``; the winning walk stays open as
+    ``continuation`` and is only read on by ``ingest_channel_listing``, a
+    batch at a time.
+    """
+
+    def __init__(self):
+        self.videos = []
+        self.seen_video_ids = set()
+        self.channel_name = "Unknown Channel"
+        self.channel_id = "unknown"
+        self.continuation = None
+        self.scanned_count = 0
+        self.complete = True
+
+    def add(self, walk, videos):
+        """Merge one probe; returns how many videos it added"""
+        self.channel_name = walk.channel_name
+        self.channel_id = walk.channel_id
+        added = 0
+        for video_data in videos:
+            if video_data['video_id'] in self.seen_video_ids:
+                continue
+            self.seen_video_ids.add(video_data['video_id'])
+            self.videos.append(video_data)
+            added += 1
+        return added
+
+    def continue_with(self, walk):
+        """Keep reading the winning walk after its probe, if it has more"""
+        if not walk.finished:
+            self.continuation = walk
+
+    def iter_continuation(self):
+        """The rest of the winning walk as it pages on.
+
+        A walk that breaks off part way leaves ``complete`` False instead of
+        failing the fetch; everything read up to then is kept.
+        """
+        if self.continuation is None:
+            return
+        try:
+            for video_data in self.continuation:
+                if video_data['video_id'] not in self.seen_video_ids:
+                    yield video_data
+        except Exception as e:
+            self.complete = False
+            logger.warning(f"⚠️ Channel walk broke off after {self.scanned_count} videos: {str(e)[:100]}")
+
+    def close(self):
+        if self.continuation is not None:
+            self.continuation.close()
+
+# Adaptive strategy planning - learned from extraction_attempts
+STRATEGY_STATS_WINDOW = 7 * 24 * 3600
+STRATEGY_STATS_SAMPLE = 50  # most recent attempts per strategy that count
+STRATEGY_STATS_RETENTION = 30 * 24 * 3600
+STRATEGY_MIN_SAMPLES = 5  # successes needed before a timeout is derived from latency
+STRATEGY_MIN_TIMEOUT = 5
+STRATEGY_PRIOR_LATENCY = 10  # assumed for strategies without successes, the same for all so ties keep the hand-tuned order
+STRATEGY_MAX_TIMEOUT = 60
+STRATEGY_TIMEOUT_HEADROOM = 1.5
+CIRCUIT_FAILURE_THRESHOLD = 5  # consecutive failures that open a strategy's circuit
+CIRCUIT_COOLDOWN = 15 * 60
+ADAPTIVE_STRATEGIES = os.environ.get('TUBE_SNATCH_ADAPTIVE_STRATEGIES', '1') != '0'
+FAILED_OUTCOMES = ('failure', 'timeout', 'empty')
+
+_attempts_recorded = itertools.count(1)
+
+def url_variant(url):
+    """Which kind of channel URL this is: 'videos', 'shorts', 'featured', ... or 'channel' for the bare URL"""
+    tail = url.rstrip('/').rsplit('/', 1)[-1]
+    return tail if tail in ('videos', 'shorts', 'streams', 'live', 'featured') else 'channel'
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+def load_strategy_stats(now=None):
+    """Recent outcomes per strategy and per URL variant, newest first"""
+    now = now or time.time()
+    rows = db_query("SELECT strategy, url_variant, outcome, seconds, created_at FROM extraction_attempts "
+                    "WHERE created_at > ? ORDER BY created_at DESC LIMIT 5000", (now - STRATEGY_STATS_WINDOW,))
+    by_strategy = collections.defaultdict(list)
+    by_variant = collections.defaultdict(list)
+    for row in rows:
+        if len(by_strategy[row['strategy']]) < STRATEGY_STATS_SAMPLE:
+            by_strategy[row['strategy']].append(row)
+        by_variant[row['url_variant']].append(row)
+    return by_strategy, by_variant
+
+def success_rate(attempts):
+    """Laplace-smoothed, so an untried strategy starts at 50% rather than 0 or 100"""
+    successes = sum(1 for attempt in attempts if attempt['outcome'] == 'success')
+    return (successes + 1) / (len(attempts) + 2)
+
+def plan_extraction_strategies(strategies, url_variations, now=None):
+    """Order, time and filter strategies and URLs by how they have been doing.
+
+    Strategies are sorted by expected time to a successful walk (median
+    success latency over smoothed success rate). Once a strategy has enough
+    successes its timeout becomes its p90 latency plus headroom, but never
+    less than half its hand-tuned value so full walks of big channels still
+    fit. A strategy whose last CIRCUIT_FAILURE_THRESHOLD attempts all failed
+    sits out for CIRCUIT_COOLDOWN, after which one attempt is let through
+    (half-open).
+    With no history this returns the hand-tuned order and timeouts unchanged.
+    """
+    now = now or time.time()
+    by_strategy, by_variant = load_strategy_stats(now)
+    planned = []
+    for position, strategy in enumerate(strategies):
+        attempts = by_strategy.get(strategy['id'], [])
+        latencies = sorted(attempt['seconds'] for attempt in attempts
+                           if attempt['outcome'] == 'success' and attempt['seconds'] is not None)
+        timeout = strategy['timeout']
+        if len(latencies) >= STRATEGY_MIN_SAMPLES:
+            floor = max(STRATEGY_MIN_TIMEOUT, strategy['timeout'] / 2)
+            timeout = min(max(percentile(latencies, 0.9) * STRATEGY_TIMEOUT_HEADROOM, floor), STRATEGY_MAX_TIMEOUT)
+        expected_latency = percentile(latencies, 0.5) if latencies else STRATEGY_PRIOR_LATENCY
+        recent = attempts[:CIRCUIT_FAILURE_THRESHOLD]
+        circuit_open = (len(recent) == CIRCUIT_FAILURE_THRESHOLD
+                        and all(attempt['outcome'] in FAILED_OUTCOMES for attempt in recent)
+                        and now - recent[0]['created_at'] < CIRCUIT_COOLDOWN)
+        planned.append({
+            'strategy': dict(strategy, timeout=round(timeout, 1)),
+            'score': expected_latency / success_rate(attempts),
+            'position': position,
+            'circuit_open': circuit_open,
+            'last_attempt': recent[0]['created_at'] if recent else 0,
+        })
+    
+    available = [entry for entry in planned if not entry['circuit_open']]
+    if not available:
+        # Everything is tripped - still try the one that has been resting longest
+        available = [min(planned, key=lambda entry: entry['last_attempt'])]
+    for entry in planned:
+        if entry['circuit_open'] and entry not in available:
+            logger.info(f"   🔌 Circuit open for {entry['strategy']['name']} - skipping for now")
+    available.sort(key=lambda entry: (entry['score'], entry['position']))
+    
+    # URL variants keep their content-type order unless history clearly says otherwise
+    ordered_urls = sorted(url_variations, key=lambda url: (-round(success_rate(by_variant.get(url_variant(url), [])), 1),
+                                                            url_variations.index(url)))
+    return [entry['strategy'] for entry in available], ordered_urls
+
+def fetch_channel_with_ytdlp(channel_url, content_type='videos', known_ids_loader=None, mode=DEFAULT_FETCH_MODE):
+    """⚡ UNCLE HYDE'S LIGHTNING FAST FETCH - No timeouts, maximum speed!"""
+    logger.info(f"⚡ UNCLE HYDE'S SPEED DEMON MODE! Fetching {content_type} from: {channel_url} ({mode})")
+    
+    strategies = build_extraction_strategies(content_type)
+    url_variations = channel_url_variations(channel_url, content_type)
+    if ADAPTIVE_STRATEGIES:
+        try:
+            strategies, url_variations = plan_extraction_strategies(strategies, url_variations)
+            plan = ', '.join(f"{strategy['id']} ({strategy['timeout']}s)" for strategy in strategies)
+            logger.info(f"🧠 Strategy plan: {plan}")
+        except Exception as e:
+            logger.warning(f"Could not plan strategies from history, using defaults: {str(e)}")
+    
+    if mode == 'race':
+        listing = race_channel_walks(strategies, url_variations, known_ids_loader)
+    else:
+        listing = walk_channel_serially(strategies, url_variations, known_ids_loader)
+    
+    more = ' and streaming the rest' if listing.continuation else ''
+    logger.info(f"🚀 FINAL RESULT: {len(listing.videos)} VIDEOS for '{listing.channel_name}'{more}!")
+    
+    if len(listing.videos) > 0:
+        return listing
+    else:
+        logger.error("💥 SPEED DEMON COULDN'T BREAK THROUGH - YouTube's defenses too strong!")
+        return None
+
+def record_extraction(strategy, url, outcome, seconds=None):
+    """Count one strategy attempt; latency is only observed for attempts that ran to completion.
+
+    Everything but cancellations also goes to extraction_attempts for the
+    adaptive planner - a cancelled loser says nothing about the strategy.
+    """
+    EXTRACTION_ATTEMPTS.labels(strategy['id'], outcome).inc()
+    if seconds is not None:
+        EXTRACTION_SECONDS.labels(strategy['id']).observe(seconds)
+    if outcome == 'cancelled':
+        return
+    now = time.time()
+    try:
+        db_execute("INSERT INTO extraction_attempts (strategy, url_variant, outcome, seconds, created_at) "
+                   "VALUES (?, ?, ?, ?, ?)",
+                   (strategy['id'], url_variant(url), outcome,
+                    strategy['timeout'] if outcome == 'timeout' else seconds, now))
+        if next(_attempts_recorded) % 500 == 0:
+            db_execute("DELETE FROM extraction_attempts WHERE created_at < ?", (now - STRATEGY_STATS_RETENTION,))
+    except sqlite3.Error as e:
+        logger.warning(f"Could not record extraction attempt: {str(e)}")
+
+def walk_outcome(probe):
+    return 'success' if probe and probe[1] else 'empty'
+
+def walk_channel_serially(strategies, url_variations, known_ids_loader):
+    listing = ChannelListing()
     
     # Quick success - if we get results, don't waste time on more URLs
     for strategy in strategies:
@@ -185,86 +1432,58 @@ def fetch_channel_with_ytdlp(channel_url, content_type='videos'):
         
         for test_url in url_variations:
             try:
-                import threading
-                import time
-                
                 logger.info(f"   🎯 RAPID STRIKE: {test_url}")
                 
                 result = [None]  # Use list to store result from thread
                 exception = [None]  # Store any exception
+                cancel_event = threading.Event()
                 
                 def extract_with_timeout():
                     try:
-                        with yt_dlp.YoutubeDL(strategy['opts']) as ydl:
-                            info = ydl.extract_info(test_url, download=False)
-                            result[0] = info
+                        result[0] = probe_channel_walk(strategy['opts'], test_url, known_ids_loader,
+                                                       cancel_event=cancel_event)
                     except Exception as e:
                         exception[0] = e
                 
                 # Start extraction in separate thread
+                started = time.monotonic()
                 thread = threading.Thread(target=extract_with_timeout)
                 thread.daemon = True  # Dies when main thread dies
                 thread.start()
                 thread.join(timeout=strategy['timeout'])
                 
                 if thread.is_alive():
+                    cancel_event.set()  # Stop it paging on in the background
+                    record_extraction(strategy, test_url, 'timeout')
                     logger.warning(f"   ⏰ TIMEOUT! {test_url} took >{strategy['timeout']}s - SKIPPING!")
                     continue
                 
+                probe = result[0]
+                record_extraction(strategy, test_url, 'failure' if exception[0] else walk_outcome(probe),
+                                  time.monotonic() - started)
                 if exception[0]:
                     raise exception[0]
-                
-                info = result[0]
-                if not info:
+
+                if not probe:
                     continue
                 
-                # Update channel info
-                if info.get('title'):
-                    channel_name = info.get('title', channel_name)
-                if info.get('id'):
-                    channel_id = info.get('id', channel_id)
+                walk, videos = probe
+                new_videos_count = listing.add(walk, videos)
                 
-                entries = info.get('entries', [])
-                new_videos_count = 0
+                if walk.stopped_early:
+                    # Ran into videos we already have - everything newer is in hand
+                    logger.info(f"🔁 INCREMENTAL SYNC! {walk.new_count} new videos before the known run - DONE!")
+                    return listing
                 
-                # Process entries quickly
-                for entry in entries:
-                    if not entry:
-                        continue
-                    
-                    video_id = entry.get('id', '')
-                    if not video_id or video_id in seen_video_ids:
-                        continue
-                    
-                    seen_video_ids.add(video_id)
-                    new_videos_count += 1
-                    
-                    # Generate thumbnail URL manually
-                    thumbnail_url = f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-                    
-                    video_data = {
-                        'video_id': video_id,
-                        'title': entry.get('title', 'Unknown Title'),
-                        'thumbnail_url': thumbnail_url,
-                        'duration': entry.get('duration_string', 'Unknown'),
-                        'resolutions': ['highest'],  # Always use highest quality
-                        'channel_id': channel_id,
-                        'channel_name': channel_name
-                    }
-                    all_videos.append(video_data)
+                # If we got a substantial haul (50+ videos), that's enough - the rest streams from this walk
+                if len(listing.videos) >= GOOD_ENOUGH_VIDEOS:
+                    logger.info(f"🏆 JACKPOT SUCCESS! {len(listing.videos)} videos - RETURNING IMMEDIATELY!")
+                    listing.continue_with(walk)
+                    return listing
+                walk.close()
                 
                 if new_videos_count > 0:
                     logger.info(f"   💥 JACKPOT! {new_videos_count} videos!")
-                    
-                    # If we got a substantial haul (50+ videos), that's enough - don't waste user's time!
-                    if len(all_videos) >= 50:
-                        logger.info(f"🏆 JACKPOT SUCCESS! {len(all_videos)} videos - RETURNING IMMEDIATELY!")
-                        return {
-                            'success': True,
-                            'channel_name': channel_name,
-                            'channel_id': channel_id,
-                            'videos': all_videos
-                        }
                     break  # Try next strategy
                     
             except Exception as e:
@@ -272,194 +1491,583 @@ def fetch_channel_with_ytdlp(channel_url, content_type='videos'):
                 continue
         
         # Quick status update
-        if len(all_videos) > 0:
-            logger.info(f"📊 Speed check: {len(all_videos)} videos collected")
+        if len(listing.videos) > 0:
+            logger.info(f"📊 Speed check: {len(listing.videos)} videos collected")
     
-    logger.info(f"🚀 FINAL RESULT: {len(all_videos)} VIDEOS for '{channel_name}'!")
-    
-    if len(all_videos) > 0:
-        return {
-            'success': True,
-            'channel_name': channel_name,
-            'channel_id': channel_id,
-            'videos': all_videos
-        }
-    else:
-        logger.error("💥 SPEED DEMON COULDN'T BREAK THROUGH - YouTube's defenses too strong!")
-        return None
+    return listing
 
-@app.route('/api/fetch-channel', methods=['POST'])
-def fetch_channel():
-    data = request.get_json()
-    channel_url = data.get('channel_url')
-    content_type = data.get('content_type', 'videos')  # Default to videos
-    
-    # Clean the URL - remove content type suffix if present  
-    if channel_url:
-        for suffix in ['/videos', '/shorts', '/streams', '/live']:
-            if channel_url.endswith(suffix):
-                channel_url = channel_url.replace(suffix, '')
-                break
-    
-    logger.info(f"Received request to fetch {content_type} from channel: {channel_url}")
+def race_channel_walks(strategies, url_variations, known_ids_loader, fanout=FETCH_RACE_FANOUT):
+    """Run strategy/URL candidates concurrently and keep the first good-enough walk.
+
+    At most ``fanout`` candidates are in flight; each one gets its strategy's
+    timeout. As soon as a walk is good enough every other candidate is
+    cancelled. If none is, the partial listings are merged like the serial
+    search does.
+    """
+    # Preferred URL first across all strategies, so the opening wave tries different clients on the best URL
+    candidates = [(strategy, url) for url in url_variations for strategy in strategies]
+    completions = queue.Queue()
+    running = {}  # index -> (cancel_event, deadline, strategy, url, started)
+    listing = ChannelListing()
+    next_index = 0
     
-    if not channel_url:
-        logger.error("No channel URL provided")
-        return jsonify({'error': 'Channel URL is required'}), 400
+    def launch(index, strategy, url, cancel_event):
+        def run():
+            try:
+                probe = probe_channel_walk(strategy['opts'], url, known_ids_loader, cancel_event=cancel_event)
+                completions.put((index, probe, None))
+            except Exception as e:
+                completions.put((index, None, e))
+        threading.Thread(target=run, name=f'channel-race-{index}', daemon=True).start()
     
     try:
-        logger.info(f"Starting to fetch {content_type} from: {channel_url}")
-        
-        # First try yt-dlp which is more reliable
-        ytdlp_result = fetch_channel_with_ytdlp(channel_url, content_type)
-        if ytdlp_result:
-            logger.info("Successfully fetched with yt-dlp")
-            conn = setup_database()
-            c = conn.cursor()
+        while next_index < len(candidates) or running:
+            while next_index < len(candidates) and len(running) < fanout:
+                strategy, url = candidates[next_index]
+                cancel_event = threading.Event()
+                started = time.monotonic()
+                running[next_index] = (cancel_event, started + strategy['timeout'], strategy, url, started)
+                logger.info(f"   🎯 RACING: {strategy['name']} on {url}")
+                launch(next_index, strategy, url, cancel_event)
+                next_index += 1
             
-            channel_id = ytdlp_result['channel_id'] 
-            channel_name = ytdlp_result['channel_name']
-            videos_data = ytdlp_result['videos']
-            
-            # Clear existing videos for this channel
-            c.execute("DELETE FROM videos WHERE channel_id=?", (channel_id,))
-            logger.info(f"Cleared existing videos for channel: {channel_name}")
+            wait = min(entry[1] for entry in running.values()) - time.monotonic()
+            try:
+                index, probe, error = completions.get(timeout=max(wait, 0))
+            except queue.Empty:
+                now = time.monotonic()
+                for index, (cancel_event, deadline, strategy, url, _) in list(running.items()):
+                    if deadline <= now:
+                        cancel_event.set()
+                        del running[index]
+                        record_extraction(strategy, url, 'timeout')
+                        logger.warning(f"   ⏰ TIMEOUT! {strategy['name']} on {url} took >{strategy['timeout']}s - CANCELLED!")
+                continue
             
-            # Insert videos into database
-            for video_data in videos_data:
-                c.execute('''INSERT OR IGNORE INTO videos 
-                             (video_id, title, thumbnail_url, duration, resolutions, channel_id, channel_name) 
-                             VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                         (video_data['video_id'], video_data['title'], video_data['thumbnail_url'], 
-                          video_data['duration'], ",".join(video_data['resolutions']), channel_id, channel_name))
+            if index not in running:
+                if probe:
+                    probe[0].close()
+                continue  # Already written off as timed out
+            _, _, strategy, url, started = running.pop(index)
+            elapsed = time.monotonic() - started
             
-            conn.commit()
-            conn.close()
+            if error:
+                if isinstance(error, ExtractionCancelled):
+                    record_extraction(strategy, url, 'cancelled')
+                else:
+                    record_extraction(strategy, url, 'failure', elapsed)
+                if not isinstance(error, ExtractionCancelled):
+                    logger.warning(f"   ⚠️ {strategy['name']} on {url} failed: {str(error)[:100]}")
+                continue
+            record_extraction(strategy, url, walk_outcome(probe), elapsed)
+            if not probe:
+                continue
             
-            return jsonify({
-                'success': True,
-                'channel_name': channel_name,
-                'video_count': len(videos_data),
-                'videos': videos_data
-            })
-        
-        # Fallback to PyTube if yt-dlp fails
-        logger.info("yt-dlp failed, trying PyTube fallback")
-        conn = setup_database()
-        c = conn.cursor()
-        
-        # Try different URL formats to make PyTube work
-        urls_to_try = [
-            channel_url,
-            channel_url + '/videos',
-            channel_url.replace('/@', '/c/'),
-            channel_url.replace('/@', '/user/')
-        ]
-        
-        channel = None
-        working_url = None
+            walk, videos = probe
+            listing.add(walk, videos)
+            # A walk that reached the end of a small channel already has all of it
+            if walk.stopped_early or len(videos) >= GOOD_ENOUGH_VIDEOS or (walk.finished and videos):
+                logger.info(f"🏆 RACE WON by {strategy['name']} on {url} with {len(videos)} videos!")
+                listing.continue_with(walk)
+                return listing
+            walk.close()
+            logger.info(f"   📊 {strategy['name']} on {url} found only {len(videos)} videos - racing on")
         
-        for url in urls_to_try:
+        return listing
+    finally:
+        # Losers stop at their next entry instead of paging through the channel for nothing
+        for cancel_event, _, strategy, url, _ in running.values():
+            cancel_event.set()
+            record_extraction(strategy, url, 'cancelled')
+        # Probes that finished after the winner are left open by nobody else
+        while True:
             try:
-                logger.info(f"Trying URL format: {url}")
-                channel = Channel(url)
-                # Test if we can access basic properties
-                _ = channel.channel_name
-                _ = channel.channel_id
-                working_url = url
-                logger.info(f"Success with URL: {url}")
+                _, probe, _ = completions.get_nowait()
+            except queue.Empty:
                 break
-            except Exception as e:
-                logger.warning(f"Failed with URL {url}: {str(e)}")
-                continue
-        
-        if not channel:
-            raise Exception("Could not access channel with any URL format. Try a different channel URL format.")
-        
-        channel_id = channel.channel_id
-        channel_name = channel.channel_name
-        
-        logger.info(f"Successfully connected to channel: {channel_name} (ID: {channel_id})")
-        
-        # Clear existing videos for this channel
-        c.execute("DELETE FROM videos WHERE channel_id=?", (channel_id,))
-        logger.info(f"Cleared existing videos for channel: {channel_name}")
-        
-        videos_data = []
-        video_count = 0
-        
-        logger.info("Starting to process videos...")
-        
-        # Get videos with better error handling
-        try:
-            videos_list = list(channel.videos)
-            logger.info(f"Found {len(videos_list)} videos in channel")
-        except Exception as e:
-            logger.error(f"Error getting videos list: {e}")
-            return jsonify({'error': f'Could not get videos from channel: {str(e)}'}), 500
-        
-        for video in videos_list:
-            try:
-                logger.info(f"Processing video: {video.title[:50]}...")
-                
-                # Get available resolutions
-                streams = video.streams.filter(progressive=True, file_extension='mp4')
-                resolutions = sorted(set(f"{s.resolution}" for s in streams if s.resolution), 
-                                    key=lambda x: int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 0, 
-                                    reverse=True)
-                
-                # Fallback if no progressive streams
-                if not resolutions:
-                    streams = video.streams.filter(file_extension='mp4')
-                    resolutions = sorted(set(f"{s.resolution}" for s in streams if s.resolution), 
-                                        key=lambda x: int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 0, 
-                                        reverse=True)
-                
-                # Format duration
-                duration = f"{video.length // 60}:{video.length % 60:02d}" if video.length else "Unknown"
-                
-                video_data = {
-                    'video_id': video.video_id,
-                    'title': video.title,
-                    'thumbnail_url': video.thumbnail_url,
-                    'duration': duration,
-                    'resolutions': resolutions if resolutions else ['720p'],  # Fallback
-                    'channel_id': channel_id,
-                    'channel_name': channel_name
-                }
-                
-                videos_data.append(video_data)
-                
-                # Insert into database
-                c.execute('''INSERT OR IGNORE INTO videos 
-                             (video_id, title, thumbnail_url, duration, resolutions, channel_id, channel_name) 
-                             VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                         (video.video_id, video.title, video.thumbnail_url, duration, 
-                          ",".join(resolutions if resolutions else ['720p']), channel_id, channel_name))
-                
-                video_count += 1
-                logger.info(f"Processed video {video_count}: {video.title[:30]}...")
-                
-                # No limit - get all videos
-                if video_count % 10 == 0:  # Log progress every 10 videos
-                    logger.info(f"Processed {video_count} videos so far...")
-                    
-            except VideoUnavailable:
-                logger.warning(f"Video unavailable, skipping")
-                continue
-            except Exception as e:
-                logger.error(f"Error processing video: {e}")
-                continue
+            if probe:
+                probe[0].close()
+
+# Existing rows keep their downloaded/download_progress/file_path state; unchanged rows are not rewritten
+UPSERT_VIDEO_SQL = """INSERT INTO videos
+                      (video_id, title, thumbnail_url, duration, resolutions, channel_id, channel_name)
+                      VALUES (?, ?, ?, ?, ?, ?, ?)
+                      ON CONFLICT(video_id) DO UPDATE SET
+                          title=excluded.title,
+                          thumbnail_url=excluded.thumbnail_url,
+                          duration=excluded.duration,
+                          resolutions=COALESCE(NULLIF(videos.resolutions, ''), excluded.resolutions),
+                          channel_id=excluded.channel_id,
+                          channel_name=excluded.channel_name
+                      WHERE videos.title IS NOT excluded.title
+                         OR videos.thumbnail_url IS NOT excluded.thumbnail_url
+                         OR videos.duration IS NOT excluded.duration
+                         OR videos.channel_id IS NOT excluded.channel_id
+                         OR videos.channel_name IS NOT excluded.channel_name
+                         OR COALESCE(videos.resolutions, '') = ''"""
+
+def upsert_channel_videos(channel_id, channel_name, videos_data):
+    """Merge fetched videos into the library in one transaction"""
+    db_executemany(UPSERT_VIDEO_SQL,
+                   [(video_data['video_id'], video_data['title'], video_data['thumbnail_url'],
+                     video_data['duration'], ",".join(video_data['resolutions']), channel_id, channel_name)
+                    for video_data in videos_data])
+    logger.info(f"Synced {len(videos_data)} videos for channel: {channel_name}")
+
+# Videos written per transaction while a channel walk streams in
+INGEST_BATCH_SIZE = int(os.environ.get('TUBE_SNATCH_INGEST_BATCH_SIZE', '500'))
+# A streamed fetch sends what it has at least this often, even short of a full batch
+STREAM_FLUSH_INTERVAL = 1.0
+
+def batched(iterable, size, max_wait=None):
+    """Lists of up to ``size`` items, read lazily from ``iterable``.
+
+    With ``max_wait`` a batch is also cut once it has been filling for that
+    many seconds - checked as items arrive, so a slow page still ends one.
+    """
+    batch = []
+    opened = time.monotonic()
+    for item in iterable:
+        if not batch:
+            opened = time.monotonic()
+        batch.append(item)
+        if len(batch) >= size or (max_wait is not None and time.monotonic() - opened >= max_wait):
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def ingest_channel_listing(listing, batch_size=INGEST_BATCH_SIZE, max_wait=None):
+    """Upsert a listing batch by batch while its winning walk pages on; yields each stored batch.
+
+    The merged probes go first, then the continuation cut by ``batched``.
+    Only one batch is held at a time and each is its own short transaction,
+    so memory stays flat however many uploads the channel has and no write
+    lock is held across page requests.
+    """
+    try:
+        for batch in itertools.chain(batched(listing.videos, batch_size),
+                                     batched(listing.iter_continuation(), batch_size, max_wait)):
+            upsert_channel_videos(listing.channel_id, listing.channel_name, batch)
+            listing.scanned_count += len(batch)
+            yield batch
+    finally:
+        listing.close()
+
+def load_known_video_ids(channel_id):
+    return {row['video_id'] for row in db_query("SELECT video_id FROM videos WHERE channel_id=?", (channel_id,))}
+
+def count_channel_videos(channel_id):
+    return db_query_one("SELECT COUNT(*) AS n FROM videos WHERE channel_id=?", (channel_id,))['n']
+
+def iter_channel_videos(channel_id, batch_size=INGEST_BATCH_SIZE):
+    """A channel's library in id order, a keyset page at a time so no connection is held in between"""
+    last_id = 0
+    while True:
+        rows = db_query("SELECT * FROM videos WHERE channel_id=? AND id > ? ORDER BY id LIMIT ?",
+                        (channel_id, last_id, batch_size))
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield [serialize_video(video) for video in rows]
+
+def load_videos_by_ids(video_ids):
+    """Library rows for ``video_ids``, serialized and in the same order"""
+    if not video_ids:
+        return []
+    rows = {row['video_id']: row for row in
+            db_query(f"SELECT * FROM videos WHERE video_id IN ({sql_placeholders(video_ids)})", video_ids)}
+    return [serialize_video(rows[video_id]) for video_id in video_ids if video_id in rows]
+
+def stream_channel_fetch(listing, sync_mode, on_ingested=None):
+    """NDJSON answer for /api/fetch-channel: the channel, then videos as they are stored, then a summary.
+
+    The first batch is the probe that won the search. After that a batch goes
+    out every INGEST_BATCH_SIZE videos or STREAM_FLUSH_INTERVAL seconds,
+    whichever comes first. Library videos the walk did not reach (an
+    incremental sync stops early) follow at the end, so the client ends up
+    with the same videos as the plain JSON answer. A client that goes away
+    stops the walk. ``on_ingested`` runs once the whole listing is stored;
+    whatever it returns goes into the summary as ``enrichment``.
+    """
+    def generate():
+        yield dumps_json({'type': 'channel', 'channel_id': listing.channel_id,
+                          'channel_name': listing.channel_name, 'sync': sync_mode}) + "\n"
+        sent_ids = set()
+        try:
+            with contextlib.closing(ingest_channel_listing(listing, max_wait=STREAM_FLUSH_INTERVAL)) as batches:
+                for batch in batches:
+                    videos = load_videos_by_ids([video_data['video_id'] for video_data in batch])
+                    sent_ids.update(video['video_id'] for video in videos)
+                    yield dumps_json({'type': 'videos', 'videos': videos}) + "\n"
+            logger.info(f"📥 Ingested {listing.scanned_count} videos for '{listing.channel_name}'")
+            enrichment = on_ingested() if on_ingested else None
+            
+            for batch in iter_channel_videos(listing.channel_id):
+                videos = [video for video in batch if video['video_id'] not in sent_ids]
+                if videos:
+                    yield dumps_json({'type': 'videos', 'videos': videos}) + "\n"
+            video_count = count_channel_videos(listing.channel_id)
+        except Exception as e:
+            logger.error(f"Error in streamed fetch_channel: {str(e)}")
+            yield dumps_json({'type': 'error', 'error': str(e)}) + "\n"
+            return
         
-        conn.commit()
-        conn.close()
+        summary = {'type': 'summary', 'success': True, 'channel_name': listing.channel_name,
+                   'sync': sync_mode, 'scanned_count': listing.scanned_count,
+                   'complete': listing.complete, 'video_count': video_count, 'done': True}
+        if enrichment is not None:
+            summary['enrichment'] = enrichment
+        yield dumps_json(summary) + "\n"
+    
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+def stream_json_list(head, key, batches):
+    """Respond with the object ``head`` plus ``key`` listing every item of ``batches``, encoded as they come"""
+    def generate():
+        yield dumps_json(head)[:-1] + f",{dumps_json(key)}:["
+        separator = ''
+        for batch in batches:
+            if batch:
+                yield separator + dumps_json(batch)[1:-1]
+                separator = ','
+        yield ']}'
+    return Response(generate(), mimetype='application/json')
+
+# PyTube fallback - a flat listing first, resolutions filled in afterwards
+PYTUBE_VIDEO_RENDERERS = ('videoRenderer', 'gridVideoRenderer', 'reelItemRenderer', 'playlistVideoRenderer')
+ENRICH_WORKERS = int(os.environ.get('TUBE_SNATCH_ENRICH_WORKERS', '4'))
+ENRICH_ITEM_TIMEOUT = 30
+ENRICH_BATCH_SIZE = 50  # rows per UPDATE transaction
+ENRICH_FLUSH_INTERVAL = 2.0
+
+def renderer_text(value):
+    """Plain text of a renderer text field, which comes as simpleText or as runs"""
+    if not isinstance(value, dict):
+        return None
+    if 'simpleText' in value:
+        return value['simpleText']
+    return ''.join(run.get('text', '') for run in value.get('runs') or []) or None
+
+class FlatChannel(Channel):
+    """pytube Channel whose listing pages also keep each video's title and duration.
+
+    pytube's own page parser returns watch URLs only and expects one fixed
+    page layout; this one picks video renderers out of the page wherever they
+    are, so the listing alone fills a row without a request per video.
+    """
+
+    def __init__(self, url, proxies=None):
+        super().__init__(url, proxies)
+        self.listed = {}  # video_id -> title and duration, until the video is taken
+
+    def _extract_videos(self, raw_json):
+        watch_paths = []
+        continuation = [None]
         
-        return jsonify({
+        def scan(node):
+            if isinstance(node, list):
+                for item in node:
+                    scan(item)
+            elif isinstance(node, dict):
+                for key, value in node.items():
+                    if key in PYTUBE_VIDEO_RENDERERS and isinstance(value, dict) and value.get('videoId'):
+                        video_id = value['videoId']
+                        self.listed[video_id] = {
+                            'title': renderer_text(value.get('title')) or renderer_text(value.get('headline')),
+                            'duration': renderer_text(value.get('lengthText')),
+                        }
+                        watch_paths.append(f"/watch?v={video_id}")
+                    elif key == 'continuationCommand' and isinstance(value, dict):
+                        continuation[0] = value.get('token')  # The page's own one comes last
+                    else:
+                        scan(value)
+        
+        scan(json.loads(raw_json))
+        return list(dict.fromkeys(watch_paths)), continuation[0]
+
+def iter_pytube_videos(channel):
+    """A pytube channel's videos, one page request per page of the listing"""
+    channel_id = channel.channel_id
+    channel_name = channel.channel_name
+    for url in channel.url_generator():
+        video_id = pytube_extract.video_id(url)
+        details = channel.listed.pop(video_id, {})
+        yield {
+            'video_id': video_id,
+            'title': details.get('title') or 'Unknown Title',
+            'thumbnail_url': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg",
+            'duration': details.get('duration') or 'Unknown',
+            'resolutions': ['highest'],  # Until enrichment has looked at the streams
+            'channel_id': channel_id,
+            'channel_name': channel_name
+        }
+
+def fetch_channel_with_pytube(channel_url):
+    """Find the channel with PyTube; returns a listing whose videos are read as it is ingested"""
+    # Try different URL formats to make PyTube work
+    urls_to_try = [
+        channel_url,
+        channel_url + '/videos',
+        channel_url.replace('/@', '/c/'),
+        channel_url.replace('/@', '/user/')
+    ]
+    
+    for url in urls_to_try:
+        try:
+            logger.info(f"Trying URL format: {url}")
+            channel = FlatChannel(url)
+            # Test if we can access basic properties
+            listing = ChannelListing()
+            listing.channel_name = channel.channel_name
+            listing.channel_id = channel.channel_id
+            logger.info(f"Success with URL: {url}")
+            break
+        except Exception as e:
+            logger.warning(f"Failed with URL {url}: {str(e)}")
+            continue
+    else:
+        raise Exception("Could not access channel with any URL format. Try a different channel URL format.")
+    
+    logger.info(f"Successfully connected to channel: {listing.channel_name} (ID: {listing.channel_id})")
+    listing.continuation = iter_pytube_videos(channel)
+    return listing
+
+def sort_resolutions(streams):
+    return sorted(set(f"{s.resolution}" for s in streams if s.resolution),
+                  key=lambda x: int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 0,
+                  reverse=True)
+
+def pytube_video_details(video_id):
+    """Title, duration and resolutions of one video - the request per video the flat listing skips"""
+    video = YouTube(f"https://www.youtube.com/watch?v={video_id}")
+    streams = video.streams
+    # Fallback if no progressive streams
+    resolutions = (sort_resolutions(streams.filter(progressive=True, file_extension='mp4'))
+                   or sort_resolutions(streams.filter(file_extension='mp4')))
+    return {
+        'title': video.title,
+        'duration': f"{video.length // 60}:{video.length % 60:02d}" if video.length else None,
+        'resolutions': resolutions or ['720p'],  # Fallback
+    }
+
+ENRICH_UPDATE_SQL = """UPDATE videos SET resolutions=?, title=COALESCE(?, title), duration=COALESCE(?, duration),
+                       qualities_checked_at=? WHERE video_id=?"""
+
+# channel_id -> progress of the enrichment run in this process
+enrichments = {}
+enrichments_lock = threading.Lock()
+enrich_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ENRICH_WORKERS, thread_name_prefix='enrich')
+
+def count_unenriched_videos(channel_id):
+    return db_query_one("SELECT COUNT(*) AS n FROM videos WHERE channel_id=? AND qualities_checked_at IS NULL",
+                        (channel_id,))['n']
+
+def iter_unenriched_video_ids(channel_id, batch_size=ENRICH_BATCH_SIZE):
+    """Videos whose streams have not been looked at, a keyset page at a time"""
+    last_id = 0
+    while True:
+        rows = db_query("SELECT id, video_id FROM videos WHERE channel_id=? AND qualities_checked_at IS NULL "
+                        "AND id > ? ORDER BY id LIMIT ?", (channel_id, last_id, batch_size))
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield from (row['video_id'] for row in rows)
+
+def start_channel_enrichment(channel_id):
+    """Start filling in a channel's resolutions in the background, or report the run already going.
+
+    What is left to do is read from the videos table, so starting again after
+    an interruption carries on where the last run stopped.
+    """
+    with enrichments_lock:
+        progress = enrichments.get(channel_id)
+        if progress and progress['state'] == 'running':
+            return dict(progress)
+        progress = {'channel_id': channel_id, 'state': 'running', 'pending': count_unenriched_videos(channel_id),
+                    'resolved': 0, 'failed': 0, 'timed_out': 0}
+        enrichments[channel_id] = progress
+    now = time.time()
+    db_execute("INSERT INTO channel_enrichments (channel_id, state, started_at, updated_at) VALUES (?, 'running', ?, ?) "
+               "ON CONFLICT(channel_id) DO UPDATE SET state='running', updated_at=excluded.updated_at",
+               (channel_id, now, now))
+    logger.info(f"🔬 Enriching {progress['pending']} videos of channel {channel_id}")
+    threading.Thread(target=run_channel_enrichment, args=(progress,), name=f'enrich-{channel_id}', daemon=True).start()
+    return dict(progress)
+
+def run_channel_enrichment(progress):
+    """Look up every unenriched video of a channel on enrich_executor, writing results in batches.
+
+    At most two lookups per worker are in flight, each gets ENRICH_ITEM_TIMEOUT
+    seconds once it has started. A timed-out lookup cannot be interrupted, so
+    it keeps its place under that cap until its worker is free again. Videos
+    that fail or time out stay unenriched for the next run. On shutdown the run stops submitting and
+    flushes; the channel stays 'running' so the next start resumes it.
+    """
+    channel_id = progress['channel_id']
+    video_ids = iter_unenriched_video_ids(channel_id)
+    pending = {}  # future -> video_id
+    overdue = set()  # timed-out lookups still holding a worker
+    started = {}
+    updates = []
+    flushed = time.monotonic()
+    exhausted = False
+    
+    def lookup(video_id):
+        started[video_id] = time.monotonic()
+        try:
+            return pytube_video_details(video_id)
+        finally:
+            started.pop(video_id, None)
+    
+    def flush():
+        db_executemany(ENRICH_UPDATE_SQL, updates)
+        updates.clear()
+    
+    state = 'done'
+    try:
+        while True:
+            overdue = {future for future in overdue if not future.done()}
+            while (not exhausted and len(pending) + len(overdue) < ENRICH_WORKERS * 2
+                   and not service_shutdown.is_set()):
+                video_id = next(video_ids, None)
+                if video_id is None:
+                    exhausted = True
+                    break
+                pending[enrich_executor.submit(lookup, video_id)] = video_id
+            if not pending and (exhausted or service_shutdown.is_set() or not overdue):
+                break
+            
+            # With every slot held by overdue lookups, wait for one of them to let go
+            done, _ = concurrent.futures.wait(pending or overdue, timeout=0.5,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in done:
+                video_id = pending.pop(future, None)
+                if video_id is None:
+                    continue
+                try:
+                    details = future.result()
+                except Exception as e:
+                    logger.warning(f"Could not enrich {video_id}: {str(e)[:100]}")
+                    progress['failed'] += 1
+                    continue
+                updates.append((",".join(details['resolutions']), details['title'], details['duration'],
+                                time.time(), video_id))
+                progress['resolved'] += 1
+            
+            # Queued lookups don't time out - only ones that have been running too long
+            for future, video_id in list(pending.items()):
+                if now - started.get(video_id, now) > ENRICH_ITEM_TIMEOUT:
+                    del pending[future]
+                    overdue.add(future)
+                    progress['timed_out'] += 1
+            
+            if len(updates) >= ENRICH_BATCH_SIZE or (updates and now - flushed >= ENRICH_FLUSH_INTERVAL):
+                flush()
+                flushed = now
+        
+        flush()
+        if service_shutdown.is_set() and not exhausted:
+            state = 'running'
+    except Exception as e:
+        logger.error(f"❌ Enrichment of channel {channel_id} failed: {str(e)}")
+        state = 'failed'
+    
+    progress['pending'] = count_unenriched_videos(channel_id)
+    progress['state'] = 'interrupted' if state == 'running' else state
+    db_execute("UPDATE channel_enrichments SET state=?, updated_at=? WHERE channel_id=?", (state, time.time(), channel_id))
+    logger.info(f"🔬 Enrichment of channel {channel_id} {progress['state']}: {progress['resolved']} resolved, "
+                f"{progress['failed']} failed, {progress['timed_out']} timed out, {progress['pending']} left")
+
+def resume_channel_enrichments():
+    """Restart the enrichment runs that were cut off by the last shutdown"""
+    for row in db_query("SELECT channel_id FROM channel_enrichments WHERE state='running'"):
+        start_channel_enrichment(row['channel_id'])
+
+def channel_enrichment_status(channel_id):
+    with enrichments_lock:
+        progress = enrichments.get(channel_id)
+        if progress:
+            return dict(progress)
+    row = db_query_one("SELECT state FROM channel_enrichments WHERE channel_id=?", (channel_id,))
+    return {'channel_id': channel_id, 'state': row['state'] if row else 'none',
+            'pending': count_unenriched_videos(channel_id)}
+
+@app.route('/api/fetch-channel', methods=['POST'])
+def fetch_channel():
+    data = request.get_json()
+    channel_url = data.get('channel_url')
+    content_type = data.get('content_type', 'videos')  # Default to videos
+    # incremental: stop at the first long run of known videos; full: walk the whole listing
+    sync_mode = data.get('sync', 'incremental')
+    fetch_mode = data.get('fetch_mode', DEFAULT_FETCH_MODE)
+    # Huge channels can skip the library in the answer and page through /api/videos instead
+    include_videos = data.get('include_videos', True)
+    # stream: answer with NDJSON records as the channel is walked instead of one JSON object at the end
+    stream = bool(data.get('stream', False))
+    # enrich: after a PyTube fallback listing, look up every video's resolutions in the background
+    enrich = bool(data.get('enrich', True))
+    
+    # Clean the URL - remove content type suffix if present  
+    if channel_url:
+        for suffix in ['/videos', '/shorts', '/streams', '/live']:
+            if channel_url.endswith(suffix):
+                channel_url = channel_url.replace(suffix, '')
+                break
+    
+    logger.info(f"Received request to fetch {content_type} from channel: {channel_url}")
+    
+    if not channel_url:
+        logger.error("No channel URL provided")
+        return jsonify({'error': 'Channel URL is required'}), 400
+    
+    if sync_mode not in ('incremental', 'full'):
+        return jsonify({'error': f"Unknown sync mode '{sync_mode}'"}), 400
+    if fetch_mode not in ('race', 'serial'):
+        return jsonify({'error': f"Unknown fetch mode '{fetch_mode}'"}), 400
+    
+    try:
+        logger.info(f"Starting to fetch {content_type} from: {channel_url}")
+        
+        # First try yt-dlp which is more reliable
+        known_ids_loader = load_known_video_ids if sync_mode == 'incremental' else None
+        listing = fetch_channel_with_ytdlp(channel_url, content_type, known_ids_loader, fetch_mode)
+        on_ingested = None
+        if listing:
+            logger.info("Successfully fetched with yt-dlp")
+        else:
+            # Fallback to PyTube if yt-dlp fails - the listing is stored first, resolutions are looked up after
+            logger.info("yt-dlp failed, trying PyTube fallback")
+            listing = fetch_channel_with_pytube(channel_url)
+            if enrich:
+                channel_id = listing.channel_id
+                on_ingested = lambda: start_channel_enrichment(channel_id)
+        
+        if stream:
+            return stream_channel_fetch(listing, sync_mode, on_ingested)
+        
+        for _ in ingest_channel_listing(listing):
+            pass
+        channel_id = listing.channel_id
+        logger.info(f"📥 Ingested {listing.scanned_count} videos for '{listing.channel_name}'")
+        if not listing.scanned_count and not listing.complete:
+            return jsonify({'error': 'Could not get videos from channel'}), 500
+        
+        # The walk may have stopped early, so answer with the channel's whole library
+        result = {
             'success': True,
-            'channel_name': channel_name,
-            'video_count': len(videos_data),
-            'videos': videos_data
-        })
+            'channel_name': listing.channel_name,
+            'sync': sync_mode,
+            'scanned_count': listing.scanned_count,
+            'complete': listing.complete,
+            'video_count': count_channel_videos(channel_id)
+        }
+        if on_ingested:
+            result['enrichment'] = on_ingested()
+        if not include_videos:
+            return jsonify(result)
+        return stream_json_list(result, 'videos', iter_channel_videos(channel_id))
         
     except Exception as e:
         logger.error(f"Error in fetch_channel: {str(e)}")
@@ -470,72 +2078,802 @@ def fetch_channel():
             error_msg = "Channel not found. Please check the URL and try again."
         return jsonify({'error': error_msg}), 500
 
+@app.route('/api/enrich-channel', methods=['POST'])
+def enrich_channel():
+    """Start (or resume) looking up resolutions for a channel's videos"""
+    data = request.get_json() or {}
+    channel_id = data.get('channel_id')
+    if not channel_id:
+        return jsonify({'error': 'Channel ID is required'}), 400
+    try:
+        return jsonify(start_channel_enrichment(channel_id))
+    except Exception as e:
+        logger.error(f"❌ Enrichment error for {channel_id}: {str(e)}")
+        return jsonify({'error': f'Enrichment failed: {str(e)}'}), 500
+
+@app.route('/api/enrich-channel/<channel_id>', methods=['GET'])
+def get_channel_enrichment(channel_id):
+    try:
+        return jsonify(channel_enrichment_status(channel_id))
+    except Exception as e:
+        logger.error(f"❌ Enrichment status error for {channel_id}: {str(e)}")
+        return jsonify({'error': f'Enrichment status failed: {str(e)}'}), 500
+
+# /api/videos listing
+VIDEO_FIELDS = ('id', 'video_id', 'title', 'thumbnail_url', 'duration', 'resolutions', 'channel_id',
+                'channel_name', 'downloaded', 'download_progress', 'file_path')
+VIDEO_SORTS = {
+    # name -> (sort key, collation, descending); NULL keys would drop out of the keyset compare
+    'id': ('id', '', False),
+    '-id': ('id', '', True),
+    'title': ("COALESCE(title, '')", ' COLLATE NOCASE', False),
+    '-title': ("COALESCE(title, '')", ' COLLATE NOCASE', True),
+}
+VIDEOS_DEFAULT_LIMIT = 200
+VIDEOS_MAX_LIMIT = 1000
+
+def serialize_video(video, fields=VIDEO_FIELDS):
+    video_data = {}
+    for field in fields:
+        value = video[field]
+        if field == 'resolutions':
+            value = value.split(',') if value else []
+        elif field == 'downloaded':
+            value = bool(value)
+        video_data[field] = value
+    return video_data
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return sort_value, int(row_id)
+
+def parse_bool_arg(value):
+    if value is None or value == '':
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Expected a boolean, got '{value}'")
+
 @app.route('/api/videos', methods=['GET'])
+@versioned('videos')
 def get_videos():
+    """Keyset-paginated video listing.
+
+    Query args: limit, cursor (next_cursor from the previous page), channel_id,
+    downloaded, title_prefix, fields (comma separated) and sort (id, -id,
+    title, -title). Every sort is tie-broken on id so pages never overlap.
+    """
     try:
-        conn = setup_database()
-        c = conn.cursor()
-        c.execute("SELECT * FROM videos")
-        videos = c.fetchall()
-        conn.close()
-        
-        videos_list = []
-        for video in videos:
-            videos_list.append({
-                'id': video[0],
-                'video_id': video[1],
-                'title': video[2],
-                'thumbnail_url': video[3],
-                'duration': video[4],
-                'resolutions': video[5].split(',') if video[5] else [],
-                'channel_id': video[6],
-                'channel_name': video[7],
-                'downloaded': bool(video[8]),
-                'download_progress': video[9],
-                'file_path': video[10]
-            })
-        
-        return jsonify({'videos': videos_list})
+        args = request.args
+        try:
+            limit = min(max(int(args.get('limit', VIDEOS_DEFAULT_LIMIT)), 1), VIDEOS_MAX_LIMIT)
+            downloaded = parse_bool_arg(args.get('downloaded'))
+            cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+        except (ValueError, TypeError, binascii.Error) as e:
+            return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+        
+        sort = args.get('sort', 'id')
+        if sort not in VIDEO_SORTS:
+            return jsonify({'error': f"Unknown sort '{sort}'. Use one of: {', '.join(VIDEO_SORTS)}"}), 400
+        sort_key, collate, descending = VIDEO_SORTS[sort]
+        
+        fields = VIDEO_FIELDS
+        if args.get('fields'):
+            fields = tuple(field.strip() for field in args['fields'].split(',') if field.strip())
+            unknown = [field for field in fields if field not in VIDEO_FIELDS]
+            if unknown:
+                return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+        # The cursor needs the sort key and id even if the caller did not ask for them
+        columns = list(dict.fromkeys(fields + ('id',))) + [f"{sort_key} AS sort_key"]
+        
+        where = []
+        params = []
+        if args.get('channel_id'):
+            where.append("channel_id = ?")
+            params.append(args['channel_id'])
+        if downloaded is not None:
+            where.append("downloaded = ?")
+            params.append(1 if downloaded else 0)
+        if args.get('title_prefix'):
+            # A range scan on the title sort index instead of a LIKE over the whole table; the same
+            # index then gives sort=title its order without a sort step
+            prefix = args['title_prefix']
+            where.append("COALESCE(title, '') >= ? COLLATE NOCASE AND COALESCE(title, '') < ? COLLATE NOCASE")
+            params.extend([prefix, prefix + '\U0010ffff'])
+        if cursor:
+            sort_value, last_id = cursor
+            op = '<' if descending else '>'
+            if sort_key == 'id':
+                where.append(f"id {op} ?")
+                params.append(last_id)
+            else:
+                # Spelled out rather than a row-value compare so SQLite can seek the index
+                where.append(f"{sort_key} {op}= ?{collate} AND ({sort_key} {op} ?{collate} OR id {op} ?)")
+                params.extend([sort_value, sort_value, last_id])
+        
+        direction = 'DESC' if descending else 'ASC'
+        sql = f"SELECT {', '.join(columns)} FROM videos"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {sort_key}{collate} {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+        
+        videos = db_query(sql, params)
+        has_more = len(videos) > limit
+        videos = videos[:limit]
+        
+        next_cursor = None
+        if has_more:
+            last = videos[-1]
+            next_cursor = encode_cursor(last['sort_key'], last['id'])
+        
+        return json_response({
+            'videos': [serialize_video(video, fields) for video in videos],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def download_video_thread(video_id, resolution):
+# /api/search - FTS5 over title and channel_name, best matches first
+SEARCH_TOKEN_RE = re.compile(r'\w+')
+SEARCH_MAX_TOKENS = 16
+SEARCH_DEFAULT_LIMIT = 50
+# bm25 costs a few microseconds per match, so broad queries are ranked this many (newest) matches at a time
+SEARCH_RANK_WINDOW = int(os.environ.get('TUBE_SNATCH_SEARCH_RANK_WINDOW', '500'))
+
+def build_search_query(text):
+    """FTS5 MATCH expression for free text: every word is required, the last one as a prefix.
+
+    Only the word being typed is a prefix - FTS5 has to merge the doclists of
+    every term a long prefix matches, while a whole word is one doclist it
+    can seek in. Words are quoted, so FTS5 operators and punctuation in the
+    text are matched literally instead of being parsed.
+    """
+    tokens = SEARCH_TOKEN_RE.findall(text)[:SEARCH_MAX_TOKENS]
+    return ' '.join(f'"{token}"' for token in tokens[:-1]) + (f' "{tokens[-1]}"*' if tokens else '')
+
+def search_window_floor(match, filters, filter_params, ceiling):
+    """Lowest rowid of the SEARCH_RANK_WINDOW newest matches below ``ceiling``, or None if fewer are left"""
+    sql = "SELECT v.id FROM videos_fts JOIN videos v ON v.id = videos_fts.rowid WHERE videos_fts MATCH ?"
+    params = [match]
+    if ceiling is not None:
+        sql += " AND videos_fts.rowid < ?"
+        params.append(ceiling)
+    sql += ''.join(f" AND {condition}" for condition in filters)
+    sql += " ORDER BY videos_fts.rowid DESC LIMIT 1 OFFSET ?"
+    row = db_query_one(sql, (*params, *filter_params, SEARCH_RANK_WINDOW - 1))
+    return row['id'] if row else None
+
+def search_library(match, filters, filter_params, columns, limit, position=None):
+    """One page of ranked matches, plus the cursor of the page after it.
+
+    A query with up to SEARCH_RANK_WINDOW matches is ranked purely by bm25.
+    Broader ones are ranked a window of newest matches at a time, which keeps
+    every query's cost bounded: the cursor remembers the window's upper rowid
+    along with the last rank and id, which come back as ``position``.
+    """
+    ceiling, after = None, None
+    if position:
+        ceiling, last_rank, last_id = position
+        after = (last_rank, last_id)
+    
+    page = []  # (window ceiling, row)
+    while True:
+        floor = search_window_floor(match, filters, filter_params, ceiling)
+        where = ["videos_fts MATCH ?", *filters]
+        params = [match, *filter_params]
+        if floor is not None:
+            where.append("videos_fts.rowid >= ?")
+            params.append(floor)
+        if ceiling is not None:
+            where.append("videos_fts.rowid < ?")
+            params.append(ceiling)
+        if after:
+            where.append("(videos_fts.rank > ? OR (videos_fts.rank = ? AND v.id > ?))")
+            params.extend([after[0], after[0], after[1]])
+        sql = (f"SELECT {', '.join('v.' + column for column in columns)}, videos_fts.rank AS search_rank "
+               f"FROM videos_fts JOIN videos v ON v.id = videos_fts.rowid "
+               f"WHERE {' AND '.join(where)} ORDER BY videos_fts.rank, v.id LIMIT ?")
+        page.extend((ceiling, row) for row in db_query(sql, (*params, limit + 1 - len(page))))
+        if len(page) > limit or floor is None:
+            break
+        ceiling, after = floor, None  # On to the next window of older matches
+    
+    next_cursor = None
+    if len(page) > limit:
+        ceiling, last = page[limit - 1]
+        next_cursor = encode_cursor([ceiling, last['search_rank']], last['id'])
+    return [row for _, row in page[:limit]], next_cursor
+
+@app.route('/api/search', methods=['GET'])
+@versioned('videos')
+def search_videos():
+    """Full-text search over titles and channel names.
+
+    Query args: q, limit, cursor (next_cursor from the previous page),
+    channel_id, downloaded and fields, as for /api/videos. Every word of q
+    must match, the last one as a prefix. Results are ranked by bm25 with
+    title matches weighted over channel names, and tie-broken on id so pages
+    never overlap.
+    """
     try:
-        conn = setup_database()
-        c = conn.cursor()
+        args = request.args
+        match = build_search_query(args.get('q', ''))
+        if not match:
+            return jsonify({'error': 'A search query is required'}), 400
+        try:
+            limit = min(max(int(args.get('limit', SEARCH_DEFAULT_LIMIT)), 1), VIDEOS_MAX_LIMIT)
+            downloaded = parse_bool_arg(args.get('downloaded'))
+            position = None
+            if args.get('cursor'):
+                (ceiling, last_rank), last_id = decode_cursor(args['cursor'])
+                position = (ceiling, last_rank, last_id)
+        except (ValueError, TypeError, binascii.Error) as e:
+            return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+        
+        fields = VIDEO_FIELDS
+        if args.get('fields'):
+            fields = tuple(field.strip() for field in args['fields'].split(',') if field.strip())
+            unknown = [field for field in fields if field not in VIDEO_FIELDS]
+            if unknown:
+                return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+        columns = list(dict.fromkeys(fields + ('id',)))
+        
+        filters = []
+        filter_params = []
+        if args.get('channel_id'):
+            filters.append("v.channel_id = ?")
+            filter_params.append(args['channel_id'])
+        if downloaded is not None:
+            filters.append("v.downloaded = ?")
+            filter_params.append(1 if downloaded else 0)
+        
+        videos, next_cursor = search_library(match, filters, filter_params, columns, limit, position)
+        return json_response({
+            'videos': [serialize_video(video, fields) for video in videos],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })
         
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Video info cache - one yt-dlp extraction serves qualities, playback and downloads
+INFO_CACHE_SIZE = int(os.environ.get('TUBE_SNATCH_INFO_CACHE_SIZE', '256'))
+INFO_CACHE_TTL = int(os.environ.get('TUBE_SNATCH_INFO_CACHE_TTL', '3600'))  # when stream URLs carry no expiry
+INFO_CACHE_EXPIRY_MARGIN = 300  # drop entries this long before their googlevideo URLs expire
+
+INFO_EXTRACT_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android', 'web'],
+            'player_skip': ['configs', 'webpage']
+        }
+    },
+    'retries': 3,
+}
+
+STREAM_EXPIRE_RE = re.compile(r'[?&/]expire[=/](\d+)')
+
+def stream_urls_expire_at(info):
+    """Earliest googlevideo 'expire' timestamp among the info's stream URLs, if any"""
+    expiries = []
+    for fmt in info.get('formats') or []:
+        for key in ('url', 'manifest_url', 'fragment_base_url'):
+            match = STREAM_EXPIRE_RE.search(fmt.get(key) or '')
+            if match:
+                expiries.append(int(match.group(1)))
+    return min(expiries) if expiries else None
+
+class VideoInfoCache:
+    """Bounded LRU of unprocessed yt-dlp info dicts keyed by video ID.
+
+    Entries expire shortly before the signed stream URLs inside them do.
+    Concurrent misses for the same video share one extraction (single
+    flight). Cached dicts are shared - copy before handing them to yt-dlp.
+    """
+
+    def __init__(self, loader, max_entries, default_ttl, expiry_margin):
+        self._loader = loader
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.expiry_margin = expiry_margin
+        self._entries = collections.OrderedDict()  # video_id -> (expires_at, info)
+        self._flights = {}  # video_id -> (Event, [info, error])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, video_id):
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(video_id)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[video_id]
+            flight = self._flights.get(video_id)
+            leader = flight is None
+            if leader:
+                flight = (threading.Event(), [None, None])
+                self._flights[video_id] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        
+        done, outcome = flight
+        if not leader:
+            done.wait()
+            if outcome[1]:
+                raise outcome[1]
+            return outcome[0]
+        
+        try:
+            info = self._loader(video_id)
+            if not info:
+                raise ValueError('Could not extract video info')
+            outcome[0] = info
+            self._store(video_id, info)
+            return info
+        except Exception as e:
+            outcome[1] = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(video_id, None)
+            done.set()
+
+    def _store(self, video_id, info):
+        now = time.time()
+        expires_at = now + self.default_ttl
+        stream_expiry = stream_urls_expire_at(info)
+        if stream_expiry:
+            expires_at = min(expires_at, stream_expiry - self.expiry_margin)
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._entries[video_id] = (expires_at, info)
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, video_id):
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 4) if lookups else None,
+            }
+
+def extract_video_info(video_id):
+    with yt_dlp.YoutubeDL(INFO_EXTRACT_OPTS) as ydl:
+        # Unprocessed, so any caller can run its own format selection over the same extraction
+        return ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False, process=False)
+
+video_info_cache = VideoInfoCache(extract_video_info, INFO_CACHE_SIZE, INFO_CACHE_TTL, INFO_CACHE_EXPIRY_MARGIN)
+
+def process_cached_info(video_id, ydl_opts, download):
+    """Run yt-dlp format selection (and optionally the download) over the cached extraction.
+
+    If yt-dlp rejects the cached info (typically expired or revoked stream
+    URLs) it is dropped and the run is retried once with a fresh extraction.
+    """
+    for attempt in (1, 2):
+        info = video_info_cache.get(video_id)
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                return ydl.process_ie_result(copy.deepcopy(info), download=download)
+        except yt_dlp.utils.DownloadError as e:
+            if attempt == 2:
+                raise
+            logger.warning(f"Cached info for {video_id} was rejected ({str(e)[:100]}), re-extracting")
+            video_info_cache.invalidate(video_id)
+
+# Media file index - exact output paths captured from yt-dlp, reconciled with disk in the background
+DOWNLOADS_DIR = "downloads"
+MEDIA_RECONCILE_INTERVAL = int(os.environ.get('TUBE_SNATCH_MEDIA_RECONCILE_INTERVAL', '600'))
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+YOUTUBE_ID_LENGTH = 11
+
+def register_media_file(video_id, path, format_id=None, checksum=None, variant=None, pinned=False, replace=True):
+    """Record a finished file in the index; path is relative to DOWNLOADS_DIR.
+
+    Pinned files are never evicted by the cache manager. With replace=False
+    an existing row is left alone. Returns whether a row was written.
+    """
+    stat = os.stat(os.path.join(DOWNLOADS_DIR, path))
+    on_conflict = '''DO UPDATE SET
+                      video_id=excluded.video_id,
+                      format_id=COALESCE(excluded.format_id, media_files.format_id),
+                      ext=excluded.ext,
+                      size=excluded.size,
+                      mtime=excluded.mtime,
+                      checksum=excluded.checksum,
+                      variant=COALESCE(excluded.variant, media_files.variant),
+                      pinned=MAX(excluded.pinned, media_files.pinned)''' if replace else 'DO NOTHING'
+    return db_execute(f'''INSERT INTO media_files
+                  (path, video_id, format_id, ext, size, mtime, checksum, created_at, variant, pinned)
+                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                  ON CONFLICT(path) {on_conflict}''',
+               (path, video_id, format_id, os.path.splitext(path)[1].lstrip('.'), stat.st_size, stat.st_mtime,
+                checksum, time.time(), variant, int(pinned))) > 0
+
+def lookup_media_file(video_id, variant=None):
+    """Newest indexed file for a video (optionally of one variant) that is still on disk, or None"""
+    if variant:
+        row = db_query_one("SELECT * FROM media_files WHERE video_id=? AND variant=? ORDER BY created_at DESC LIMIT 1",
+                           (video_id, variant))
+    else:
+        row = db_query_one("SELECT * FROM media_files WHERE video_id=? ORDER BY created_at DESC LIMIT 1", (video_id,))
+    if row and not os.path.isfile(os.path.join(DOWNLOADS_DIR, row['path'])):
+        # Deleted behind our back - drop it now rather than waiting for the reconciler
+        db_execute("DELETE FROM media_files WHERE path=?", (row['path'],))
+        return lookup_media_file(video_id, variant)
+    return row
+
+MEDIA_LEASE_TTL = 300  # how long a crashed process's leases outlive it
+
+class MediaLeases:
+    """Reference counts of cached files currently being read, so nothing deletes one mid-serve.
+
+    Counts are kept per process and mirrored into media_leases while above
+    zero, so the owner's evictor also sees files other workers are serving.
+    A live process keeps pushing its rows' expiry back; a crashed one's lapse
+    after MEDIA_LEASE_TTL.
+    """
+
+    def __init__(self):
+        self.holder = uuid.uuid4().hex
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def acquire(self, path):
+        with self._lock:
+            self._counts[path] += 1
+            if self._counts[path] == 1:
+                db_execute("INSERT OR REPLACE INTO media_leases (path, holder, expires_at) VALUES (?, ?, ?)",
+                           (path, self.holder, time.time() + MEDIA_LEASE_TTL))
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh, daemon=True, name='media-leases')
+                self._refresher.start()
+
+    def release(self, path):
+        with self._lock:
+            self._counts[path] -= 1
+            if self._counts[path] <= 0:
+                del self._counts[path]
+                db_execute("DELETE FROM media_leases WHERE path=? AND holder=?", (path, self.holder))
+
+    def _refresh(self):
+        while True:
+            time.sleep(MEDIA_LEASE_TTL / 3)
+            try:
+                db_execute("UPDATE media_leases SET expires_at=? WHERE holder=?",
+                           (time.time() + MEDIA_LEASE_TTL, self.holder))
+            except Exception as e:
+                logger.error(f"Media lease refresh failed: {str(e)}")
+
+    def delete_if_idle(self, path, delete):
+        """Run delete() unless this process is reading path; the check and delete are atomic against acquire()"""
+        with self._lock:
+            if self._counts.get(path):
+                return False
+            delete()
+            return True
+
+    def active(self):
+        """Paths being read by any process"""
+        return {row['path'] for row in db_query("SELECT DISTINCT path FROM media_leases WHERE expires_at > ?",
+                                                (time.time(),))}
+
+media_leases = MediaLeases()
+
+# Download cache quota
+CACHE_QUOTA_BYTES = int(os.environ.get('TUBE_SNATCH_CACHE_QUOTA_BYTES', str(20 * 1024 ** 3)))  # 0 disables the quota
+CACHE_HIGH_WATERMARK = float(os.environ.get('TUBE_SNATCH_CACHE_HIGH_WATERMARK', '0.9'))
+CACHE_LOW_WATERMARK = float(os.environ.get('TUBE_SNATCH_CACHE_LOW_WATERMARK', '0.75'))
+CACHE_EVICTION_POLICY = os.environ.get('TUBE_SNATCH_CACHE_POLICY', 'lru')
+CACHE_CHECK_INTERVAL = 60
+CACHE_EVICTION_ORDER = {
+    'lru': 'COALESCE(last_access, created_at)',
+    'lfu': 'access_count, COALESCE(last_access, created_at)',
+}
+
+class CacheManager:
+    """Keeps the downloads directory under a byte quota.
+
+    Crossing the high watermark wakes a background thread that deletes
+    unpinned files nobody is reading - least recently (lru) or least often
+    (lfu) served first - until usage drops below the low watermark. Nothing
+    is ever evicted on a request thread.
+    """
+
+    def __init__(self, quota, high_watermark, low_watermark, policy):
+        if policy not in CACHE_EVICTION_ORDER:
+            raise ValueError(f"Unknown cache eviction policy {policy!r}")
+        self.quota = quota
+        self.high_bytes = int(quota * high_watermark)
+        self.low_bytes = int(quota * low_watermark)
+        self.policy = policy
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.last_eviction = None
+
+    def usage(self):
+        row = db_query_one("SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes, "
+                           "COALESCE(SUM(pinned), 0) AS pinned_files, "
+                           "COALESCE(SUM(CASE WHEN pinned THEN size END), 0) AS pinned_bytes FROM media_files")
+        return dict(row)
+
+    def record_access(self, path):
+        db_execute("UPDATE media_files SET last_access=?, access_count=access_count+1 WHERE path=?",
+                   (time.time(), path))
+
+    def check(self):
+        """Wake the evictor if the cache is over its high watermark - only the owner process evicts"""
+        if download_ownership.standby:
+            return
+        if self.quota and self.usage()['bytes'] > self.high_bytes:
+            self.start()
+            self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='cache-evictor')
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(CACHE_CHECK_INTERVAL)
+            self._wake.clear()
+            try:
+                self.evict()
+            except Exception as e:
+                logger.error(f"Cache eviction failed: {str(e)}")
+
+    def evict(self):
+        used = self.usage()['bytes']
+        if not self.quota or used <= self.high_bytes:
+            return 0
+        
+        db_execute("DELETE FROM media_leases WHERE expires_at <= ?", (time.time(),))  # left by crashed workers
+        freed = 0
+        for row in db_query(f"SELECT path, size FROM media_files WHERE pinned=0 "
+                            f"ORDER BY {CACHE_EVICTION_ORDER[self.policy]}"):
+            if used <= self.low_bytes:
+                break
+            try:
+                removed = media_leases.delete_if_idle(row['path'], functools.partial(self._remove, row['path']))
+            except OSError as e:
+                # Windows won't delete a file some process still has open; it stays indexed for a later pass
+                logger.warning(f"⚠️ Could not evict {row['path']}: {str(e)}")
+                continue
+            if removed:
+                freed += 1
+                used -= row['size'] or 0
+                self.evicted_bytes += row['size'] or 0
+        
+        if freed:
+            self.evicted_files += freed
+            self.last_eviction = time.time()
+            logger.info(f"🧹 Evicted {freed} cached files, cache now {used} of {self.quota} bytes")
+        if used > self.low_bytes:
+            logger.warning(f"⚠️ Download cache still at {used} bytes - the rest is pinned or being served")
+        return freed
+
+    def _remove(self, path):
+        """Delete one file with its index row, unless another process holds a lease on it.
+
+        The DELETE takes the database write lock before the lease check, so no
+        lease can be taken between the check and the file going away. If the
+        file can't be removed the row is rolled back with it.
+        """
+        with db_transaction() as conn:
+            removed = conn.execute("DELETE FROM media_files WHERE path=? AND NOT EXISTS "
+                                   "(SELECT 1 FROM media_leases WHERE path=? AND expires_at > ?)",
+                                   (path, path, time.time())).rowcount
+            if not removed:
+                return False
+            conn.execute("UPDATE videos SET downloaded=0, download_progress=0, file_path=NULL WHERE file_path=?",
+                         (path,))
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(DOWNLOADS_DIR, path))
+        return True
+
+    def stats(self):
+        usage = self.usage()
+        return {
+            'quota_bytes': self.quota,
+            'high_watermark_bytes': self.high_bytes,
+            'low_watermark_bytes': self.low_bytes,
+            'used_bytes': usage['bytes'],
+            'files': usage['files'],
+            'pinned_files': usage['pinned_files'],
+            'pinned_bytes': usage['pinned_bytes'],
+            'files_being_served': len(media_leases.active()),
+            'policy': self.policy,
+            'evicted_files': self.evicted_files,
+            'evicted_bytes': self.evicted_bytes,
+            'last_eviction': self.last_eviction,
+        }
+
+cache_manager = CacheManager(CACHE_QUOTA_BYTES, CACHE_HIGH_WATERMARK, CACHE_LOW_WATERMARK, CACHE_EVICTION_POLICY)
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def reconcile_media_files():
+    """Bring the media index in line with the downloads directory.
+
+    Drops rows whose files are gone or changed size, adopts finished files the
+    index doesn't know about (e.g. downloads from before the index existed) and
+    fills in missing checksums. Downloads keep registering files while this
+    runs, so rows newer than the directory scan are never dropped and
+    adoption never overwrites a row that appeared in the meantime.
+    """
+    if not os.path.isdir(DOWNLOADS_DIR):
+        return
+    scanned_at = time.time()
+    on_disk = {}
+    with os.scandir(DOWNLOADS_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if STREAM_PART_RE.match(entry.name):
+                # Left behind by a stream fetch that died with the process
+                if time.time() - entry.stat().st_mtime > STREAM_PART_MAX_AGE and \
+                        not stream_flights.owns(os.path.join(DOWNLOADS_DIR, entry.name)):
+                    os.remove(entry.path)
+            elif not entry.name.endswith(('.part', '.ytdl')) and '.part-Frag' not in entry.name:
+                on_disk[entry.name] = entry.stat()
+    
+    indexed = {row['path']: row for row in db_query("SELECT path, size, created_at FROM media_files")}
+    stale = [path for path, row in indexed.items()
+             if (path not in on_disk or on_disk[path].st_size != row['size']) and (row['created_at'] or 0) < scanned_at]
+    if stale:
+        # Re-checked in the DELETE: a download may have re-registered the path since it was read
+        db_executemany("DELETE FROM media_files WHERE path=? AND size IS ? AND COALESCE(created_at, 0) < ?",
+                       [(path, indexed[path]['size'], scanned_at) for path in stale])
+    
+    # Downloads are named "<video_id>_<title>.<ext>"; YouTube IDs are a fixed 11 characters
+    unknown = {name: name[:YOUTUBE_ID_LENGTH] for name in on_disk
+               if (name not in indexed or name in stale) and name[YOUTUBE_ID_LENGTH:YOUTUBE_ID_LENGTH + 1] == '_'}
+    known_videos = set()
+    candidate_ids = list(set(unknown.values()))
+    for start in range(0, len(candidate_ids), 500):
+        batch = candidate_ids[start:start + 500]
+        rows = db_query(f"SELECT video_id FROM videos WHERE video_id IN ({sql_placeholders(batch)})", batch)
+        known_videos.update(row['video_id'] for row in rows)
+    adopted = 0
+    for name, video_id in unknown.items():
+        if video_id in known_videos:
+            variant = STREAM_FILE_RE.match(name)
+            if register_media_file(video_id, name, variant=variant.group(1) if variant else None, replace=False):
+                adopted += 1
+    
+    checksummed = 0
+    for row in db_query("SELECT path FROM media_files WHERE checksum IS NULL"):
+        try:
+            checksum = file_checksum(os.path.join(DOWNLOADS_DIR, row['path']))
+        except OSError:
+            continue
+        db_execute("UPDATE media_files SET checksum=? WHERE path=? AND checksum IS NULL", (checksum, row['path']))
+        checksummed += 1
+    
+    if stale or adopted or checksummed:
+        logger.info(f"🗂️ Media index reconciled: {len(stale)} dropped, {adopted} adopted, {checksummed} checksummed")
+    cache_manager.check()
+
+def start_media_reconciler():
+    def loop():
+        while True:
+            try:
+                reconcile_media_files()
+            except Exception as e:
+                logger.error(f"Media index reconcile failed: {str(e)}")
+            time.sleep(MEDIA_RECONCILE_INTERVAL)
+    
+    threading.Thread(target=loop, daemon=True, name='media-reconciler').start()
+
+def download_video_thread(job):
+    video_id = job.video_id
+    try:
         # Get video info
-        c.execute("SELECT * FROM videos WHERE video_id=?", (video_id,))
-        video = c.fetchone()
+        video = db_query_one("SELECT video_id FROM videos WHERE video_id=?", (video_id,))
         
         if not video:
-            download_progress[video_id] = {'status': 'error', 'message': 'Video not found'}
+            update_download_job(job.job_id, state='failed', error='Video not found', finished_at=time.time())
             return
         
-        download_progress[video_id] = {'status': 'downloading', 'progress': 0}
+        db_execute("UPDATE download_jobs SET state='running', attempts=attempts+1, error=NULL, "
+                   "started_at=?, updated_at=? WHERE job_id=?", (time.time(), time.time(), job.job_id))
+        publish_job_state(job.job_id)
         
         # Create downloads directory
-        os.makedirs("downloads", exist_ok=True)
+        os.makedirs(DOWNLOADS_DIR, exist_ok=True)
         
-        # Use yt-dlp for actual downloading (more reliable)
-        video_url = f"https://www.youtube.com/watch?v={video_id}"
+        # DASH downloads fetch video then audio; keep a running byte total across both
+        counters = {'finished_bytes': 0, 'last_write': 0.0, 'counted_bytes': 0, 'merge_started': None}
+        # Concurrent fragment downloads call the hook from several threads
+        read_bytes = {}  # filename -> bytes already charged to the bandwidth scheduler
+        read_lock = threading.Lock()
         
         def progress_hook(d):
+            if download_scheduler.checkpointing:
+                raise DownloadCheckpointed(video_id)
             if d['status'] == 'downloading':
-                if 'total_bytes' in d and d['total_bytes']:
-                    percent = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                    download_progress[video_id] = {'status': 'downloading', 'progress': int(percent)}
-                elif '_percent_str' in d:
-                    # Extract percentage from string like "50.2%"
-                    percent_str = d['_percent_str'].replace('%', '')
-                    try:
-                        percent = float(percent_str)
-                        download_progress[video_id] = {'status': 'downloading', 'progress': int(percent)}
-                    except:
-                        pass
+                with read_lock:
+                    downloaded = d.get('downloaded_bytes') or 0
+                    read = downloaded - read_bytes.get(d.get('filename'), 0)
+                    read_bytes[d.get('filename')] = downloaded
+                # Blocking here holds back yt-dlp's next read, which is what enforces the limits
+                bandwidth_scheduler.consume(job.job_id, read)
+
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                downloaded_bytes = counters['finished_bytes'] + (d.get('downloaded_bytes') or 0)
+                total_bytes = counters['finished_bytes'] + int(total) if total else None
+                if downloaded_bytes > counters['counted_bytes']:
+                    LIBRARY_DOWNLOAD_BYTES.inc(downloaded_bytes - counters['counted_bytes'])
+                    counters['counted_bytes'] = downloaded_bytes
+                # The event bus does its own rate limiting, so every tick is offered to it
+                job_events.publish_progress(job.job_id, {
+                    'job_id': job.job_id,
+                    'video_id': video_id,
+                    'downloaded_bytes': downloaded_bytes,
+                    'total_bytes': total_bytes,
+                    'progress': min(int(downloaded_bytes * 100 / total_bytes), 100) if total_bytes else 0,
+                })
+                now = time.time()
+                if now - counters['last_write'] < PROGRESS_WRITE_INTERVAL:
+                    return
+                counters['last_write'] = now
+                update_download_job(job.job_id, downloaded_bytes=downloaded_bytes, total_bytes=total_bytes)
             elif d['status'] == 'finished':
-                download_progress[video_id] = {'status': 'completed', 'progress': 100, 'file_path': d['filename']}
+                counters['finished_bytes'] += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+                update_download_job(job.job_id, downloaded_bytes=counters['finished_bytes'])
+        
+        def postprocessor_hook(d):
+            if d.get('postprocessor') == 'Merger' and d['status'] == 'started':
+                counters['merge_started'] = time.monotonic()
+                update_download_job(job.job_id, state='merging')
+            elif d.get('postprocessor') == 'Merger' and d['status'] == 'finished' and counters['merge_started']:
+                MERGE_SECONDS.observe(time.monotonic() - counters['merge_started'])
+        
+        # Called with the final path once merging and post-processing are done
+        output_paths = []
         
         # Configure yt-dlp for 1080p MAXIMUM quality like Y2mate (DASH merging)
         ydl_opts = {
@@ -543,6 +2881,9 @@ def download_video_thread(video_id, resolution):
             'outtmpl': f'downloads/{video_id}_%(title)s.%(ext)s',  # Include video ID in filename
             'merge_output_format': 'mp4',  # Force merge to MP4 like Y2mate
             'progress_hooks': [progress_hook],
+            'postprocessor_hooks': [postprocessor_hook],
+            'post_hooks': [output_paths.append],
+            'continuedl': True,  # Requeued jobs pick up their .part files where they stopped
             'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'extractor_args': {
                 'youtube': {
@@ -555,180 +2896,1088 @@ def download_video_thread(video_id, resolution):
             'skip_unavailable_fragments': True,
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Starting download of {video_id} at {resolution}")
-            ydl.download([video_url])
+        connections = bandwidth_scheduler.start_job(job.job_id, job.priority)
+        ydl_opts['concurrent_fragment_downloads'] = connections
+        logger.info(f"Starting download of {video_id} at {job.resolution} (job {job.job_id}, "
+                    f"{connections} connections)")
+        try:
+            info = process_cached_info(video_id, ydl_opts, download=True)
+        finally:
+            bandwidth_scheduler.finish_job(job.job_id, connections)
         
-        # Find the downloaded file and update database with file path
-        downloads_dir = "downloads"
+        # Record the exact file yt-dlp produced
         downloaded_file = None
-        if os.path.exists(downloads_dir):
-            for filename in os.listdir(downloads_dir):
-                if filename.startswith(f"{video_id}_"):
-                    downloaded_file = filename
+        if output_paths:
+            downloaded_file = os.path.relpath(output_paths[-1], DOWNLOADS_DIR)
+            pin = db_query_one("SELECT pin FROM download_jobs WHERE job_id=?", (job.job_id,))
+            register_media_file(video_id, downloaded_file, format_id=info.get('format_id'),
+                                variant=stream_variant('highest'), pinned=bool(pin and pin['pin']))
+            cache_manager.check()
+        
+        with db_transaction() as conn:
+            if downloaded_file:
+                conn.execute("UPDATE videos SET downloaded=1, download_progress=100, file_path=? WHERE video_id=?",
+                             (downloaded_file, video_id))
+            else:
+                conn.execute("UPDATE videos SET downloaded=1, download_progress=100 WHERE video_id=?", (video_id,))
+            conn.execute("UPDATE download_jobs SET state='done', file_path=?, finished_at=?, updated_at=? "
+                         "WHERE job_id=?", (downloaded_file, time.time(), time.time(), job.job_id))
+        publish_job_state(job.job_id)
+        logger.info(f"Download completed for {video_id}, file: {downloaded_file}")
+        
+    except Exception as e:
+        if download_scheduler.checkpointing:
+            requeue_checkpointed_jobs([job.job_id])
+            logger.info(f"⏸️ Checkpointed {video_id} for the next start (job {job.job_id})")
+            return
+        logger.error(f"Download error for {video_id}: {str(e)}")
+        update_download_job(job.job_id, state='failed', error=str(e), finished_at=time.time())
+
+download_scheduler = DownloadScheduler(DOWNLOAD_WORKERS, download_video_thread)
+
+def lookup_channel_ids(video_ids):
+    """Map video_id -> channel_id for the given videos"""
+    channel_ids = {}
+    for start in range(0, len(video_ids), 500):
+        chunk = video_ids[start:start + 500]
+        channel_ids.update(db_query(f"SELECT video_id, channel_id FROM videos "
+                                    f"WHERE video_id IN ({sql_placeholders(chunk)})", chunk))
+    return channel_ids
+
+@app.route('/api/download', methods=['POST'])
+def download_videos():
+    data = request.get_json()
+    video_ids = data.get('video_ids', [])
+    resolution = data.get('resolution', 'highest')
+    pin = bool(data.get('pin', False))  # keep the files out of cache eviction
+
+    if not video_ids:
+        return jsonify({'error': 'No video IDs provided'}), 400
+    if service_shutdown.is_set():
+        return jsonify({'error': 'Server is shutting down, try again shortly'}), 503, {'Retry-After': '5'}
+
+    # Single-video requests come from someone waiting on the UI; big selections are bulk grabs
+    priority_name = data.get('priority') or ('interactive' if len(video_ids) == 1 else 'bulk')
+    if priority_name not in PRIORITY_NAMES:
+        return jsonify({'error': f"Unknown priority '{priority_name}'"}), 400
+    priority = PRIORITY_NAMES[priority_name]
+
+    video_ids = list(dict.fromkeys(video_ids))
+    channel_ids = lookup_channel_ids(video_ids)
+
+    requests_to_queue = [(video_id, resolution, channel_ids.get(video_id)) for video_id in video_ids]
+    if download_ownership.standby:
+        rows = [row for row, _ in enqueue_for_owner(requests_to_queue, priority)]
+        positions = estimate_queue_positions(load_active_jobs())
+        queued_jobs = [{
+            'job_id': row['job_id'],
+            'video_id': row['video_id'],
+            'status': row['state'],
+            'priority': PRIORITY_LABELS.get(row['priority'], 'bulk'),
+            'position': positions.get(row['job_id'])
+        } for row in rows]
+    else:
+        results = download_scheduler.submit_many(requests_to_queue, priority, persist=save_download_jobs)
+        positions = download_scheduler.queue_positions()
+        queued_jobs = [{
+            'job_id': job.job_id,
+            'video_id': job.video_id,
+            'status': job.status,
+            'priority': PRIORITY_LABELS[job.priority],
+            'position': positions.get(job.job_id)
+        } for job, _ in results]
+
+    if pin:
+        pin_downloads([job['job_id'] for job in queued_jobs], video_ids)
+    logger.info(f"Queued {len(video_ids)} downloads at {priority_name} priority")
+    return jsonify({'success': True, 'message': 'Downloads queued', 'jobs': queued_jobs})
+
+def pin_downloads(job_ids, video_ids):
+    """Mark jobs so their finished file is registered pinned, and pin what is already cached"""
+    with db_transaction() as conn:
+        if job_ids:
+            conn.execute(f"UPDATE download_jobs SET pin=1 WHERE job_id IN ({sql_placeholders(job_ids)})", job_ids)
+        # Also covers a job that finished before the flag above was set
+        conn.execute(f"UPDATE media_files SET pinned=1 WHERE video_id IN ({sql_placeholders(video_ids)})", video_ids)
+
+@app.route('/api/download-queue', methods=['GET'])
+def get_download_queue():
+    if download_ownership.standby:
+        counts = dict(db_query("SELECT state, COUNT(*) FROM download_jobs GROUP BY state"))
+        return jsonify({
+            'workers': DOWNLOAD_WORKERS,
+            'active_workers': counts.get('running', 0) + counts.get('merging', 0),
+            'queued': counts.get('queued', 0),
+            'role': download_ownership.role,
+        })
+    return jsonify(dict(download_scheduler.stats(), role=download_ownership.role,
+                        bandwidth=bandwidth_scheduler.stats()))
+
+def build_download_progress():
+    """Latest job per video, with live queue positions"""
+    # Queue positions move as workers pick jobs up, so fill them in at read time
+    rows = db_query("SELECT * FROM download_jobs ORDER BY created_at")
+    if download_ownership.standby:
+        positions = estimate_queue_positions(rows)
+    else:
+        positions = download_scheduler.queue_positions()
+    
+    progress = {}
+    for row in rows:
+        entry = job_progress_entry(row)
+        if row['job_id'] in positions:
+            entry['position'] = positions[row['job_id']]
+        progress[row['video_id']] = entry  # latest job per video wins
+    return progress
+
+def download_queue_version():
+    """Tag for the scheduler's in-memory queue order, which moves without a database write"""
+    return f"queue-{download_scheduler.epoch}-{download_scheduler.version}"
+
+@app.route('/api/download-progress', methods=['GET'])
+@versioned('download_jobs', live=download_queue_version)
+def get_download_progress():
+    return json_response(build_download_progress())
+
+def format_sse(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+@app.route('/api/download-events', methods=['GET'])
+def download_events():
+    """Server-Sent Events feed of download job deltas.
+
+    A fresh connection gets a 'snapshot' event (the /api/download-progress
+    payload) followed by 'job' (state change), 'progress' (coalesced byte
+    counters) and 'cleared' events. Reconnecting with Last-Event-ID resumes
+    from the backlog; if that is no longer possible a new snapshot is sent.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    resume_seq = job_events.parse_event_id(last_event_id)
+    
+    def generate():
+        yield "retry: 3000\n\n"
+        seq = resume_seq
+        while not job_events.closed:
+            events = job_events.wait(seq, timeout=15) if seq is not None else None
+            if events is None:
+                # New client, stale ID or a subscriber that fell behind the backlog
+                seq = job_events.current_seq()
+                yield format_sse(job_events.event_id(seq), 'snapshot', build_download_progress())
+                continue
+            if not events:
+                if job_events.closed:
+                    break  # Shutting down - EventSource reconnects, to a live worker if there is one
+                yield ": keep-alive\n\n"
+                continue
+            for event_seq, event_type, data in events:
+                yield format_sse(job_events.event_id(event_seq), event_type, data)
+            seq = events[-1][0]
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/clear-downloads', methods=['POST'])
+def clear_downloads():
+    db_execute("DELETE FROM download_jobs WHERE state IN ('done', 'failed')")
+    job_sync.cleared_here()
+    job_events.publish('cleared', {'states': ['done', 'failed']})
+    return jsonify({'success': True})
+
+def recover_download_jobs():
+    """Requeue jobs a previous run left queued or in flight.
+
+    The output template is deterministic and yt-dlp keeps its .part files, so a
+    requeued job resumes from the bytes already on disk. Jobs that keep dying
+    mid-download are failed after MAX_DOWNLOAD_ATTEMPTS.
+    """
+    now = time.time()
+    with db_transaction() as conn:
+        conn.execute("UPDATE download_jobs SET state='failed', error=?, finished_at=?, updated_at=? "
+                     "WHERE state IN ('running', 'merging') AND attempts >= ?",
+                     (f'Interrupted {MAX_DOWNLOAD_ATTEMPTS} times, giving up', now, now, MAX_DOWNLOAD_ATTEMPTS))
+        conn.execute("UPDATE download_jobs SET state='queued', updated_at=? WHERE state IN ('running', 'merging')",
+                     (now,))
+    
+    rows = load_active_jobs()
+    if rows:
+        download_scheduler.restore(rows)
+        logger.info(f"Recovered {len(rows)} interrupted download jobs")
+
+# Serving processes - under a multi-worker server exactly one process owns the
+# downloads; the others hand jobs to it through the download_jobs table
+OWNER_LOCK_PATH = os.environ.get('TUBE_SNATCH_OWNER_LOCK', DATABASE_PATH + '.owner.lock')
+OWNER_RETRY_INTERVAL = 5  # seconds between standby attempts to take over a vacated owner lock
+JOB_SYNC_INTERVAL = float(os.environ.get('TUBE_SNATCH_JOB_SYNC_INTERVAL', '0.5'))
+JOB_SYNC_OVERLAP = 2.0  # seconds re-read every poll, so rows committed out of timestamp order are not missed
+JOB_SYNC_MEMORY = 300  # seconds a relayed job's last state is remembered
+DRAIN_TIMEOUT = int(os.environ.get('TUBE_SNATCH_DRAIN_TIMEOUT', '30'))
+CHECKPOINT_TIMEOUT = 10
+
+class DownloadOwnership:
+    """Which serving process runs downloads, decided by an exclusive lock file.
+
+    ``role`` is 'standalone' until start_background_services() runs, then
+    'owner' (holds the lock: download workers, job recovery, media reconciler,
+    cache eviction) or 'standby' (queues jobs in the database for the owner).
+    The OS drops the lock when the owner exits, so a standby can take over
+    without any stale-lock detection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.role = 'standalone'
+        self._file = None
+
+    def try_acquire(self):
+        if self.role == 'owner':
+            return True
+        lock_file = open(self.path, 'a+b')
+        try:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            self.role = 'standby'
+            return False
+        self._file = lock_file
+        self.role = 'owner'
+        return True
+
+    @property
+    def standby(self):
+        return self.role == 'standby'
+
+download_ownership = DownloadOwnership(OWNER_LOCK_PATH)
+
+def load_queued_jobs(job_ids):
+    return db_query(f"SELECT * FROM download_jobs WHERE job_id IN ({sql_placeholders(job_ids)}) AND state='queued'",
+                    job_ids)
+
+def enqueue_for_owner(requests, priority):
+    """Standby side of /api/download: store jobs for the owner to pick up.
+
+    Returns (job row, created) pairs like submit_many. Each insert is
+    conditional, so two workers queueing the same video leave one active job.
+    """
+    now = time.time()
+    created = set()
+    with db_transaction() as conn:
+        for video_id, resolution, channel_id in requests:
+            job_id = uuid.uuid4().hex
+            cursor = conn.execute(f'''INSERT INTO download_jobs
+                                      (job_id, video_id, resolution, priority, channel_id, state, created_at, updated_at)
+                                      SELECT ?, ?, ?, ?, ?, 'queued', ?, ?
+                                      WHERE NOT EXISTS (SELECT 1 FROM download_jobs WHERE video_id=?
+                                                        AND state IN ({sql_placeholders(ACTIVE_JOB_STATES)}))''',
+                                  (job_id, video_id, resolution, priority, channel_id, now, now, video_id,
+                                   *ACTIVE_JOB_STATES))
+            if cursor.rowcount:
+                created.add(job_id)
+    video_ids = [video_id for video_id, _, _ in requests]
+    rows = {row['video_id']: row for row in db_query(
+        f"SELECT * FROM download_jobs WHERE video_id IN ({sql_placeholders(video_ids)}) "
+        f"AND state IN ({sql_placeholders(ACTIVE_JOB_STATES)})", (*video_ids, *ACTIVE_JOB_STATES))}
+    results = [(rows[video_id], rows[video_id]['job_id'] in created) for video_id in video_ids if video_id in rows]
+    new_rows = [row for row, is_new in results if is_new]
+    for row in new_rows:
+        job_events.publish('job', dict(job_progress_entry(row), video_id=row['video_id']))
+    job_sync.remember(new_rows)  # already announced here, the relay need not repeat it
+    return results
+
+def estimate_queue_positions(rows):
+    """Queue positions from stored jobs, for standby workers (ignores the owner's per-channel interleaving)"""
+    queued = sorted((row for row in rows if row['state'] == 'queued'),
+                    key=lambda row: (row['priority'], row['created_at']))
+    return {row['job_id']: position for position, row in enumerate(queued, start=1)}
+
+def requeue_checkpointed_jobs(job_ids):
+    """Put jobs stopped by a shutdown back in the queue without charging them an attempt"""
+    if not job_ids:
+        return
+    db_execute(f"UPDATE download_jobs SET state='queued', attempts=MAX(attempts - 1, 0), updated_at=? "
+               f"WHERE job_id IN ({sql_placeholders(job_ids)}) AND state IN ('running', 'merging')",
+               (time.time(), *job_ids))
+    for job_id in job_ids:
+        publish_job_state(job_id)
+
+class JobSync:
+    """Keeps this process in step with download jobs that other processes change.
+
+    Polls download_jobs rows by updated_at. The owner adopts jobs standby
+    workers queued; a standby turns the owner's updates into 'job' and
+    'progress' events for its own /api/download-events subscribers (progress
+    at the owner's PROGRESS_WRITE_INTERVAL). Both publish 'cleared' when
+    another worker clears finished jobs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen = {}  # job_id -> (state, downloaded_bytes, updated_at) last relayed
+        self._since = time.time()
+        self._finished_count = None
+        self._next_owner_attempt = 0.0
+
+    def remember(self, rows):
+        with self._lock:
+            for row in rows:
+                self._seen[row['job_id']] = (row['state'], row['downloaded_bytes'], row['updated_at'])
+
+    def cleared_here(self):
+        """This process just cleared finished jobs and told its own subscribers"""
+        with self._lock:
+            self._finished_count = None
+
+    def poll(self):
+        with self._lock:
+            since = self._since
+        rows = db_query("SELECT * FROM download_jobs WHERE updated_at >= ? ORDER BY updated_at",
+                        (since - JOB_SYNC_OVERLAP,))
+        if download_ownership.role == 'owner':
+            self._adopt(rows)
+        elif download_ownership.standby:
+            self._relay(rows)
+        self._check_cleared()
+        with self._lock:
+            if rows:
+                self._since = max(self._since, rows[-1]['updated_at'])
+            cutoff = self._since - JOB_SYNC_MEMORY
+            for job_id in [job_id for job_id, seen in self._seen.items() if seen[2] < cutoff]:
+                del self._seen[job_id]
+
+    def _adopt(self, rows):
+        queued = [row['job_id'] for row in rows if row['state'] == 'queued']
+        if not queued:
+            return
+        jobs, duplicates = download_scheduler.adopt(queued, load_queued_jobs)
+        if duplicates:
+            # Raced another worker's request for the same video; the job already here stands
+            db_execute(f"DELETE FROM download_jobs WHERE job_id IN ({sql_placeholders(duplicates)}) "
+                       "AND state='queued'", duplicates)
+        for job in jobs:
+            publish_job_state(job.job_id)
+        if jobs:
+            logger.info(f"📥 Picked up {len(jobs)} downloads queued by other workers")
+
+    def _relay(self, rows):
+        for row in rows:
+            current = (row['state'], row['downloaded_bytes'], row['updated_at'])
+            with self._lock:
+                previous = self._seen.get(row['job_id'])
+                self._seen[row['job_id']] = current
+            if previous and previous[:2] == current[:2]:
+                continue
+            entry = dict(job_progress_entry(row), video_id=row['video_id'])
+            if previous and previous[0] == current[0]:
+                job_events.publish_progress(row['job_id'], {
+                    'job_id': row['job_id'],
+                    'video_id': row['video_id'],
+                    'downloaded_bytes': entry['downloaded_bytes'],
+                    'total_bytes': entry['total_bytes'],
+                    'progress': entry['progress'],
+                })
+            else:
+                job_events.publish('job', entry)
+
+    def _check_cleared(self):
+        count = db_query_one("SELECT COUNT(*) AS n FROM download_jobs WHERE state IN ('done', 'failed')")['n']
+        with self._lock:
+            previous, self._finished_count = self._finished_count, count
+        if previous is not None and count < previous:
+            job_events.publish('cleared', {'states': ['done', 'failed']})
+
+    def run(self):
+        while not service_shutdown.wait(JOB_SYNC_INTERVAL):
+            try:
+                if download_ownership.standby and time.monotonic() >= self._next_owner_attempt:
+                    self._next_owner_attempt = time.monotonic() + OWNER_RETRY_INTERVAL
+                    if download_ownership.try_acquire():
+                        logger.info("👑 Previous download owner exited, taking over")
+                        start_owner_services()
+                self.poll()
+            except Exception as e:
+                logger.error(f"Job sync failed: {str(e)}")
+
+job_sync = JobSync()
+service_shutdown = threading.Event()
+_shutdown_lock = threading.Lock()
+_shutdown_complete = False
+
+def start_owner_services():
+    recover_download_jobs()
+    start_media_reconciler()
+    cache_manager.start()
+    resume_channel_enrichments()
+
+def start_background_services():
+    """Claim the download owner role if it is free, then start this process's background threads"""
+    if download_ownership.try_acquire():
+        logger.info(f"👑 Process {os.getpid()} owns downloads")
+        start_owner_services()
+    else:
+        logger.info(f"Process {os.getpid()} is a standby worker; downloads run in the owner process")
+    threading.Thread(target=job_sync.run, daemon=True, name='job-sync').start()
+
+def shutdown_services():
+    """Stop taking jobs, give running downloads DRAIN_TIMEOUT seconds and checkpoint the rest.
+
+    Queued jobs stay queued in the database for whichever process owns
+    downloads next. Safe to call from several threads; later callers wait for
+    the first to finish.
+    """
+    global _shutdown_complete
+    service_shutdown.set()
+    job_events.close()
+    with _shutdown_lock:
+        if _shutdown_complete:
+            return
+        if not download_ownership.standby:
+            queued = download_scheduler.stats()['queued']
+            running = download_scheduler.drain(DRAIN_TIMEOUT)
+            if running:
+                logger.info(f"⏸️ Checkpointing {len(running)} downloads still running after {DRAIN_TIMEOUT}s")
+                # Stuck in a merge or between progress ticks - the next start resumes them from their .part files
+                requeue_checkpointed_jobs([job.job_id for job in download_scheduler.checkpoint(CHECKPOINT_TIMEOUT)])
+            logger.info(f"🛑 Downloads drained, {queued} queued jobs left for the next start")
+        _shutdown_complete = True
+
+# Production serving - waitress in one process; see gunicorn.conf.py for several worker processes
+SERVER_HOST = os.environ.get('TUBE_SNATCH_HOST', '127.0.0.1')
+SERVER_PORT = int(os.environ.get('TUBE_SNATCH_PORT', '8000'))
+SERVER_THREADS = int(os.environ.get('TUBE_SNATCH_THREADS', '32'))  # every open event stream holds one
+SERVER_CHANNEL_TIMEOUT = int(os.environ.get('TUBE_SNATCH_CHANNEL_TIMEOUT', '120'))  # idle keep-alive connections
+SERVER_CONNECTION_LIMIT = int(os.environ.get('TUBE_SNATCH_CONNECTION_LIMIT', '256'))
+
+def run_production_server():
+    try:
+        from waitress import create_server
+    except ImportError:
+        logger.error("Production mode needs waitress: pip install waitress")
+        sys.exit(1)
+    
+    setup_database()
+    start_background_services()
+    # A connection streaming a file or events is never idle, so channel_timeout only reaps quiet keep-alives
+    server = create_server(app, host=SERVER_HOST, port=SERVER_PORT, threads=SERVER_THREADS,
+                           channel_timeout=SERVER_CHANNEL_TIMEOUT, connection_limit=SERVER_CONNECTION_LIMIT,
+                           ident='tube-snatch')
+    
+    def stop(signum, frame):
+        logger.info(f"🛑 Received signal {signum}, shutting down")
+        service_shutdown.set()
+        job_events.close()  # End event streams so waitress's threads can finish
+        raise SystemExit  # waitress closes its listeners when run() sees this
+    
+    for name in ('SIGTERM', 'SIGINT', 'SIGBREAK'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), stop)
+    
+    logger.info(f"Serving on http://{SERVER_HOST}:{SERVER_PORT} with {SERVER_THREADS} threads")
+    server.run()
+    shutdown_services()
+
+# Static file serving - conditional requests, byte ranges, zero-copy where the server supports it
+FILE_BUFFER_SIZE = 1024 * 1024
+MAX_BYTE_RANGES = 16
+RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+def parse_byte_ranges(header, size):
+    """Satisfiable (start, end) pairs, end inclusive, for a Range header.
+
+    Returns None when the header should be ignored (absent, malformed or not
+    bytes) and [] when it is well-formed but nothing in it can be satisfied.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        match = RANGE_SPEC_RE.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if not first:
+            # Suffix range: the final N bytes - of which an empty file has none
+            length = int(last)
+            if length and size:
+                ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    
+    # Coalesce overlapping or adjacent ranges so a client can't make us reread the file
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def file_etag(stat):
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+def read_file_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(FILE_BUFFER_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+class ClosingFile(io.FileIO):
+    """Raw file whose close() also runs a callback.
+
+    Bodies are returned with direct_passthrough so servers see their own file
+    wrapper, which means Response.call_on_close never fires - the server
+    closing the file is the only reliable end-of-response signal.
+    """
+
+    def __init__(self, path, on_close=None):
+        super().__init__(path, 'rb')
+        self._on_close = on_close
+
+    def close(self):
+        was_open = not self.closed
+        super().close()
+        if was_open and self._on_close:
+            self._on_close()
+
+def file_body(path, start, length, on_close=None):
+    """Response body for one contiguous slice of a file.
+
+    gunicorn and waitress send a wrapped file from its current offset for
+    Content-Length bytes - gunicorn with os.sendfile - so the bytes never pass
+    through Python. Without a wsgi.file_wrapper we read in large blocks.
+    """
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if not file_wrapper:
+        return ClosingIterator(read_file_range(path, start, length), on_close)
+    f = ClosingFile(path, on_close)
+    f.seek(start)
+    return file_wrapper(f, FILE_BUFFER_SIZE)
+
+def attachment_disposition(filename):
+    """Content-Disposition for a download: an ASCII fallback name plus the UTF-8 one (RFC 6266/5987)"""
+    ascii_name = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+    ascii_name = re.sub(r'["\\\x00-\x1f\x7f]', '_', ascii_name).strip()
+    stem, dot, ext = ascii_name.rpartition('.')
+    if not stem.strip(' ._'):
+        ascii_name = f"download.{ext}" if dot else 'download'
+    if ascii_name == filename:
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+
+def serve_media_file(path, download_name, mimetype='video/mp4', on_close=None):
+    """Serve a finished file with strong validators and single/multi byte-range support.
+
+    on_close runs once the server is finished with the response.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(last_modified),
+        'Content-Disposition': attachment_disposition(download_name),
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Disposition,Content-Length,Content-Range,Accept-Ranges,ETag',
+        'Cache-Control': 'private, max-age=0, must-revalidate'
+    }
+    
+    def bodiless(status):
+        response = Response(status=status, headers=headers)
+        if on_close:
+            response.call_on_close(on_close)
+        return response
+    
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            return bodiless(304)
+    elif request.if_modified_since and last_modified <= request.if_modified_since:
+        return bodiless(304)
+    
+    ranges = parse_byte_ranges(request.headers.get('Range'), size)
+    if ranges is not None and request.headers.get('If-Range'):
+        # Only honour the range if the client's copy is still this exact file
+        if_range = request.if_range
+        if if_range.etag != etag and (not if_range.date or if_range.date != last_modified):
+            ranges = None
+    if ranges is not None and len(ranges) > MAX_BYTE_RANGES:
+        ranges = None
+    
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        return Response(file_body(path, 0, size, on_close), status=200, mimetype=mimetype, headers=headers,
+                        direct_passthrough=True)
+    
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{size}'
+        return bodiless(416)
+    
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return Response(file_body(path, start, end - start + 1, on_close), status=206, mimetype=mimetype, headers=headers,
+                        direct_passthrough=True)
+    
+    # Multiple ranges: multipart/byteranges with a precomputed length
+    boundary = uuid.uuid4().hex
+    parts = [((f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+               f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode(), start, end)
+             for start, end in ranges]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    
+    def generate():
+        for part_header, start, end in parts:
+            yield part_header
+            yield from read_file_range(path, start, end - start + 1)
+        yield closing
+    
+    headers['Content-Length'] = str(sum(len(part_header) + end - start + 1 for part_header, start, end in parts)
+                                    + len(closing))
+    return Response(ClosingIterator(generate(), on_close), status=206,
+                    mimetype=f'multipart/byteranges; boundary={boundary}',
+                    headers=headers, direct_passthrough=True)
+
+# Pass-through streaming for /api/stream-download
+STREAM_CHUNK_SIZE = 256 * 1024
+STREAM_RANGE_SIZE = 10 * 1024 * 1024  # googlevideo throttles long unranged reads, so fetch in ranges like yt-dlp does
+STREAM_CONNECT_TIMEOUT = 30
+FFMPEG_PATH = shutil.which('ffmpeg')
+UNSAFE_FILENAME_CHARS = re.compile(r'[/\\:?*<>|]')
+
+def download_filename(title, ext, suffix=''):
+    """Browser-safe attachment name for a video; the suffix is added after the title is cut to 50 characters"""
+    return f"{UNSAFE_FILENAME_CHARS.sub('_', (title or 'video')[:50])}{suffix}.{ext}"
+
+def stream_variant(resolution):
+    """Normalised quality a download request asks for, e.g. 'highest' -> '1080p'"""
+    match = re.match(r'(\d+)', resolution or '')
+    return f"{min(int(match.group(1)), 1080) if match else 1080}p"
+
+def stream_format_selector(resolution, single_file=False):
+    """Format selector for a stream download, capped at 1080p like the original downloader"""
+    height = stream_variant(resolution)[:-1]
+    if single_file:
+        return f'best[height<={height}][ext=mp4]/best[height<={height}]/best'
+    return f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[height<={height}][ext=mp4]/best[height<={height}]'
+
+def proxy_ranged_chunks(url, headers, start=0, end=None):
+    """Yield bytes start..end (inclusive, None for EOF) of a remote file, fetched as consecutive byte ranges"""
+    with requests.Session() as session:
+        position = start
+        while end is None or position <= end:
+            range_end = position + STREAM_RANGE_SIZE - 1
+            if end is not None:
+                range_end = min(range_end, end)
+            with session.get(url, headers=dict(headers, Range=f'bytes={position}-{range_end}'),
+                             stream=True, timeout=STREAM_CONNECT_TIMEOUT) as response:
+                if response.status_code == 416:
+                    return
+                response.raise_for_status()
+                received = 0
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    received += len(chunk)
+                    STREAM_DOWNLOAD_BYTES.inc(len(chunk))
+                    yield chunk
+            position += received
+            if received < range_end - (position - received) + 1:
+                return  # Short range - reached the end of the file
+
+def remux_fragmented_mp4(formats):
+    """Start ffmpeg muxing separate video/audio streams into a fragmented MP4 on stdout.
+
+    frag_keyframe+empty_moov puts the moov atom up front and writes a fragment
+    per keyframe, so the output can be sent while it is being produced.
+    """
+    command = [FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-nostdin']
+    for fmt in formats:
+        headers = ''.join(f"{name}: {value}\r\n" for name, value in (fmt.get('http_headers') or {}).items())
+        command += ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+        if headers:
+            command += ['-headers', headers]
+        command += ['-i', fmt['url']]
+    for index in range(len(formats)):
+        command += ['-map', str(index)]
+    command += ['-c', 'copy', '-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', 'pipe:1']
+    
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    # Drain stderr so a chatty ffmpeg can never block on a full pipe
+    errors = collections.deque(maxlen=20)
+    threading.Thread(target=lambda: errors.extend(process.stderr), daemon=True).start()
+    
+    def chunks():
+        try:
+            while True:
+                chunk = process.stdout.read1(STREAM_CHUNK_SIZE)
+                if not chunk:
                     break
+                STREAM_DOWNLOAD_BYTES.inc(len(chunk))
+                yield chunk
+        finally:
+            if process.poll() is None:
+                process.kill()  # Client went away
+            process.wait()
+            if process.returncode not in (0, -signal.SIGKILL):
+                logger.warning(f"ffmpeg exited with {process.returncode}: {b''.join(errors).decode(errors='replace')[-500:]}")
+    
+    return chunks()
+
+def prefixed_chunks(first_chunk, chunks):
+    try:
+        yield first_chunk
+        yield from chunks
+    finally:
+        chunks.close()
+
+def open_download_stream(video_id, resolution, range_header=None, if_range=None):
+    """Pick formats for a stream download and open the byte source.
+
+    Returns a dict with chunks, ext, size, etag and byte_range (the slice
+    being sent, or None for the whole stream). Single-file formats of known
+    size honour one byte range so interrupted downloads can resume; remuxed
+    output is produced on the fly and is never ranged. The first chunk has
+    already been fetched so failures surface before any response headers are sent.
+    """
+    for attempt in (1, 2):
+        info = process_cached_info(video_id, dict(INFO_EXTRACT_OPTS, format=stream_format_selector(resolution)),
+                                   download=False)
+        requested = info.get('requested_formats')
+        if requested and not FFMPEG_PATH:
+            logger.warning("ffmpeg not found, streaming a single-file format instead of merging DASH")
+            info = process_cached_info(video_id, dict(INFO_EXTRACT_OPTS,
+                                                      format=stream_format_selector(resolution, single_file=True)),
+                                       download=False)
+            requested = None
         
-        if downloaded_file:
-            c.execute("UPDATE videos SET downloaded=1, download_progress=100, file_path=? WHERE video_id=?", 
-                     (downloaded_file, video_id))
+        size = etag = byte_range = None
+        if requested:
+            chunks, ext = remux_fragmented_mp4(requested), 'mp4'
         else:
-            c.execute("UPDATE videos SET downloaded=1, download_progress=100 WHERE video_id=?", (video_id,))
-        
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"Download completed for {video_id}, file: {downloaded_file}")
+            size, ext = info.get('filesize'), info.get('ext', 'mp4')
+            if size:
+                # A format's bytes never change for a given itag and size
+                etag = f'"{video_id}-{info.get("format_id")}-{size:x}"'
+                ranges = parse_byte_ranges(range_header, size)
+                if ranges and len(ranges) == 1 and (not if_range or if_range == etag):
+                    byte_range = ranges[0]
+            start, end = byte_range or (0, size - 1 if size else None)
+            chunks = proxy_ranged_chunks(info['url'], info.get('http_headers') or {}, start, end)
         
-    except Exception as e:
-        logger.error(f"Download error for {video_id}: {str(e)}")
-        download_progress[video_id] = {'status': 'error', 'message': str(e)}
+        try:
+            first_chunk = next(chunks, b'')
+        except requests.HTTPError as e:
+            # Stream URLs can be revoked before their expiry - retry once with a fresh extraction
+            if attempt == 2 or e.response is None or e.response.status_code != 403:
+                raise
+            logger.warning(f"Stream URL for {video_id} was refused, re-extracting")
+            video_info_cache.invalidate(video_id)
+            continue
+        if not first_chunk:
+            chunks.close()
+            raise RuntimeError('Stream ended before any data was received')
+        return {
+            'chunks': prefixed_chunks(first_chunk, chunks),
+            'format_id': info.get('format_id'),
+            'ext': ext,
+            'size': size,
+            'etag': etag,
+            'byte_range': byte_range
+        }
 
-@app.route('/api/download', methods=['POST'])
-def download_videos():
-    data = request.get_json()
-    video_ids = data.get('video_ids', [])
-    resolution = data.get('resolution', 'highest')
-    
-    if not video_ids:
-        return jsonify({'error': 'No video IDs provided'}), 400
-    
-    # Start download threads
-    for video_id in video_ids:
-        if video_id not in download_threads or not download_threads[video_id].is_alive():
-            thread = threading.Thread(target=download_video_thread, args=(video_id, resolution))
-            download_threads[video_id] = thread
-            thread.start()
-    
-    return jsonify({'success': True, 'message': 'Downloads started'})
+# Single-flight stream fetches, kept in the download cache once complete
+STREAM_PART_MAX_AGE = 3600
+STREAM_FILE_RE = re.compile(r'^.{11}_stream-(\d+p)\.\w+$')
+STREAM_PART_RE = re.compile(r'^.{11}_stream-\d+p\.\w+(\.\d+)?\.part$')
 
-@app.route('/api/download-progress', methods=['GET'])
-def get_download_progress():
-    return jsonify(download_progress)
+class StreamFlight:
+    """One upstream fetch of a (video_id, variant), written to the cache while any number of readers tail it"""
 
-@app.route('/api/clear-downloads', methods=['POST'])
-def clear_downloads():
-    global download_progress
-    download_progress = {}
-    return jsonify({'success': True})
+    def __init__(self, key):
+        self.key = key
+        self.cond = threading.Condition()
+        self.stream = None  # open_download_stream() result once the leader has it
+        self.part_path = None
+        self.final_path = None
+        self.path = None  # where the bytes are right now - part_path until the fetch completes
+        self.written = 0
+        self.readers = 0
+        self.finished = False
+        self.cancelled = False
+        self.error = None
+
+    def opened(self, stream, final_path):
+        with self.cond:
+            self.stream = stream
+            self.final_path = final_path
+            # Per process, so two serving workers fetching the same variant never share a part file
+            self.part_path = self.path = f"{final_path}.{os.getpid()}.part"
+            self.cond.notify_all()
+
+    def fail(self, error):
+        with self.cond:
+            self.error = error
+            self.cond.notify_all()
+
+    def wait_opened(self):
+        with self.cond:
+            while self.stream is None and self.error is None:
+                self.cond.wait()
+            if self.stream is None:
+                raise self.error
+
+    def write(self, video_id, variant):
+        """Pull the upstream stream into the cache; runs on its own thread so no single client owns it"""
+        chunks = self.stream['chunks']
+        try:
+            with open(self.part_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    f.flush()
+                    with self.cond:
+                        if self.cancelled:
+                            break
+                        self.written += len(chunk)
+                        self.cond.notify_all()
+            if self.cancelled:
+                os.remove(self.part_path)
+                logger.info(f"🗑️ Abandoned stream fetch {self.key}: every client disconnected")
+                return
+            with self.cond:
+                replace_file(self.part_path, self.final_path)
+                self.path = self.final_path
+            register_media_file(video_id, os.path.relpath(self.final_path, DOWNLOADS_DIR),
+                                format_id=self.stream['format_id'], variant=variant)
+            cache_manager.check()
+            with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+            logger.info(f"✅ Cached stream download {self.final_path} ({self.written} bytes)")
+        except Exception as e:
+            logger.error(f"❌ Stream fetch {self.key} failed: {str(e)}")
+            self.fail(e)
+            with contextlib.suppress(OSError):
+                os.remove(self.part_path)
+        finally:
+            chunks.close()
+            stream_flights.discard(self)
+
+    def tail(self):
+        """Yield the fetched bytes from the start, waiting for more until the fetch ends"""
+        offset = 0
+        while True:
+            with self.cond:
+                while offset >= self.written and not self.finished and self.error is None:
+                    self.cond.wait()
+                if self.error is not None:
+                    raise self.error
+                if offset >= self.written:
+                    return
+                available, path = self.written, self.path
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue  # Renamed into place between reading the path and opening it
+            with f:
+                f.seek(offset)
+                while offset < available:
+                    data = f.read(min(FILE_BUFFER_SIZE, available - offset))
+                    if not data:
+                        break
+                    offset += len(data)
+                    yield data
+
+class StreamFlights:
+    """Coalesces concurrent stream downloads of the same (video_id, variant) onto one fetch"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        """Register a reader; returns (flight, leader) - the leader must open the stream"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                with flight.cond:
+                    if flight.cancelled:
+                        flight = None
+                    else:
+                        flight.readers += 1
+            leader = flight is None
+            if leader:
+                flight = StreamFlight(key)
+                flight.readers = 1
+                self._flights[key] = flight
+                self.started += 1
+            else:
+                self.coalesced += 1
+        return flight, leader
+
+    def leave(self, flight):
+        with flight.cond:
+            flight.readers -= 1
+            # Nobody is waiting for the rest - stop fetching rather than finish for an empty room
+            abandon = flight.readers == 0 and not flight.finished and flight.error is None
+            if abandon:
+                flight.cancelled = True
+        if abandon:
+            self.discard(flight)
+
+    def discard(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def owns(self, path):
+        with self._lock:
+            return any(flight.part_path == path for flight in self._flights.values())
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._flights), 'started': self.started, 'coalesced': self.coalesced}
+
+stream_flights = StreamFlights()
+
+def replace_file(source, target, attempts=50):
+    """os.replace, retried while a reader on Windows briefly holds the source open"""
+    for attempt in range(attempts):
+        try:
+            return os.replace(source, target)
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1)
+
+def serve_cached_media(video, media_file):
+    """Serve an indexed file, holding a lease on it until the response is closed"""
+    clean_filename = download_filename(video['title'], media_file['ext'])
+    file_path = os.path.join(DOWNLOADS_DIR, media_file['path'])
+    media_leases.acquire(media_file['path'])
+    cache_manager.record_access(media_file['path'])
+    try:
+        response = serve_media_file(file_path, clean_filename, mimetypes.guess_type(file_path)[0] or 'video/mp4',
+                                    on_close=lambda: media_leases.release(media_file['path']))
+    except Exception:
+        media_leases.release(media_file['path'])
+        raise
+    logger.info(f"✅ Serving cached file: {clean_filename}")
+    return response
 
 @app.route('/api/stream-download/<video_id>', methods=['GET'])
 def stream_download(video_id):
-    """Stream download directly to browser - no temp files, real Chrome progress!"""
+    """Stream download directly to browser - no temp files, real Chrome progress!
+
+    Single-file formats are proxied from YouTube in ranged chunks; DASH
+    video+audio pairs are remuxed by ffmpeg into a fragmented MP4 on the fly.
+    Concurrent requests for the same video and quality share one fetch, and
+    the finished file stays in the download cache for repeat requests.
+    """
     try:
-        conn = setup_database()
-        c = conn.cursor()
-        c.execute("SELECT * FROM videos WHERE video_id=?", (video_id,))
-        video = c.fetchone()
-        conn.close()
+        video = db_query_one("SELECT * FROM videos WHERE video_id=?", (video_id,))
         
         if not video:
             logger.error(f"Video {video_id} not found in database")
             return jsonify({'error': 'Video not found'}), 404
         
-        video_title = video[2]  # title is at index 2
         resolution = request.args.get('resolution', 'highest')
+        variant = stream_variant(resolution)
         
-        # Clean filename for browser download
-        clean_filename = f"{video_title[:50].replace('/', '_').replace('\\', '_').replace(':', '_').replace('?', '_').replace('*', '_').replace('<', '_').replace('>', '_').replace('|', '_')}.mp4"
-        
-        logger.info(f"🚀 Starting direct stream download: {clean_filename}")
-        
-        # Get YouTube video URL
-        video_url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        # Configure yt-dlp for 1080p MAXIMUM quality like Y2mate (DASH merging)
-        ydl_opts = {
-            'format': 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080][ext=mp4]/best[height<=1080]',  # 1080p max with DASH merging
-            'quiet': True,
-            'no_warnings': True,
-            'merge_output_format': 'mp4',  # Force merge to MP4
-            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                    'player_skip': ['configs', 'webpage']
-                }
-            },
-            'retries': 5,
-            'fragment_retries': 5,
-            'skip_unavailable_fragments': True,
-        }
-        
-        # Download to temp file first with proper 1080p quality, then stream it
-        
-        temp_id = uuid.uuid4().hex
-        temp_filename = f"temp_{temp_id}.%(ext)s"
-        temp_path = os.path.join("downloads", temp_filename)
-        os.makedirs("downloads", exist_ok=True)
+        # Already fetched at this quality - serve from disk with full Range support
+        media_file = lookup_media_file(video_id, variant)
+        if media_file:
+            return serve_cached_media(video, media_file)
         
-        # Update ydl_opts to actually download the file with proper quality
-        ydl_opts['outtmpl'] = temp_path
-        
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                logger.info(f"🎬 Downloading 1080p video {video_id} to temp file...")
-                ydl.download([video_url])
-            
-            # Find the actual downloaded file (yt-dlp might change the extension)
-            actual_file = None
-            downloads_dir = "downloads"
-            if os.path.exists(downloads_dir):
-                for filename in os.listdir(downloads_dir):
-                    if filename.startswith(f"temp_{temp_id}"):
-                        actual_file = os.path.join(downloads_dir, filename)
-                        break
-            
-            if not actual_file or not os.path.exists(actual_file):
-                return jsonify({'error': 'Failed to download video file'}), 500
+        if request.headers.get('Range'):
+            # Resuming a download that isn't cached - proxy just the requested bytes
+            try:
+                stream = open_download_stream(video_id, resolution, request.headers.get('Range'),
+                                              request.headers.get('If-Range'))
+            except Exception as e:
+                logger.error(f"❌ Download failed: {str(e)}")
+                return jsonify({'error': f'Download failed: {str(e)}'}), 500
+            chunks, release = stream['chunks'], stream['chunks'].close
+        else:
+            flight, leader = stream_flights.join((video_id, variant))
+            try:
+                if leader:
+                    try:
+                        stream = open_download_stream(video_id, resolution)
+                    except Exception as e:
+                        flight.fail(e)
+                        stream_flights.discard(flight)
+                        raise
+                    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+                    flight.opened(stream, os.path.join(DOWNLOADS_DIR, f"{video_id}_stream-{variant}.{stream['ext']}"))
+                    threading.Thread(target=flight.write, args=(video_id, variant), daemon=True).start()
+                else:
+                    logger.info(f"🔗 Joining in-flight stream download of {video_id} at {variant}")
+                    flight.wait_opened()
+            except Exception as e:
+                stream_flights.leave(flight)
+                logger.error(f"❌ Download failed: {str(e)}")
+                return jsonify({'error': f'Download failed: {str(e)}'}), 500
             
-            logger.info(f"✅ Successfully downloaded 1080p file: {actual_file}")
+            stream = dict(flight.stream, byte_range=None)
+            cache_path = os.path.relpath(flight.final_path, DOWNLOADS_DIR)
+            media_leases.acquire(cache_path)
+            chunks = flight.tail()
             
-        except Exception as e:
-            logger.error(f"❌ Download failed: {str(e)}")
-            return jsonify({'error': f'Download failed: {str(e)}'}), 500
+            def release():
+                media_leases.release(cache_path)
+                stream_flights.leave(flight)
         
-        # Stream the actual 1080p downloaded file to browser
-        from flask import Response, stream_with_context
+        # Clean filename for browser download
+        clean_filename = download_filename(video['title'], stream['ext'])
+        size = stream['size']
         
         def generate():
-            with open(actual_file, 'rb') as f:
-                while True:
-                    chunk = f.read(8192)
-                    if not chunk:
-                        break
-                    yield chunk
-        
-        # Get file size for proper download progress
-        file_size = os.path.getsize(actual_file)
-        
-        response = Response(
-            stream_with_context(generate()),
-            mimetype='video/mp4',
-            headers={
-                'Content-Disposition': f'attachment; filename="{clean_filename}"',
-                'Content-Length': str(file_size),
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Expose-Headers': 'Content-Disposition,Content-Length',
-                'Cache-Control': 'no-cache'
-            }
-        )
-        
-        # Clean up temp file after streaming (in background)
-        def cleanup_temp_file():
             try:
-                time.sleep(5)  # Wait a bit for download to start
-                if os.path.exists(actual_file):
-                    os.remove(actual_file)
-                    logger.info(f"🗑️ Cleaned up temp file: {actual_file}")
+                yield from chunks
             except Exception as e:
-                logger.warning(f"Could not clean up temp file: {e}")
+                # Headers are already out - all we can do is cut the response short
+                logger.error(f"❌ Stream for {video_id} broke off: {str(e)}")
         
-        import threading
-        cleanup_thread = threading.Thread(target=cleanup_temp_file)
-        cleanup_thread.daemon = True
-        cleanup_thread.start()
+        headers = {
+            'Content-Disposition': attachment_disposition(clean_filename),
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Content-Disposition,Content-Length,Content-Range,Accept-Ranges,ETag',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+        status = 200
+        if size:
+            headers['Accept-Ranges'] = 'bytes'
+            headers['ETag'] = stream['etag']
+            headers['Content-Length'] = str(size)
+        if stream['byte_range']:
+            start, end = stream['byte_range']
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            headers['Content-Length'] = str(end - start + 1)
         
-        logger.info(f"✅ Started streaming 1080p download: {clean_filename} ({file_size} bytes)")
+        logger.info(f"✅ Started streaming download: {clean_filename} ({size or 'unknown'} bytes)")
+        response = Response(generate(), status=status, mimetype='video/mp4', headers=headers)
+        # Runs once the server is done with the response, even if the body was never iterated
+        response.call_on_close(release)
         return response
         
     except Exception as e:
@@ -739,66 +3988,20 @@ def stream_download(video_id):
 def download_file(video_id):
     """Fallback method - serve from local files if they exist"""
     try:
-        conn = setup_database()
-        c = conn.cursor()
-        c.execute("SELECT * FROM videos WHERE video_id=? AND downloaded=1", (video_id,))
-        video = c.fetchone()
-        conn.close()
+        video = db_query_one("SELECT * FROM videos WHERE video_id=? AND downloaded=1", (video_id,))
         
         if not video:
             # If not downloaded locally, redirect to stream download
             return redirect(f'/api/stream-download/{video_id}')
         
-        downloads_dir = "downloads"
-        if not os.path.exists(downloads_dir):
-            return redirect(f'/api/stream-download/{video_id}')
-        
-        # First try to use stored file_path from database (column 11)
-        stored_filename = video[11] if len(video) > 11 and video[11] else None
+        media_file = lookup_media_file(video_id)
+        if not media_file and video['file_path'] and os.path.isfile(os.path.join(DOWNLOADS_DIR, video['file_path'])):
+            # Downloaded before the index existed and not yet adopted by the reconciler
+            register_media_file(video_id, video['file_path'])
+            media_file = lookup_media_file(video_id)
         
-        if stored_filename:
-            file_path = os.path.join(downloads_dir, stored_filename)
-            if os.path.exists(file_path):
-                # Clean filename for download using video title
-                video_title = video[2]  # title is at index 2
-                clean_filename = f"{video_title[:50].replace('/', '_').replace('\\', '_').replace(':', '_').replace('?', '_').replace('*', '_').replace('<', '_').replace('>', '_').replace('|', '_')}.{stored_filename.split('.')[-1]}"
-                
-                response = send_file(
-                    file_path, 
-                    as_attachment=True, 
-                    download_name=clean_filename,
-                    mimetype='video/mp4'
-                )
-                
-                # Add CORS headers for browser download
-                response.headers['Access-Control-Allow-Origin'] = '*'
-                response.headers['Access-Control-Expose-Headers'] = 'Content-Disposition'
-                
-                logger.info(f"✅ Serving cached file: {clean_filename}")
-                return response
-        
-        # Fallback: Look for files starting with video ID
-        for filename in os.listdir(downloads_dir):
-            if filename.startswith(f"{video_id}_"):
-                file_path = os.path.join(downloads_dir, filename)
-                if os.path.exists(file_path):
-                    # Clean filename for download
-                    video_title = video[2]  # title is at index 2
-                    clean_filename = f"{video_title[:50].replace('/', '_').replace('\\', '_').replace(':', '_').replace('?', '_').replace('*', '_').replace('<', '_').replace('>', '_').replace('|', '_')}.{filename.split('.')[-1]}"
-                    
-                    response = send_file(
-                        file_path, 
-                        as_attachment=True, 
-                        download_name=clean_filename,
-                        mimetype='video/mp4'
-                    )
-                    
-                    # Add CORS headers for browser download
-                    response.headers['Access-Control-Allow-Origin'] = '*'
-                    response.headers['Access-Control-Expose-Headers'] = 'Content-Disposition'
-                    
-                    logger.info(f"✅ Serving cached file (fallback): {clean_filename}")
-                    return response
+        if media_file:
+            return serve_cached_media(video, media_file)
         
         # No local file found, redirect to stream download
         return redirect(f'/api/stream-download/{video_id}')
@@ -807,27 +4010,241 @@ def download_file(video_id):
         logger.error(f"Error serving download: {str(e)}")
         return redirect(f'/api/stream-download/{video_id}')
 
+# Archive export - stored ZIP or tar streamed straight from the download cache
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x0808  # sizes/CRC in a trailing data descriptor, UTF-8 names
+EXPORT_MAX_FILES = 5000
+
+def dos_datetime(timestamp):
+    t = time.localtime(max(timestamp, 315532800))  # DOS dates start in 1980
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+class StoredZipStream:
+    """Uncompressed ZIP of existing files, produced on the fly with an exact length.
+
+    Every header size is known up front - only the CRCs are computed while
+    streaming, and those go into fixed-size data descriptors and the central
+    directory - so Content-Length can be sent before the first byte. Members
+    or offsets past 4 GiB get ZIP64 extra fields and end records.
+    """
+
+    def __init__(self, members):
+        # members: (archive name, path, size, mtime)
+        self.members = []
+        offset = 0
+        for name, path, size, mtime in members:
+            member = {
+                'name': name.encode('utf-8'),
+                'path': path,
+                'size': size,
+                'time': dos_datetime(mtime),
+                'offset': offset,
+                'large': size >= ZIP32_LIMIT,
+                'crc': 0,
+            }
+            self.members.append(member)
+            offset += len(self._local_header(member)) + size + len(self._data_descriptor(member))
+        self.central_offset = offset
+        self.central_size = sum(len(self._central_header(member)) for member in self.members)
+        self.length = self.central_offset + self.central_size + len(self._end_records())
+
+    def _local_header(self, member):
+        extra = struct.pack('<HHQQ', 0x0001, 16, member['size'], member['size']) if member['large'] else b''
+        size32 = ZIP32_LIMIT if member['large'] else member['size']
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if member['large'] else 20, ZIP_FLAGS, 0,
+                           *member['time'], 0, size32, size32, len(member['name']), len(extra)) + member['name'] + extra
+
+    def _data_descriptor(self, member):
+        if member['large']:
+            return struct.pack('<IIQQ', 0x08074b50, member['crc'], member['size'], member['size'])
+        return struct.pack('<IIII', 0x08074b50, member['crc'], member['size'], member['size'])
+
+    def _central_header(self, member):
+        far = member['offset'] >= ZIP32_LIMIT
+        extra_fields = ([member['size'], member['size']] if member['large'] else []) + ([member['offset']] if far else [])
+        extra = struct.pack(f'<HH{len(extra_fields)}Q', 0x0001, 8 * len(extra_fields), *extra_fields) if extra_fields else b''
+        size32 = ZIP32_LIMIT if member['large'] else member['size']
+        version = 45 if extra_fields else 20
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, ZIP_FLAGS, 0, *member['time'],
+                           member['crc'], size32, size32, len(member['name']), len(extra), 0, 0, 0, 0,
+                           ZIP32_LIMIT if far else member['offset']) + member['name'] + extra
+
+    def _end_records(self):
+        count = len(self.members)
+        records = b''
+        if count >= 0xFFFF or self.central_offset >= ZIP32_LIMIT or self.central_size >= ZIP32_LIMIT:
+            zip64_end_offset = self.central_offset + self.central_size
+            records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count,
+                                   self.central_size, self.central_offset)
+            records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+        return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                     min(self.central_size, ZIP32_LIMIT), min(self.central_offset, ZIP32_LIMIT), 0)
+
+    def __iter__(self):
+        for member in self.members:
+            yield self._local_header(member)
+            crc = 0
+            sent = 0
+            for chunk in read_file_range(member['path'], 0, member['size']):
+                crc = zlib.crc32(chunk, crc)
+                sent += len(chunk)
+                yield chunk
+            if sent != member['size']:
+                raise IOError(f"{member['path']} changed size during export")
+            member['crc'] = crc
+            yield self._data_descriptor(member)
+        for member in self.members:
+            yield self._central_header(member)
+        yield self._end_records()
+
+class TarStream:
+    """GNU tar of existing files, produced on the fly with an exact length"""
+
+    BLOCK = tarfile.BLOCKSIZE
+
+    def __init__(self, members):
+        self.members = []
+        for name, path, size, mtime in members:
+            info = tarfile.TarInfo(name)
+            info.size, info.mtime, info.mode = size, int(mtime), 0o644
+            self.members.append((info.tobuf(format=tarfile.GNU_FORMAT, encoding='utf-8'), path, size))
+        self.length = sum(len(header) + self._padded(size) for header, _, size in self.members) + 2 * self.BLOCK
+
+    def _padded(self, size):
+        return -(-size // self.BLOCK) * self.BLOCK
+
+    def __iter__(self):
+        for header, path, size in self.members:
+            yield header
+            sent = 0
+            for chunk in read_file_range(path, 0, size):
+                sent += len(chunk)
+                yield chunk
+            if sent != size:
+                raise IOError(f"{path} changed size during export")
+            yield b'\0' * (self._padded(size) - size)
+        yield b'\0' * (2 * self.BLOCK)
+
+EXPORT_FORMATS = {
+    'zip': (StoredZipStream, 'application/zip'),
+    'tar': (TarStream, 'application/x-tar'),
+}
+
+@app.route('/api/export', methods=['GET', 'POST'])
+def export_videos():
+    """Stream downloaded videos as one archive.
+
+    Takes video_ids (list, or comma-separated in a query string) or a
+    channel_id, and format=zip (stored, no compression) or tar. Nothing is
+    staged on disk; the archive is assembled from the cached files as it is
+    sent, with an exact Content-Length.
+    """
+    try:
+        params = request.get_json(silent=True) or request.values
+        archive_format = params.get('format', 'zip')
+        if archive_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unsupported format: {archive_format}'}), 400
+        
+        video_ids = params.get('video_ids') or []
+        if isinstance(video_ids, str):
+            video_ids = [video_id for video_id in video_ids.split(',') if video_id]
+        channel_id = params.get('channel_id')
+        
+        newest_file = "m.path = (SELECT path FROM media_files WHERE video_id=v.video_id ORDER BY created_at DESC LIMIT 1)"
+        if video_ids:
+            rows = []
+            for start in range(0, len(video_ids), 500):
+                batch = video_ids[start:start + 500]
+                rows += db_query(f"SELECT v.video_id, v.title, v.channel_name, m.path, m.ext FROM videos v "
+                                 f"JOIN media_files m ON {newest_file} "
+                                 f"WHERE v.video_id IN ({sql_placeholders(batch)}) ORDER BY v.id", batch)
+        elif channel_id:
+            rows = db_query(f"SELECT v.video_id, v.title, v.channel_name, m.path, m.ext FROM videos v "
+                            f"JOIN media_files m ON {newest_file} WHERE v.channel_id=? ORDER BY v.id", (channel_id,))
+        else:
+            return jsonify({'error': 'Provide video_ids or channel_id'}), 400
+        
+        if len(rows) > EXPORT_MAX_FILES:
+            return jsonify({'error': f'At most {EXPORT_MAX_FILES} videos per export'}), 400
+        
+        members = []
+        for row in rows:
+            file_path = os.path.join(DOWNLOADS_DIR, row['path'])
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            # Titles can repeat, so the video ID keeps archive names unique
+            archive_name = download_filename(row['title'] or row['video_id'], row['ext'], f" [{row['video_id']}]")
+            members.append((archive_name, file_path, stat.st_size, stat.st_mtime, row['path']))
+        
+        if not members:
+            return jsonify({'error': 'None of the requested videos are downloaded'}), 404
+        
+        # Keep the cache manager away from every member until the archive is sent
+        for member in members:
+            media_leases.acquire(member[4])
+        # A file evicted before its lease was taken is gone from the index - leave it out
+        leased = [member[4] for member in members]
+        indexed = set()
+        for start in range(0, len(leased), 500):
+            batch = leased[start:start + 500]
+            indexed.update(row['path'] for row in db_query(
+                f"SELECT path FROM media_files WHERE path IN ({sql_placeholders(batch)})", batch))
+        for member in members:
+            if member[4] not in indexed:
+                media_leases.release(member[4])
+        members = [member for member in members if member[4] in indexed]
+        if not members:
+            return jsonify({'error': 'None of the requested videos are downloaded'}), 404
+        
+        def release():
+            for member in members:
+                media_leases.release(member[4])
+        
+        archive_class, mimetype = EXPORT_FORMATS[archive_format]
+        archive = archive_class([member[:4] for member in members])
+        
+        label = rows[0]['channel_name'] if channel_id and rows[0]['channel_name'] else 'tube-snatch-export'
+        archive_filename = download_filename(label, archive_format)
+        
+        def generate():
+            try:
+                yield from archive
+            except Exception as e:
+                logger.error(f"❌ Export broke off: {str(e)}")
+        
+        response = Response(generate(), mimetype=mimetype, headers={
+            'Content-Length': str(archive.length),
+            'Content-Disposition': attachment_disposition(archive_filename),
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Content-Disposition,Content-Length',
+            'Cache-Control': 'no-cache'
+        })
+        response.call_on_close(release)
+        logger.info(f"📦 Exporting {len(members)} videos as {archive_format} ({archive.length} bytes)")
+        return response
+        
+    except Exception as e:
+        logger.error(f"❌ Export error: {str(e)}")
+        return jsonify({'error': f'Export failed: {str(e)}'}), 500
+
 @app.route('/api/play-video/<video_id>', methods=['GET'])
 def play_video(video_id):
     """Stream video for web player with quality selection"""
     try:
-        conn = setup_database()
-        c = conn.cursor()
-        c.execute("SELECT * FROM videos WHERE video_id=?", (video_id,))
-        video = c.fetchone()
-        conn.close()
+        video = db_query_one("SELECT * FROM videos WHERE video_id=?", (video_id,))
         
         if not video:
             logger.error(f"Video {video_id} not found in database")
             return jsonify({'error': 'Video not found'}), 404
         
-        video_title = video[2]
+        video_title = video['title']
         quality = request.args.get('quality', '720p')  # Default to 720p for streaming
         
         logger.info(f"🎥 Streaming video for player: {video_title} at {quality}")
         
-        video_url = f"https://www.youtube.com/watch?v={video_id}"
-        
         # Configure yt-dlp for streaming playback with quality selection
         if quality == '1080p':
             format_selector = 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080][ext=mp4]/best[height<=1080]'
@@ -838,99 +4255,294 @@ def play_video(video_id):
         else:
             format_selector = 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720][ext=mp4]/best[height<=720]'
         
-        ydl_opts = {
-            'format': format_selector,
-            'quiet': True,
-            'no_warnings': True,
-            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                    'player_skip': ['configs', 'webpage']
-                }
-            },
-            'retries': 3,
-            'fragment_retries': 3,
-        }
+        ydl_opts = dict(INFO_EXTRACT_OPTS, format=format_selector)
+        
+        # Format selection only - the extraction itself comes from the shared info cache
+        info = process_cached_info(video_id, ydl_opts, download=False)
+        if not info:
+            return jsonify({'error': 'Could not extract video info'}), 500
+        
+        # Get direct stream URL
+        stream_url = info.get('url')
+        if not stream_url and 'formats' in info:
+            formats = info['formats']
+            for fmt in formats:
+                if fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none':
+                    stream_url = fmt.get('url')
+                    break
+        
+        if not stream_url:
+            return jsonify({'error': 'No stream URL found'}), 500
+        
+        # Return video info for the web player
+        return jsonify({
+            'success': True,
+            'video_id': video_id,
+            'title': video_title,
+            'stream_url': stream_url,
+            'quality': quality,
+            'duration': info.get('duration', 0),
+            'thumbnail': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
+        })
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
-            if not info:
-                return jsonify({'error': 'Could not extract video info'}), 500
-            
-            # Get direct stream URL
-            stream_url = info.get('url')
-            if not stream_url and 'formats' in info:
-                formats = info['formats']
-                for fmt in formats:
-                    if fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none':
-                        stream_url = fmt.get('url')
-                        break
-            
-            if not stream_url:
-                return jsonify({'error': 'No stream URL found'}), 500
-            
-            # Return video info for the web player
-            return jsonify({
-                'success': True,
-                'video_id': video_id,
-                'title': video_title,
-                'stream_url': stream_url,
-                'quality': quality,
-                'duration': info.get('duration', 0),
-                'thumbnail': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-            })
-            
     except Exception as e:
         logger.error(f"❌ Play video error for {video_id}: {str(e)}")
         return jsonify({'error': f'Play video failed: {str(e)}'}), 500
 
+def video_qualities(info):
+    """Player quality buckets available in an extracted info dict"""
+    qualities = set()
+    for fmt in info.get('formats') or []:
+        height = fmt.get('height')
+        if height and fmt.get('vcodec') != 'none':
+            if height >= 1080:
+                qualities.add('1080p')
+            elif height >= 720:
+                qualities.add('720p')
+            elif height >= 480:
+                qualities.add('480p')
+    
+    # Default qualities if none found
+    if not qualities:
+        qualities = {'720p', '480p'}
+    
+    return sorted(qualities, key=lambda x: int(x[:-1]), reverse=True)
+
+# Quality resolution - results persisted in videos.resolutions
+QUALITY_WORKERS = int(os.environ.get('TUBE_SNATCH_QUALITY_WORKERS', '8'))
+QUALITY_CACHE_TTL = int(os.environ.get('TUBE_SNATCH_QUALITY_CACHE_TTL', str(7 * 24 * 3600)))  # HD renditions can appear after upload
+QUALITY_ITEM_TIMEOUT = 20
+QUALITY_MAX_ITEM_TIMEOUT = 60
+QUALITY_BATCH_LIMIT = 1000
+
+# Shared by every batch request so concurrent listings can't pile up extractions
+quality_executor = concurrent.futures.ThreadPoolExecutor(max_workers=QUALITY_WORKERS, thread_name_prefix='qualities')
+
+def cached_qualities(video_ids):
+    """Stored qualities still within QUALITY_CACHE_TTL, keyed by video ID"""
+    cached = {}
+    cutoff = time.time() - QUALITY_CACHE_TTL
+    for start in range(0, len(video_ids), 500):
+        batch = video_ids[start:start + 500]
+        rows = db_query(f"SELECT video_id, resolutions FROM videos WHERE video_id IN ({sql_placeholders(batch)}) "
+                        f"AND qualities_checked_at > ?", (*batch, cutoff))
+        cached.update((row['video_id'], row['resolutions'].split(',')) for row in rows if row['resolutions'])
+    return cached
+
+def resolve_qualities(video_id):
+    qualities = video_qualities(video_info_cache.get(video_id))
+    db_execute("UPDATE videos SET resolutions=?, qualities_checked_at=? WHERE video_id=?",
+               (",".join(qualities), time.time(), video_id))
+    return qualities
+
+@app.route('/api/video-qualities', methods=['POST'])
+def get_video_qualities_batch():
+    """Resolve qualities for many videos at once, streamed back as NDJSON.
+
+    Stored results come first, then one line per video as extractions finish
+    on the shared pool. At most QUALITY_WORKERS of a request's extractions
+    are submitted at a time, each gets ``timeout`` seconds once it has
+    started. A timed-out extraction is reported straight away but keeps its
+    slot until its worker is free, so the rest don't queue up behind it. The
+    last line is a summary.
+    """
+    try:
+        data = request.json or {}
+        video_ids = list(dict.fromkeys(data.get('video_ids', [])))
+        if not video_ids:
+            return jsonify({'error': 'No video IDs provided'}), 400
+        if len(video_ids) > QUALITY_BATCH_LIMIT:
+            return jsonify({'error': f'At most {QUALITY_BATCH_LIMIT} videos per request'}), 400
+        item_timeout = min(float(data.get('timeout', QUALITY_ITEM_TIMEOUT)), QUALITY_MAX_ITEM_TIMEOUT)
+        
+        cached = cached_qualities(video_ids)
+        
+    except Exception as e:
+        logger.error(f"❌ Batch qualities error: {str(e)}")
+        return jsonify({'error': f'Get qualities failed: {str(e)}'}), 500
+    
+    def generate():
+        counts = {'cached': len(cached), 'resolved': 0, 'failed': 0, 'timed_out': 0}
+        for video_id, qualities in cached.items():
+            yield json.dumps({'video_id': video_id, 'qualities': qualities, 'cached': True}) + "\n"
+        
+        started = {}
+        
+        def resolve(video_id):
+            started[video_id] = time.monotonic()
+            try:
+                return resolve_qualities(video_id)
+            finally:
+                started.pop(video_id, None)
+        
+        remaining = iter([video_id for video_id in video_ids if video_id not in cached])
+        exhausted = False
+        pending = {}  # future -> video_id
+        overdue = set()  # timed-out extractions still holding a worker
+        try:
+            while True:
+                overdue = {future for future in overdue if not future.done()}
+                while not exhausted and len(pending) + len(overdue) < QUALITY_WORKERS:
+                    video_id = next(remaining, None)
+                    if video_id is None:
+                        exhausted = True
+                        break
+                    pending[quality_executor.submit(resolve, video_id)] = video_id
+                if not pending and (exhausted or not overdue):
+                    break
+                
+                done, _ = concurrent.futures.wait(pending or overdue, timeout=0.5,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    video_id = pending.pop(future, None)
+                    if video_id is None:
+                        continue
+                    try:
+                        line = {'video_id': video_id, 'qualities': future.result(), 'cached': False}
+                        counts['resolved'] += 1
+                    except Exception as e:
+                        line = {'video_id': video_id, 'error': str(e)}
+                        counts['failed'] += 1
+                    yield json.dumps(line) + "\n"
+                
+                # Queued items don't time out - only ones that have been running too long
+                now = time.monotonic()
+                for future, video_id in list(pending.items()):
+                    if now - started.get(video_id, now) > item_timeout:
+                        del pending[future]
+                        overdue.add(future)
+                        counts['timed_out'] += 1
+                        yield json.dumps({'video_id': video_id, 'error': 'Timed out'}) + "\n"
+        finally:
+            # Client went away (or we're done) - drop work that hasn't started yet
+            for future in pending:
+                future.cancel()
+        
+        yield json.dumps(dict(counts, done=True)) + "\n"
+    
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
 @app.route('/api/video-qualities/<video_id>', methods=['GET'])
 def get_video_qualities(video_id):
     """Get available qualities for a video"""
     try:
-        video_url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'listformats': True,
-            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        }
+        cached = cached_qualities([video_id])
+        return jsonify({
+            'success': True,
+            'qualities': cached.get(video_id) or resolve_qualities(video_id)
+        })
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
-            if not info:
-                return jsonify({'error': 'Could not extract video info'}), 500
-            
-            # Extract available qualities
-            qualities = set()
-            if 'formats' in info:
-                for fmt in info['formats']:
-                    height = fmt.get('height')
-                    if height and fmt.get('vcodec') != 'none':
-                        if height >= 1080:
-                            qualities.add('1080p')
-                        elif height >= 720:
-                            qualities.add('720p')
-                        elif height >= 480:
-                            qualities.add('480p')
-            
-            # Default qualities if none found
-            if not qualities:
-                qualities = {'720p', '480p'}
-            
-            return jsonify({
-                'success': True,
-                'qualities': sorted(list(qualities), key=lambda x: int(x[:-1]), reverse=True)
-            })
-            
     except Exception as e:
         logger.error(f"❌ Get qualities error for {video_id}: {str(e)}")
         return jsonify({'error': f'Get qualities failed: {str(e)}'}), 500
 
+@app.route('/api/info-cache', methods=['GET'])
+def get_info_cache_stats():
+    return jsonify(video_info_cache.stats())
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache_usage():
+    """Download cache usage against its quota"""
+    return jsonify(dict(cache_manager.stats(), stream_fetches=stream_flights.stats()))
+
+@app.route('/api/cache/pin', methods=['POST'])
+def pin_cached_videos():
+    """Pin (or with "pinned": false, unpin) cached files of the given videos so eviction skips them"""
+    try:
+        data = request.json or {}
+        video_ids = data.get('video_ids', [])
+        if not video_ids:
+            return jsonify({'error': 'No video IDs provided'}), 400
+        pinned = bool(data.get('pinned', True))
+        
+        updated = db_execute(f"UPDATE media_files SET pinned=? WHERE video_id IN ({sql_placeholders(video_ids)})",
+                             (int(pinned), *video_ids))
+        if not pinned:
+            cache_manager.check()
+        return jsonify({'success': True, 'pinned': pinned, 'files': updated})
+        
+    except Exception as e:
+        logger.error(f"Error pinning cached files: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+METRICS_MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+class StatsCollector:
+    """Exports the counters the caches and scheduler already keep, read only when scraped.
+
+    Queue and cache figures come from the shared database, so any worker
+    reports the same values. The info cache and stream counters live in each
+    process; with several workers they carry a pid label.
+    """
+
+    def describe(self):
+        # Without this, registering the collector would call collect() at import time
+        return []
+
+    def collect(self):
+        process_labels = ['pid'] if METRICS_MULTIPROCESS else []
+        process = [str(os.getpid())] if METRICS_MULTIPROCESS else []
+        
+        jobs = {row['state']: row['n'] for row in db_query(
+            f"SELECT state, COUNT(*) AS n FROM download_jobs WHERE state IN ({sql_placeholders(ACTIVE_JOB_STATES)}) "
+            f"GROUP BY state", ACTIVE_JOB_STATES)}
+        active = jobs.get('running', 0) + jobs.get('merging', 0)
+        queue_depth = GaugeMetricFamily('tubesnatch_download_queue_depth', 'Download jobs waiting for a worker')
+        queue_depth.add_metric([], jobs.get('queued', 0))
+        yield queue_depth
+        workers = GaugeMetricFamily('tubesnatch_download_workers', 'Download workers by state', labels=['state'])
+        workers.add_metric(['active'], active)
+        workers.add_metric(['idle'], max(download_scheduler.worker_count - active, 0))
+        yield workers
+        
+        info = video_info_cache.stats()
+        lookups = CounterMetricFamily('tubesnatch_info_cache_lookups', 'Info cache lookups by result',
+                                      labels=['result'] + process_labels)
+        for result in ('hits', 'misses', 'coalesced'):
+            lookups.add_metric([result] + process, info[result])
+        yield lookups
+        entries = GaugeMetricFamily('tubesnatch_info_cache_entries', 'Cached extractions', labels=process_labels)
+        entries.add_metric(process, info['entries'])
+        yield entries
+        
+        flights = stream_flights.stats()
+        fetches = CounterMetricFamily('tubesnatch_stream_fetches', 'Stream download requests by how they were served',
+                                      labels=['result'] + process_labels)
+        fetches.add_metric(['started'] + process, flights['started'])
+        fetches.add_metric(['coalesced'] + process, flights['coalesced'])
+        yield fetches
+        
+        cache = cache_manager.stats()
+        cache_bytes = GaugeMetricFamily('tubesnatch_download_cache_bytes', 'Download cache size', labels=['kind'])
+        cache_bytes.add_metric(['used'], cache['used_bytes'])
+        cache_bytes.add_metric(['pinned'], cache['pinned_bytes'])
+        cache_bytes.add_metric(['quota'], cache['quota_bytes'])
+        yield cache_bytes
+        evicted = CounterMetricFamily('tubesnatch_download_cache_evicted_bytes', 'Bytes evicted from the download cache',
+                                      labels=process_labels)
+        evicted.add_metric(process, cache['evicted_bytes'])
+        yield evicted
+
+if METRICS_MULTIPROCESS:
+    # Counters and histograms summed over every gunicorn worker, plus this worker's own stats
+    metrics_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(metrics_registry)
+else:
+    metrics_registry = REGISTRY
+metrics_registry.register(StatsCollector())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(generate_latest(metrics_registry), mimetype=CONTENT_TYPE_LATEST)
+
 if __name__ == '__main__':
-    setup_database()
     logger.info("Tube Snatch - YouTube Downloader Server Starting...")
-    logger.info("Starting server on http://127.0.0.1:8000")
-    app.run(debug=True, host='127.0.0.1', port=8000)
+    if '--production' in sys.argv[1:] or os.environ.get('TUBE_SNATCH_ENV') == 'production':
+        run_production_server()
+    else:
+        setup_database()
+        # The debug reloader runs this script twice; only the serving child owns the download workers
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_services()
+        logger.info(f"Starting development server on http://{SERVER_HOST}:{SERVER_PORT}")
+        app.run(debug=True, host=SERVER_HOST, port=SERVER_PORT)